@@ -0,0 +1,145 @@
+"""
+Compare the legacy hand-written address queries (sql/address_view.sql UNION ALL
+sql/user_profile_address_view.sql) with the query compiled from the address
+registry.
+
+Reports the bytes each query would process (via dry runs, which are free) and,
+with --parity, checks that both queries return the same rows. The user profile
+extraction (sql/user_profile_address_view.sql, six passes over participants)
+is also compared on its own with the compiled single scan of participants.
+
+Run from the repository root:
+
+    python benchmarks/address_view_bytes.py [--parity]
+"""
+import os
+import re
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+from google.cloud import bigquery
+import constants
+import sql_compiler
+import address_registry
+from address_registry import ADDRESS_FIELDS
+from utils import logger
+
+# Output columns compared by the parity check; ts_address_delivered is
+# excluded since it is CURRENT_TIMESTAMP() in both queries
+PARITY_COLUMNS = [
+    "Connect_ID",
+    "ts_user_profile_updated",
+    "address_src_question_cid",
+    "address_nickname",
+    "address_source",
+    "historical_order",
+] + ADDRESS_FIELDS
+
+
+def render(query):
+    """
+    Replace the table placeholders and strip the trailing semicolon
+
+    The legacy user profile queries name the cross street columns
+    cross_street1/cross_street2; they are renamed to the registry's
+    cross_street_1/cross_street_2.
+    """
+    query = query.replace('@flat_module4', constants.MODULE_4_TABLE)
+    query = query.replace('@flat_participants', constants.FLAT_PARTICIPANTS_TABLE)
+    query = query.replace('@raw_participants', constants.RAW_PARTICIPANTS_TABLE)
+    query = re.sub(r'\bAS cross_street(\d)\b', r'AS cross_street_\1', query)
+    return query.strip().rstrip(';')
+
+
+def legacy_query(file_names=None):
+    """The hand-written UNION ALL address queries"""
+    if file_names is None:
+        file_names = [constants.ADDRESS_QUERY_SQL, constants.USER_PROFILE_QUERY_SQL]
+    queries = []
+    for file_name in file_names:
+        with open(os.path.join(constants.SQL_DIR, file_name), 'r') as f:
+            queries.append(render(f.read()))
+    return "\nUNION ALL\n".join(queries)
+
+
+def generated_query(table=None):
+    """The address query compiled from the address registry, optionally only for the sources of one table"""
+    sources = address_registry.ADDRESS_SOURCES
+    if table is not None:
+        sources = [source for source in sources if source["table"] == table]
+    return sql_compiler.compile_address_query(sources)
+
+
+def dry_run_bytes(client, query):
+    """Return the number of bytes a query would process"""
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    job = client.query(query, job_config=job_config)
+    return job.total_bytes_processed
+
+
+def count_mismatched_rows(client, query_a, query_b):
+    """
+    Count rows whose multiplicity differs between two address queries
+
+    Rows are compared on PARITY_COLUMNS, by name.
+    """
+    columns_sql = ", ".join(PARITY_COLUMNS)
+    parity_query = f"""
+    WITH a AS (
+        SELECT TO_JSON_STRING(STRUCT({columns_sql})) AS row_key, COUNT(*) AS n
+        FROM ({query_a})
+        GROUP BY row_key
+    ),
+    b AS (
+        SELECT TO_JSON_STRING(STRUCT({columns_sql})) AS row_key, COUNT(*) AS n
+        FROM ({query_b})
+        GROUP BY row_key
+    )
+    SELECT COUNT(*) AS mismatched
+    FROM a
+    FULL OUTER JOIN b USING (row_key)
+    WHERE a.n IS NULL OR b.n IS NULL OR a.n != b.n
+    """
+    job = client.query(parity_query, timeout=constants.QUERY_TIMEOUT)
+    return list(job.result())[0]['mismatched']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--parity', action='store_true',
+                        help='Also run both queries and compare their output (bills both scans)')
+    args = parser.parse_args()
+
+    client = bigquery.Client(project=constants.PROJECT_ID)
+
+    comparisons = [
+        ("Address queries", legacy_query(), generated_query()),
+        ("User profile", legacy_query([constants.USER_PROFILE_QUERY_SQL]), generated_query("participants")),
+    ]
+
+    failed = False
+    for name, legacy, generated in comparisons:
+        legacy_bytes = dry_run_bytes(client, legacy)
+        generated_bytes = dry_run_bytes(client, generated)
+
+        logger.info(f"{name}, legacy UNION ALL queries: {legacy_bytes:,} bytes")
+        logger.info(f"{name}, compiled registry query: {generated_bytes:,} bytes")
+        if generated_bytes:
+            logger.info(f"{name}, reduction: {legacy_bytes / generated_bytes:.1f}x")
+
+        if args.parity:
+            mismatched = count_mismatched_rows(client, legacy, generated)
+            if mismatched:
+                logger.error(f"{name}: parity check failed, {mismatched} rows differ")
+                failed = True
+            else:
+                logger.info(f"{name}: parity check passed, both queries return identical rows")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure address normalization throughput on synthetic addresses.
+
+Generates synthetic address records with the spelling variants seen in the
+source data (suffix and state spellings, unit designators, ZIP+4, stray
+punctuation and case) and reports records per second for:
+
+- normalize_record, one record at a time
+- normalize_column over plain lists, and over pandas/pyarrow columns when installed
+
+Run from the repository root:
+
+    python benchmarks/normalization_benchmark.py [--records 1000000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import normalization
+from utils import logger
+
+STREET_NAMES = ["Main", "Oak", "Maple", "Cedar", "Elm", "Washington", "Lake", "Hill", "Park", "Pine"]
+SUFFIXES = ["St", "St.", "Street", "STREET", "Ave", "Avenue", "Av.", "Rd", "Road", "Blvd", "Boulevard", "Dr", "Drive", "Ln", "Lane"]
+DIRECTIONALS = ["", "", "N ", "N. ", "North ", "S ", "South ", "E ", "West "]
+UNITS = ["", "", "", "Apt 4", "Apt. #12", "#7", "Unit 3B", "Suite 100", "Ste 2"]
+STATES = ["NY", "new york", "MI", "Michigan", "CA", "california", "TX", "Texas", "MN", "minnesota"]
+CITIES = ["Saint Paul", "St. Paul", "Detroit", "Fort Worth", "Ft Worth", "Albany", "Houston", "Oakland"]
+
+
+def synthetic_records(count, seed=0):
+    """Generate synthetic address records"""
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        street_num = str(rng.randint(1, 9999))
+        street = f"{rng.choice(DIRECTIONALS)}{rng.choice(STREET_NAMES)} {rng.choice(SUFFIXES)}"
+        unit = rng.choice(UNITS)
+        zip_code = f"{rng.randint(1000, 99999):05d}"
+        if rng.random() < 0.3:
+            zip_code += f"-{rng.randint(0, 9999):04d}"
+        records.append({
+            "address_line_1": f" {street_num} {street}{', ' + unit if unit else ''} ",
+            "street_num": street_num,
+            "street_name": street,
+            "apartment_num": unit or None,
+            "city": rng.choice(CITIES),
+            "state": rng.choice(STATES),
+            "zip_code": zip_code,
+            "country": rng.choice(["US", "USA", "United States", None]),
+        })
+    return records
+
+
+def report(label, records, seconds):
+    logger.info(f"{label:<28} {records / seconds:>14,.0f} records/s ({seconds:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1_000_000, help="Number of synthetic addresses")
+    args = parser.parse_args()
+
+    records = synthetic_records(args.records)
+    fields = list(records[0].keys())
+    columns = {field: [record[field] for record in records] for field in fields}
+
+    start = time.perf_counter()
+    for record in records:
+        normalization.normalize_record(record)
+    report("normalize_record", len(records), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for field in fields:
+        normalization.normalize_column(columns[field], field)
+    report("normalize_column (list)", len(records), time.perf_counter() - start)
+
+    try:
+        import pandas as pd
+    except ImportError:
+        logger.info("pandas not installed, skipping the pandas benchmark")
+    else:
+        frame = pd.DataFrame(columns)
+        start = time.perf_counter()
+        for field in fields:
+            normalization.normalize_column(frame[field], field)
+        report("normalize_column (pandas)", len(records), time.perf_counter() - start)
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        logger.info("pyarrow not installed, skipping the pyarrow benchmark")
+    else:
+        table = pa.table(columns)
+        start = time.perf_counter()
+        for field in fields:
+            normalization.normalize_column(table[field], field)
+        report("normalize_column (pyarrow)", len(records), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Time every step of the pipeline (main.main) on synthetic cohorts.
+
+For each cohort size a synthetic cohort is generated (see synthetic_cohort.py,
+cached in local/benchmarks/ by size and seed), a fresh local DuckDB pipeline
+database is created and main.main() is run on it. Each pipeline step is timed
+and its wall time, bytes processed (BigQuery backend only) and the process
+peak memory after the step are recorded.
+
+Results are written to a JSON file stamped with the git commit, generator
+version and seed, so runs of different commits on the same sizes and seed can
+be compared:
+
+    python benchmarks/pipeline_benchmark.py [--sizes 10000 100000 1000000] [--runs 2]
+
+--runs 2 runs the pipeline a second time on the same database (without
+resuming), measuring a delivery with nothing new to deliver. --backend bigquery times one run against
+the tables configured in constants.py instead (sizes do not apply).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import datetime
+import functools
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import constants
+import backend
+import main as pipeline_main
+from utils import logger
+import synthetic_cohort
+
+# Pipeline functions main.main() calls, in order
+PIPELINE_STEPS = [
+    "create_required_tables",
+    "create_address_view",
+    "stage_watermarks",
+    "refresh_addresses_table",
+    "backfill_fingerprints",
+    "deliver_new_addresses",
+    "identify_new_addresses",
+    "collapse_near_duplicates",
+    "update_metadata",
+    "export_addresses",
+    "generate_summary_statistics",
+]
+
+BENCHMARK_DIR = os.path.join(os.getcwd(), "local", "benchmarks")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class RecordingClient:
+    """Wrap a BigQuery client, recording the jobs started through it"""
+
+    def __init__(self, client):
+        self._client = client
+        self.jobs = []
+
+    def query(self, *args, **kwargs):
+        job = self._client.query(*args, **kwargs)
+        # Dry runs checking the bytes billed budgets (see instrumentation.py) process nothing
+        job_config = kwargs.get("job_config")
+        if job_config is None or not job_config.dry_run:
+            self.jobs.append(job)
+        return job
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _bytes_processed(jobs):
+    return sum(job.total_bytes_processed or 0 for job in jobs)
+
+
+def run_pipeline(backend_name):
+    """
+    Run main.main() once, timing every pipeline step
+
+    Returns:
+        List of step measurements, in call order
+    """
+    constants.BACKEND = backend_name
+    pipeline = backend.get_backend(backend_name)
+    client = backend.get_client(backend_name)
+    recording = RecordingClient(client) if backend_name == "bigquery" else None
+    steps = []
+
+    def timed(name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            jobs_before = len(recording.jobs) if recording else 0
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                steps.append({
+                    "step": name,
+                    "wall_seconds": round(time.perf_counter() - start, 4),
+                    "bytes_processed": _bytes_processed(recording.jobs[jobs_before:]) if recording else None,
+                    "peak_memory_mb": round(peak_memory_mb(), 1),
+                })
+        return wrapper
+
+    originals = {name: getattr(pipeline, name) for name in PIPELINE_STEPS}
+    original_get_client = backend.get_client
+    try:
+        for name, function in originals.items():
+            setattr(pipeline, name, timed(name, function))
+        backend.get_client = lambda name=None: recording or client
+        pipeline_main.main()
+    finally:
+        for name, function in originals.items():
+            setattr(pipeline, name, function)
+        backend.get_client = original_get_client
+        if backend_name == "duckdb":
+            client.close()
+    return steps
+
+
+def benchmark_size(participants, seed, runs):
+    """Generate (or reuse) a cohort and time the pipeline on a fresh local database"""
+    cohort_dir = os.path.join(BENCHMARK_DIR, f"cohort_v{synthetic_cohort.GENERATOR_VERSION}_{participants}_{seed}")
+    if not os.path.exists(os.path.join(cohort_dir, "module4_v1_JP.parquet")):
+        start = time.perf_counter()
+        synthetic_cohort.generate_cohort(participants, cohort_dir, seed)
+        logger.info(f"Generated {participants} participants in {time.perf_counter() - start:.1f}s")
+
+    run_dir = os.path.join(BENCHMARK_DIR, f"run_{participants}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+
+    constants.LOCAL_SNAPSHOT_DIR = cohort_dir
+    constants.DUCKDB_DATABASE = os.path.join(run_dir, "pipeline.duckdb")
+    constants.LOCAL_EXPORT_DIR = os.path.join(run_dir, "exports")
+    constants.RUN_REPORT_DIR = os.path.join(run_dir, "run_reports")
+    # Later runs measure a delivery with nothing new, not a resumed one
+    constants.RESUME_RUNS = False
+
+    results = []
+    for run in range(1, runs + 1):
+        start = time.perf_counter()
+        steps = run_pipeline("duckdb")
+        results.append({
+            "participants": participants,
+            "run": run,
+            "wall_seconds": round(time.perf_counter() - start, 4),
+            "steps": steps,
+        })
+        logger.info(f"{participants} participants, run {run}: {results[-1]['wall_seconds']:.2f}s")
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(backend_name):
+    """Describe the code and machine a benchmark ran on"""
+    env = {
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    if backend_name == "duckdb":
+        import duckdb
+        env["duckdb"] = duckdb.__version__
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Cohort sizes (participants)")
+    parser.add_argument("--seed", type=int, default=0, help="Cohort random seed")
+    parser.add_argument("--runs", type=int, default=1, help="Pipeline runs per size on the same database")
+    parser.add_argument("--backend", choices=backend.BACKENDS, default="duckdb", help="Execution backend")
+    parser.add_argument("--output", default=None, help="Results file (defaults to benchmarks/results/)")
+    args = parser.parse_args()
+
+    env = environment(args.backend)
+    if args.backend == "bigquery":
+        start = time.perf_counter()
+        steps = run_pipeline("bigquery")
+        results = [{"participants": None, "run": 1,
+                    "wall_seconds": round(time.perf_counter() - start, 4), "steps": steps}]
+    else:
+        results = []
+        for participants in args.sizes:
+            results += benchmark_size(participants, args.seed, args.runs)
+
+    report = {
+        "benchmark": "pipeline",
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "backend": args.backend,
+        "generator_version": synthetic_cohort.GENERATOR_VERSION,
+        "seed": args.seed,
+        "environment": env,
+        "results": results,
+    }
+
+    output = args.output
+    if output is None:
+        commit = (env["git_commit"] or "unknown")[:12]
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"pipeline_{args.backend}_{commit}_{timestamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Benchmark results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
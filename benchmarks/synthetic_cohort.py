@@ -0,0 +1,254 @@
+"""
+Generate a synthetic Connect cohort as Parquet snapshots of the source tables.
+
+Writes participants.parquet and module4_v1_JP.parquet, the snapshots the
+local DuckDB backend reads (see core/duckdb_backend.py), with every column the
+address registry reads:
+
+- participants: eligibility statuses, change timestamps, the current user
+  profile addresses and a d_569151507 address history array of varying length
+- module4_v1_JP: every Module 4 address slot, a few of them filled per
+  participant who completed the module
+
+Addresses are drawn with the spelling variants seen in the source data, and
+history entries often repeat the current address with a different spelling,
+so normalization and near-duplicate collapsing have realistic work to do.
+The output only depends on the participant count and the seed.
+
+Run from the repository root:
+
+    python benchmarks/synthetic_cohort.py --participants 100000 [--output local/snapshots]
+"""
+import os
+import sys
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import pyarrow as pa
+import pyarrow.parquet as pa_parquet
+import constants
+import address_registry
+from utils import logger
+
+# Bump when the generated data changes, so benchmark results of different versions are not compared
+GENERATOR_VERSION = 1
+
+VERIFIED, NOT_VERIFIED = 197316935, 875007964
+NO_DESTRUCTION, DESTRUCTION = 104430631, 353358909
+MODULE4_COMPLETE, MODULE4_INCOMPLETE = 231311385, 972455046
+
+STREET_NAMES = ["Main", "Oak", "Maple", "Cedar", "Elm", "Washington", "Lake", "Hill", "Park", "Pine",
+                "Lincoln", "Jackson", "Franklin", "Highland", "Sunset", "Ridge", "Church", "Mill"]
+SUFFIX_VARIANTS = [["St", "St.", "Street", "STREET"], ["Ave", "Avenue", "Av."], ["Rd", "Road"],
+                   ["Blvd", "Boulevard"], ["Dr", "Drive"], ["Ln", "Lane"], ["Ct", "Court"]]
+UNIT_VARIANTS = ["Apt {}", "Apt. #{}", "#{}", "Unit {}", "Suite {}"]
+CITIES = [("Detroit", "MI", "Michigan"), ("Minneapolis", "MN", "Minnesota"), ("Saint Paul", "MN", "Minnesota"),
+          ("Marshfield", "WI", "Wisconsin"), ("Honolulu", "HI", "Hawaii"), ("Portland", "OR", "Oregon"),
+          ("Atlanta", "GA", "Georgia"), ("Chicago", "IL", "Illinois"), ("Sioux Falls", "SD", "South Dakota"),
+          ("Fargo", "ND", "North Dakota")]
+HISTORY_LENGTH_WEIGHTS = [40, 25, 15, 8, 5, 3, 2, 1, 1]  # Weights of 0..8 history entries
+
+START_DATE = datetime.datetime(2021, 7, 1, tzinfo=datetime.timezone.utc)
+END_DATE = datetime.datetime(2025, 6, 30, tzinfo=datetime.timezone.utc)
+
+
+def _columns(sources):
+    """Source columns read by a list of registry entries, in first-use order"""
+    columns = {}
+    for source in sources:
+        for value in source["fields"].values():
+            for column in [value] if isinstance(value, str) else value:
+                columns.setdefault(column, None)
+    return list(columns)
+
+
+PROFILE_COLUMNS = _columns(address_registry.USER_PROFILE_ADDRESSES)
+MODULE4_COLUMNS = _columns(address_registry.MODULE4_ADDRESS_SLOTS)
+HISTORY_TIMESTAMP = address_registry.USER_PROFILE_HISTORY_TIMESTAMP
+
+HISTORY_TYPE = pa.list_(pa.struct(
+    [(column, pa.string()) for column in PROFILE_COLUMNS] + [(HISTORY_TIMESTAMP, pa.string())]
+))
+PARTICIPANTS_SCHEMA = pa.schema(
+    [
+        ("Connect_ID", pa.string()),
+        ("d_821247024", pa.int64()),  # Verification status
+        ("d_831041022", pa.int64()),  # Data destruction requested
+        ("d_663265240", pa.int64()),  # Module 4 status
+        ("d_371303487", pa.string()),  # User profile updated
+        ("d_914594314", pa.string()),  # Verification status updated
+    ]
+    + [(column, pa.string()) for column in PROFILE_COLUMNS if column != HISTORY_TIMESTAMP]
+    + [(address_registry.USER_PROFILE_HISTORY_ARRAY, HISTORY_TYPE)]
+)
+MODULE4_SCHEMA = pa.schema(
+    [("Connect_ID", pa.string()), ("COMPLETED_TS", pa.string())]
+    + [(column, pa.string()) for column in MODULE4_COLUMNS]
+)
+
+
+def _timestamp(rng, start=START_DATE):
+    seconds = rng.uniform(0, (END_DATE - start).total_seconds())
+    return (start + datetime.timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def random_address(rng):
+    """Draw an address as a dict of address field values"""
+    city, state, state_name = rng.choice(CITIES)
+    zip_code = f"{rng.randint(501, 99950):05d}"
+    return {
+        "street_num": str(rng.randint(1, 19999)),
+        "street_name": rng.choice(STREET_NAMES),
+        "suffix": rng.randrange(len(SUFFIX_VARIANTS)),
+        "unit": str(rng.randint(1, 40)) if rng.random() < 0.2 else None,
+        "city": city,
+        "state": state,
+        "state_name": state_name,
+        "zip_code": zip_code,
+    }
+
+
+def spell(rng, address):
+    """Spell an address drawn by random_address, with random formatting variants"""
+    suffix = rng.choice(SUFFIX_VARIANTS[address["suffix"]])
+    street_name = f"{address['street_name']} {suffix}"
+    unit = rng.choice(UNIT_VARIANTS).format(address["unit"]) if address["unit"] else None
+    zip_code = address["zip_code"]
+    if rng.random() < 0.2:
+        zip_code += f"-{rng.randint(0, 9999):04d}"
+    spelled = {
+        "street_num": address["street_num"],
+        "street_name": street_name if rng.random() < 0.9 else street_name.upper(),
+        "apartment_num": unit,
+        "address_line_1": f"{address['street_num']} {street_name}",
+        "address_line_2": unit,
+        "city": address["city"],
+        "state": address["state"] if rng.random() < 0.8 else address["state_name"],
+        "zip_code": zip_code,
+        "country": rng.choice(["US", "USA", "United States", None]),
+    }
+    return spelled
+
+
+def _profile_values(rng, address_entries):
+    """Fill the user profile columns from (registry entry, address) pairs"""
+    values = {column: None for column in PROFILE_COLUMNS}
+    for entry, address in address_entries:
+        if address is None:
+            continue
+        spelled = spell(rng, address)
+        for field, column in entry["fields"].items():
+            values[column] = spelled.get(field)
+    return values
+
+
+def _participant(rng, connect_id):
+    """Generate one participants row and its module4_v1_JP row (or None)"""
+    verified = rng.random() < 0.95
+    module4_complete = verified and rng.random() < 0.7
+    profile_updated = _timestamp(rng)
+
+    home = random_address(rng)
+    profile = [
+        (address_registry.USER_PROFILE_ADDRESSES[0], home),
+        (address_registry.USER_PROFILE_ADDRESSES[1], random_address(rng) if rng.random() < 0.4 else None),
+        (address_registry.USER_PROFILE_ADDRESSES[2], random_address(rng) if rng.random() < 0.1 else None),
+    ]
+
+    history = []
+    history_length = rng.choices(range(len(HISTORY_LENGTH_WEIGHTS)), weights=HISTORY_LENGTH_WEIGHTS)[0]
+    for _ in range(history_length):
+        # Most updates re-save the same home address, often spelled differently
+        previous = home if rng.random() < 0.6 else random_address(rng)
+        entry = _profile_values(rng, [(address_registry.USER_PROFILE_ADDRESSES[0], previous)])
+        entry[HISTORY_TIMESTAMP] = _timestamp(rng)
+        history.append(entry)
+
+    row = {
+        "Connect_ID": connect_id,
+        "d_821247024": VERIFIED if verified else NOT_VERIFIED,
+        "d_831041022": NO_DESTRUCTION if rng.random() < 0.99 else DESTRUCTION,
+        "d_663265240": MODULE4_COMPLETE if module4_complete else MODULE4_INCOMPLETE,
+        "d_371303487": profile_updated,
+        "d_914594314": _timestamp(rng),
+        address_registry.USER_PROFILE_HISTORY_ARRAY: history,
+    }
+    row.update(_profile_values(rng, profile))
+
+    if not module4_complete:
+        return row, None
+
+    module4 = {column: None for column in MODULE4_COLUMNS}
+    module4["Connect_ID"] = connect_id
+    module4["COMPLETED_TS"] = _timestamp(rng)
+    slots = rng.sample(address_registry.MODULE4_ADDRESS_SLOTS, rng.randint(1, 4))
+    for position, slot in enumerate(slots):
+        # The first slot is usually the current home address
+        spelled = spell(rng, home if position == 0 and rng.random() < 0.7 else random_address(rng))
+        non_us = rng.random() < 0.03
+        for field, columns in slot["fields"].items():
+            if isinstance(columns, str):
+                columns = [columns]
+            # List fields hold the US column first and the non-US fallback second
+            column = columns[-1] if non_us and len(columns) > 1 else columns[0]
+            module4[column] = spelled.get(field)
+    return row, module4
+
+
+def generate_cohort(participants, output_dir=None, seed=0, chunk_size=100_000):
+    """
+    Write synthetic participants and module4_v1_JP snapshots
+
+    Args:
+        participants: Number of participants
+        output_dir: Directory to write the snapshots to (defaults to LOCAL_SNAPSHOT_DIR)
+        seed: Random seed; the same count and seed always give the same data
+        chunk_size: Participants generated and written per row group
+
+    Returns:
+        Dictionary of table name to the number of rows written
+    """
+    if output_dir is None:
+        output_dir = constants.LOCAL_SNAPSHOT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    rng = random.Random(seed)
+    participants_path = os.path.join(output_dir, "participants.parquet")
+    module4_path = os.path.join(output_dir, "module4_v1_JP.parquet")
+    counts = {"participants": 0, "module4": 0}
+
+    with pa_parquet.ParquetWriter(participants_path, PARTICIPANTS_SCHEMA) as participants_writer, \
+            pa_parquet.ParquetWriter(module4_path, MODULE4_SCHEMA) as module4_writer:
+        for start in range(0, participants, chunk_size):
+            participant_rows, module4_rows = [], []
+            for index in range(start, min(start + chunk_size, participants)):
+                row, module4 = _participant(rng, str(100000000 + index))
+                participant_rows.append(row)
+                if module4 is not None:
+                    module4_rows.append(module4)
+
+            participants_writer.write_table(pa.Table.from_pylist(participant_rows, schema=PARTICIPANTS_SCHEMA))
+            module4_writer.write_table(pa.Table.from_pylist(module4_rows, schema=MODULE4_SCHEMA))
+            counts["participants"] += len(participant_rows)
+            counts["module4"] += len(module4_rows)
+
+    logger.info(f"Synthetic cohort written to {output_dir}: {counts['participants']} participants, "
+                f"{counts['module4']} module 4 rows")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=10_000, help="Number of participants")
+    parser.add_argument("--output", default=None, help="Output directory (defaults to LOCAL_SNAPSHOT_DIR)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    generate_cohort(args.participants, args.output, args.seed)
+
+
+if __name__ == "__main__":
+    main()
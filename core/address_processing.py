@@ -1,15 +1,145 @@
 import os
+import json
 import datetime
+import hashlib
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 import constants
-from tabulate import tabulate
 from utils import logger
+import sql_compiler
+import fingerprint
+import normalization
+import reporting
+import scheduler
+import local_export
+import geocodes
+import watermarks
+
+# Columns of the delivered address rows (current delivery and comprehensive
+# tables), with their types
+DELIVERY_COLUMNS = [
+    ("delivery_id", "STRING"),
+    ("delivery_date", "TIMESTAMP"),
+    ("Connect_ID", "STRING"),
+    ("ts_user_profile_updated", "TIMESTAMP"),
+    ("address_src_question_cid", "STRING"),
+    ("address_nickname", "STRING"),
+    ("address_source", "STRING"),
+    ("ts_address_delivered", "TIMESTAMP"),
+    ("historical_order", "INT64"),
+    ("address_line_1", "STRING"),
+    ("address_line_2", "STRING"),
+    ("street_num", "STRING"),
+    ("street_name", "STRING"),
+    ("apartment_num", "STRING"),
+    ("city", "STRING"),
+    ("state", "STRING"),
+    ("zip_code", "STRING"),
+    ("country", "STRING"),
+    ("cross_street_1", "STRING"),
+    ("cross_street_2", "STRING"),
+    ("address_hash", "STRING"),
+    ("address_fingerprint", "INT64"),
+    ("fingerprint_version", "INT64"),
+]
+
+# Columns of the distinct locations of a unique-location export (see
+# map_locations): the normalized address fields of each location and how many
+# delivered addresses share it
+LOCATION_COLUMNS = [
+    ("delivery_id", "STRING"),
+    ("delivery_date", "TIMESTAMP"),
+    ("location_key", "INT64"),
+    ("address_line_1", "STRING"),
+    ("address_line_2", "STRING"),
+    ("street_num", "STRING"),
+    ("street_name", "STRING"),
+    ("apartment_num", "STRING"),
+    ("city", "STRING"),
+    ("state", "STRING"),
+    ("zip_code", "STRING"),
+    ("country", "STRING"),
+    ("cross_street_1", "STRING"),
+    ("cross_street_2", "STRING"),
+    ("address_count", "INT64"),
+    ("participant_count", "INT64"),
+]
+
+# Columns of the location map: every address mapped to a location, either
+# exported for geocoding ('export') or resolved from the geocode cache ('cache')
+LOCATION_MAP_COLUMNS = [
+    ("delivery_id", "STRING"),
+    ("delivery_date", "TIMESTAMP"),
+    ("Connect_ID", "STRING"),
+    ("address_src_question_cid", "STRING"),
+    ("address_nickname", "STRING"),
+    ("address_source", "STRING"),
+    ("historical_order", "INT64"),
+    ("address_hash", "STRING"),
+    ("address_fingerprint", "INT64"),
+    ("fingerprint_version", "INT64"),
+    ("location_key", "INT64"),
+    ("resolution", "STRING"),
+]
+
+# Steps whose completion is recorded in the run state table by the step's own
+# transaction (see _record_step_statement), so a crash can never leave the
+# step done but unrecorded
+TRANSACTIONAL_STEPS = [
+    "identify_new_addresses",
+    "collapse_near_duplicates",
+    "deliver_new_addresses",
+    "update_metadata",
+]
+
+def _table_id(table):
+    """Strip the backticks from a table reference for the client API"""
+    return table.replace('`', '')
+
+def _get_table(client, table):
+    """
+    Get a table, or None if a plan finds it missing
+
+    A plan creates nothing (see instrumentation.py), so on a new dataset the
+    tables a run creates first are missing while it is planned; outside a
+    plan a missing table raises NotFound.
+    """
+    try:
+        return client.get_table(_table_id(table))
+    except NotFound:
+        if getattr(client, 'plan', False):
+            return None
+        raise
+
+def _tables_version(client, tables, *keys):
+    """
+    Version of the contents of tables, from their last-modified times
+
+    Results derived from the tables are labelled with this version, so they are
+    only recomputed once one of the tables has changed. Label updates also bump
+    a table's last-modified time, so this is only used for the source tables,
+    which the pipeline never labels.
+
+    Args:
+        client: BigQuery client
+        tables: Tables the result is derived from
+        *keys: Other inputs of the result, such as the hash of the SQL computing it
+
+    Returns:
+        16 character hex string, usable as a label value
+    """
+    parts = []
+    for table in tables:
+        table = _get_table(client, table)
+        parts.append(table.modified.isoformat() if table is not None else "missing")
+    return hashlib.sha256("|".join(parts + [str(key) for key in keys]).encode('utf-8')).hexdigest()[:16]
 
 def create_required_tables(client):
     """Create required tables if they don't exist"""
     logger.info("Creating required tables if they don't exist")
     
-    # Create metadata table - add address_hash column
+    # Create metadata table - address_fingerprint is the dedup key, address_hash
+    # the legacy key it is mapped from (see fingerprint.py)
     metadata_table = constants.METADATA_TABLE
     metadata_table_query = f"""
     CREATE TABLE IF NOT EXISTS {metadata_table} (
@@ -18,12 +148,16 @@ def create_required_tables(client):
         Connect_ID STRING,
         address_src_question_cid STRING,
         address_nickname STRING,
-        address_hash STRING,  -- Add address_hash column
+        address_hash STRING,
         ts_address_delivered TIMESTAMP,
         address_source STRING,
         historical_order INT64,
-        ts_user_profile_updated TIMESTAMP
+        ts_user_profile_updated TIMESTAMP,
+        address_fingerprint INT64,
+        fingerprint_version INT64
     )
+    PARTITION BY DATE(delivery_date)
+    CLUSTER BY address_fingerprint, Connect_ID
     """
     
     # Create comprehensive table - add the new columns
@@ -49,8 +183,13 @@ def create_required_tables(client):
         zip_code STRING,
         country STRING,
         cross_street_1 STRING,
-        cross_street_2 STRING
+        cross_street_2 STRING,
+        address_hash STRING,
+        address_fingerprint INT64,
+        fingerprint_version INT64
     )
+    PARTITION BY DATE(delivery_date)
+    CLUSTER BY address_fingerprint, Connect_ID
     """
     
     # Create current delivery table - add the new columns
@@ -76,54 +215,252 @@ def create_required_tables(client):
         zip_code STRING,
         country STRING,
         cross_street_1 STRING,
-        cross_street_2 STRING
+        cross_street_2 STRING,
+        address_hash STRING,
+        address_fingerprint INT64,
+        fingerprint_version INT64
     )
     """
     
-    # Execute queries
-    client.query(metadata_table_query, timeout=constants.QUERY_TIMEOUT).result()
-    client.query(comprehensive_query, timeout=constants.QUERY_TIMEOUT).result()
-    client.query(current_delivery_query, timeout=constants.QUERY_TIMEOUT).result()
+    # The current delivery is rewritten with DML (see deliver_new_addresses), so
+    # a table created before fingerprints existed needs their columns
+    current_delivery_columns_query = f"""
+    ALTER TABLE {current_delivery_table}
+        ADD COLUMN IF NOT EXISTS address_hash STRING,
+        ADD COLUMN IF NOT EXISTS address_fingerprint INT64,
+        ADD COLUMN IF NOT EXISTS fingerprint_version INT64
+    """
     
-    logger.info("Required tables created/verified")
-
-def create_address_view(client):
-    """Create or update the address view"""
-    logger.info("Creating/updating address view")
+    # Create watermark table - one row per source table - and the watermark
+    # history table (see watermarks.py)
+    watermark_query, watermark_history_query = watermarks.create_table_statements(
+        constants.WATERMARK_TABLE, constants.WATERMARK_HISTORY_TABLE
+    )
+    
+    # Create collapse map table - one row per near-duplicate collapsed into
+    # another address of the same delivery (see collapse_near_duplicates)
+    collapse_map_table = constants.COLLAPSE_MAP_TABLE
+    collapse_map_query = f"""
+    CREATE TABLE IF NOT EXISTS {collapse_map_table} (
+        delivery_id STRING,
+        delivery_date TIMESTAMP,
+        Connect_ID STRING,
+        address_src_question_cid STRING,
+        address_nickname STRING,
+        address_source STRING,
+        historical_order INT64,
+        address_hash STRING,
+        address_fingerprint INT64,
+        fingerprint_version INT64,
+        representative_address_hash STRING,
+        representative_fingerprint INT64,
+        similarity FLOAT64
+    )
+    PARTITION BY DATE(delivery_date)
+    CLUSTER BY address_fingerprint, Connect_ID
+    """
+    
+    # Create location map table - the location key of every address of a
+    # unique-location export or resolved from the geocode cache, to fan the
+    # geocodes back out (see map_locations and identify_new_addresses)
+    location_map_columns_sql = ",\n        ".join(f"{column} {data_type}" for column, data_type in LOCATION_MAP_COLUMNS)
+    location_map_query = f"""
+    CREATE TABLE IF NOT EXISTS {constants.LOCATION_MAP_TABLE} (
+        {location_map_columns_sql}
+    )
+    PARTITION BY DATE(delivery_date)
+    CLUSTER BY location_key, Connect_ID
+    """
+    
+    # Create current locations table - the distinct locations of the current delivery
+    location_columns_sql = ",\n        ".join(f"{column} {data_type}" for column, data_type in LOCATION_COLUMNS)
+    current_locations_query = f"""
+    CREATE TABLE IF NOT EXISTS {constants.CURRENT_LOCATIONS_TABLE} (
+        {location_columns_sql}
+    )
+    """
     
-    # Get the formatted SQL for both queries separately
-    module4_sql_path = os.path.join(constants.SQL_DIR, constants.ADDRESS_QUERY_SQL)
-    user_profile_sql_path = os.path.join(constants.SQL_DIR, constants.USER_PROFILE_QUERY_SQL)
+    # Create geocode cache table - the latest returned geocode of every location
+    # (see ingest_geocodes)
+    geocode_columns_sql = ",\n        ".join(f"{field} {data_type}" for field, data_type in geocodes.GEOCODE_FIELDS)
+    geocode_cache_query = f"""
+    CREATE TABLE IF NOT EXISTS {constants.GEOCODE_CACHE_TABLE} (
+        location_key INT64,
+        {geocode_columns_sql},
+        geocoded_at TIMESTAMP  -- When the geocode was ingested
+    )
+    CLUSTER BY location_key
+    """
     
-    with open(module4_sql_path, 'r') as f:
-        module4_query = f.read()
+    # Create run stats table - one row per pipeline run (see instrumentation.py)
+    run_stats_table = constants.RUN_STATS_TABLE
+    run_stats_query = f"""
+    CREATE TABLE IF NOT EXISTS {run_stats_table} (
+        run_id STRING,
+        delivery_id STRING,
+        backend STRING,
+        status STRING,
+        error STRING,
+        started_at TIMESTAMP,
+        ended_at TIMESTAMP,
+        wall_seconds FLOAT64,
+        query_count INT64,
+        slot_millis INT64,
+        estimated_bytes_processed INT64,
+        total_bytes_processed INT64,
+        total_bytes_billed INT64,
+        steps ARRAY<STRUCT<
+            step STRING,
+            wall_seconds FLOAT64,
+            query_count INT64,
+            slot_millis INT64,
+            estimated_bytes_processed INT64,
+            total_bytes_processed INT64,
+            total_bytes_billed INT64
+        >>,
+        queries ARRAY<STRUCT<
+            job_id STRING,
+            step STRING,
+            statement_type STRING,
+            state STRING,
+            wall_seconds FLOAT64,
+            slot_millis INT64,
+            estimated_bytes_processed INT64,
+            total_bytes_processed INT64,
+            total_bytes_billed INT64,
+            cache_hit BOOL,
+            rows_affected INT64
+        >>
+    )
+    PARTITION BY DATE(started_at)
+    """
     
-    with open(user_profile_sql_path, 'r') as f:
-        user_profile_query = f.read()
+    # Create summary stats table - the summary statistics of each delivery, as
+    # mergeable rows the all-deliveries report is rolled up from
+    # (see compute_delivery_stats)
+    summary_stats_table = constants.SUMMARY_STATS_TABLE
+    summary_stats_query = f"""
+    CREATE TABLE IF NOT EXISTS {summary_stats_table} (
+        delivery_id STRING,
+        computed_at TIMESTAMP,
+        dimension STRING,  -- total, nickname, source, distribution or completeness
+        value STRING,  -- Nickname, source, addresses per participant or address field
+        address_count INT64,
+        participant_count INT64
+    )
+    CLUSTER BY delivery_id
+    """
     
-    # Replace placeholders
-    module4_query = module4_query.replace('@flat_module4', constants.MODULE_4_TABLE)
-    module4_query = module4_query.replace('@flat_participants', constants.FLAT_PARTICIPANTS_TABLE)
-    module4_query = module4_query.replace('@raw_participants', constants.RAW_PARTICIPANTS_TABLE)
+    # Execute queries - the tables are independent, so they are created concurrently
+    scheduler.run_tasks({
+        name: (scheduler.query_task(client, query), [])
+        for name, query in [
+            ("metadata", metadata_table_query),
+            ("comprehensive", comprehensive_query),
+            ("current_delivery", current_delivery_query),
+            ("watermark", watermark_query),
+            ("watermark_history", watermark_history_query),
+            ("collapse_map", collapse_map_query),
+            ("location_map", location_map_query),
+            ("current_locations", current_locations_query),
+            ("geocode_cache", geocode_cache_query),
+            ("run_stats", run_stats_query),
+            ("summary_stats", summary_stats_query),
+        ]
+    })
+    client.query(current_delivery_columns_query, timeout=constants.QUERY_TIMEOUT).result()
     
-    user_profile_query = user_profile_query.replace('@flat_module4', constants.MODULE_4_TABLE)
-    user_profile_query = user_profile_query.replace('@flat_participants', constants.FLAT_PARTICIPANTS_TABLE)
-    user_profile_query = user_profile_query.replace('@raw_participants', constants.RAW_PARTICIPANTS_TABLE)
+    # Tables created before partitioning was introduced are migrated in place
+    migrate_delivery_tables(client)
     
-    # Defensively strip the ; from the two queries.. 
-    module4_query = module4_query.strip().rstrip(';')
-    user_profile_query = user_profile_query.strip().rstrip(';')
+    logger.info("Required tables created/verified")
 
-    # Create the combined view
-    view_name = constants.ADDRESSES_VIEW
-    combined_query = f"""
-    {module4_query}
-    UNION ALL
-    {user_profile_query}
+def migrate_delivery_tables(client):
     """
+    Migrate unpartitioned delivery tables to the partitioned and clustered layout
 
-    view_query = f"""
-    CREATE OR REPLACE VIEW {view_name} AS
+    The metadata and comprehensive tables are partitioned on delivery_date and
+    clustered on address_fingerprint and Connect_ID, so the dedup join and
+    delivery deletes only read the blocks they touch. BigQuery cannot change
+    the partitioning of an existing table, so a table still using an old
+    layout is copied into a partitioned table which then replaces it. Columns
+    added since a table was created are added first.
+
+    DDL cannot run in a transaction, so the swap is made safe step by step:
+    the copy must hold as many rows as the original, the original is renamed
+    to a backup rather than dropped, and the backup is only dropped once the
+    copy took the original's name. If the copy cannot be renamed, the backup
+    is renamed back.
+
+    Args:
+        client: BigQuery client
+    """
+    clustering_fields = ['address_fingerprint', 'Connect_ID']
+    added_columns = {
+        'address_hash': 'STRING',
+        'address_fingerprint': 'INT64',
+        'fingerprint_version': 'INT64',
+    }
+
+    for table_name in [constants.METADATA_TABLE, constants.COMPREHENSIVE_TABLE]:
+        table = _get_table(client, table_name)
+        if table is None or (table.time_partitioning is not None and table.clustering_fields == clustering_fields):
+            continue
+
+        logger.info(f"Migrating {table_name} to a partitioned and clustered table ({table.num_rows} rows)")
+
+        # Older tables lack the hash and fingerprint columns to cluster on
+        columns = [field.name for field in table.schema]
+        add_column_sql = "\n        ".join(
+            f"ALTER TABLE {table_name} ADD COLUMN {column} {data_type};"
+            for column, data_type in added_columns.items()
+            if column not in columns
+        )
+
+        migrated_table = f"`{table.project}.{table.dataset_id}.{table.table_id}_partitioned`"
+        backup_id = f"{table.table_id}_backup"
+        backup_table = f"`{table.project}.{table.dataset_id}.{backup_id}`"
+        copy_query = f"""
+        {add_column_sql}
+
+        CREATE OR REPLACE TABLE {migrated_table}
+        PARTITION BY DATE(delivery_date)
+        CLUSTER BY address_fingerprint, Connect_ID
+        AS
+        SELECT * FROM {table_name};
+
+        ASSERT (SELECT COUNT(*) FROM {migrated_table}) = (SELECT COUNT(*) FROM {table_name})
+            AS 'The partitioned copy of {table_name} does not hold all its rows; the table was left as it is';
+        """
+        job = client.query(copy_query, timeout=constants.QUERY_TIMEOUT)
+        job.result()
+
+        client.query(f"ALTER TABLE {table_name} RENAME TO {backup_id}", timeout=constants.QUERY_TIMEOUT).result()
+        try:
+            client.query(f"ALTER TABLE {migrated_table} RENAME TO {table.table_id}",
+                         timeout=constants.QUERY_TIMEOUT).result()
+        except Exception:
+            logger.error(f"Could not rename the partitioned copy of {table_name}, restoring it from {backup_table}")
+            client.query(f"ALTER TABLE {backup_table} RENAME TO {table.table_id}",
+                         timeout=constants.QUERY_TIMEOUT).result()
+            raise
+
+        client.query(f"DROP TABLE {backup_table}", timeout=constants.QUERY_TIMEOUT).result()
+        logger.info(f"Migrated {table_name} ({job.total_bytes_processed} bytes processed)")
+
+def deploy_normalization_udfs(client):
+    """Create or update the address normalization UDFs the address view fingerprints with"""
+    statements = normalization.sql_udf_statements(constants.NORMALIZATION_UDF_DATASET)
+    job = client.query(";\n\n".join(statements), timeout=constants.QUERY_TIMEOUT)
+    job.result()
+    logger.info(f"Deployed {len(statements)} normalization UDFs to {constants.NORMALIZATION_UDF_DATASET}")
+
+def _address_view_body():
+    """Query of the address view, standardizing and fingerprinting the compiled address query"""
+    # The address query is compiled from the address registry, one scan per source table
+    combined_query = sql_compiler.get_address_query()
+
+    return f"""
     -- Create a common table expression (CTE) for address standardization
     WITH standardized_addresses AS (
         SELECT
@@ -150,48 +487,78 @@ def create_address_view(client):
             NULLIF(TRIM(CAST(cross_street_1 AS STRING)), '') AS cross_street_1,
             NULLIF(TRIM(CAST(cross_street_2 AS STRING)), '') AS cross_street_2
         FROM (
-            -- Insert your existing combined query here (module4_query UNION ALL user_profile_query)
+            -- Compiled address query (see address_registry.py)
             {combined_query}
         ) subquery
-    )
+    ),
 
-    -- Main view definition
-    SELECT *,
-    -- Add a computed hash field to help with deduplication
-    TO_HEX(MD5(CONCAT(
-        IFNULL(Connect_ID, ''),
-        IFNULL(address_src_question_cid, ''),
-        IFNULL(address_nickname, ''),
-        IFNULL(address_source, ''),
-        IFNULL(address_line_1, ''),
-        IFNULL(address_line_2, ''),
-        IFNULL(street_num, ''),
-        IFNULL(street_name, ''),
-        IFNULL(apartment_num, ''),
-        IFNULL(city, ''),
-        IFNULL(state, ''),
-        IFNULL(zip_code, ''),
-        IFNULL(country, ''),
-        IFNULL(cross_street_1, ''),
-        IFNULL(cross_street_2, '')
-    ))) AS address_hash
-    FROM standardized_addresses
-    WHERE
     -- Only include records with at least one address field populated
-    (
-        address_line_1 IS NOT NULL OR
-        address_line_2 IS NOT NULL OR
-        street_num IS NOT NULL OR
-        street_name IS NOT NULL OR
-        apartment_num IS NOT NULL OR
-        city IS NOT NULL OR
-        state IS NOT NULL OR
-        zip_code IS NOT NULL OR
-        country IS NOT NULL OR
-        cross_street_1 IS NOT NULL OR
-        cross_street_2 IS NOT NULL
+    populated_addresses AS (
+        SELECT
+            *,
+            -- Digest of the delimiter-safe serialization of the normalized fields (see fingerprint.py)
+            MD5({fingerprint.sql_canonical_expression()}) AS fingerprint_digest
+        FROM standardized_addresses
+        WHERE
+            address_line_1 IS NOT NULL OR
+            address_line_2 IS NOT NULL OR
+            street_num IS NOT NULL OR
+            street_name IS NOT NULL OR
+            apartment_num IS NOT NULL OR
+            city IS NOT NULL OR
+            state IS NOT NULL OR
+            zip_code IS NOT NULL OR
+            country IS NOT NULL OR
+            cross_street_1 IS NOT NULL OR
+            cross_street_2 IS NOT NULL
     )
+
+    -- Main view definition
+    SELECT * EXCEPT (fingerprint_digest),
+    -- Legacy (version 1) hex hash, kept so delivered addresses recorded before
+    -- fingerprints existed can be mapped to their fingerprint
+    {fingerprint.sql_legacy_hash_expression()} AS address_hash,
+    -- Compact INT64 fingerprint used as the dedup join key
+    {fingerprint.sql_digest_to_fingerprint('fingerprint_digest')} AS address_fingerprint,
+    {fingerprint.FINGERPRINT_VERSION} AS fingerprint_version
+    FROM populated_addresses
+    """
+
+def _address_view_ddl_hash(view_body):
+    """Hash of the address view query and of the normalization UDFs it uses, labelling the view"""
+    # The fingerprint is computed over normalized address fields (see normalization.py)
+    udf_statements = normalization.sql_udf_statements(constants.NORMALIZATION_UDF_DATASET)
+    return hashlib.sha256("\n".join(udf_statements + [view_body]).encode('utf-8')).hexdigest()[:16]
+
+def create_address_view(client):
     """
+    Create or update the address view and the normalization UDFs it uses
+
+    The view is labelled with a hash of its DDL and of the UDFs. When the
+    rendered DDL matches the deployed view nothing is run, so BigQuery keeps
+    its cached results for the view.
+
+    Args:
+        client: BigQuery client
+    """
+    view_name = constants.ADDRESSES_VIEW
+    view_body = _address_view_body()
+    ddl_hash = _address_view_ddl_hash(view_body)
+    try:
+        if client.get_table(_table_id(view_name)).labels.get('ddl_hash') == ddl_hash:
+            logger.info(f"Address view {view_name} is up to date")
+            return
+    except NotFound:
+        pass
+
+    logger.info("Creating/updating address view")
+    deploy_normalization_udfs(client)
+
+    view_query = f"""
+    CREATE OR REPLACE VIEW {view_name}
+    OPTIONS (labels = [('ddl_hash', '{ddl_hash}')])
+    AS
+    {view_body}"""
 
     # Save the query for debugging
     debug_dir = os.path.join(os.getcwd(), 'debug')
@@ -204,6 +571,14 @@ def create_address_view(client):
     
     # Execute the query
     try:
+        # Estimate a full scan of the new view before deploying it: after a
+        # view change the addresses table is rebuilt from it, so a run under a
+        # bytes billed budget stops here on a costly edit (see instrumentation.py)
+        estimate_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        estimate = client.query(f"SELECT * FROM ({view_body})", job_config=estimate_config,
+                                timeout=constants.QUERY_TIMEOUT)
+        logger.info(f"Reading the new address view processes {estimate.total_bytes_processed} bytes")
+
         job_config = bigquery.QueryJobConfig()
         job = client.query(view_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
         job.result()
@@ -213,82 +588,488 @@ def create_address_view(client):
         logger.info("Check the debug file for the SQL query that failed")
         raise
 
-def identify_new_addresses(client, delivery_id):
-    """Identify new addresses that haven't been delivered yet"""
-    logger.info(f"Identifying new addresses for delivery ID: {delivery_id}")
-    
-    metadata_table = constants.METADATA_TABLE
-    addresses_view = constants.ADDRESSES_VIEW
-    current_delivery_table = constants.CURRENT_DELIVERY_TABLE
-    
-    # Since address_hash already exists in the view, use it directly
-    find_query = f"""
-    WITH already_delivered_hashes AS (
-      SELECT DISTINCT address_hash
-      FROM {metadata_table}
-    )
-    
-    SELECT
-      a.*,
-      @delivery_id AS delivery_id,
-      CURRENT_TIMESTAMP() AS delivery_date
-    FROM {addresses_view} a
-    LEFT JOIN already_delivered_hashes d
-      ON a.address_hash = d.address_hash
-    WHERE d.address_hash IS NULL
+def _changed_participants_query():
     """
-    
+    Query returning the participants changed since the committed watermarks
+
+    Uses the @lookback_hours query parameter (see _watermark_parameters).
+    """
+    since = {
+        source_name: f"""(
+            SELECT TIMESTAMP_SUB(high_water_mark, INTERVAL @lookback_hours HOUR)
+            FROM {constants.WATERMARK_TABLE}
+            WHERE source_name = '{source_name}'
+        )"""
+        for source_name in sql_compiler.source_tables()
+    }
+    return sql_compiler.compile_changed_participants_query(since)
+
+def _watermark_parameters():
+    """Query parameters used by _changed_participants_query"""
+    return [
+        bigquery.ScalarQueryParameter("lookback_hours", "INT64", constants.WATERMARK_LOOKBACK_HOURS)
+    ]
+
+def stage_watermarks(client, delivery_id):
+    """
+    Record the current high-water mark of every source table as pending for a delivery
+
+    The marks are taken before any addresses are extracted, so source rows that
+    change while the pipeline runs are picked up again by the next run. They
+    only take effect once commit_watermarks() is called for the same delivery.
+
+    Computing the marks scans the change columns of every source table. The
+    watermark table is labelled with the version of the source tables the
+    marks were computed from; while the sources are unmodified, the marks
+    staged last are staged again instead.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery the watermarks belong to
+    """
+    logger.info(f"Staging source watermarks for delivery ID: {delivery_id}")
+
+    watermark_table = constants.WATERMARK_TABLE
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)
         ]
     )
-    
-    # Run query to find new addresses
-    temp_table_id = f"{constants.PROJECT_ID}.{constants.TARGET_DATASET_ID}.temp_new_addresses_{delivery_id.replace('-', '_').lower()}"
-    
-    # Use destination table to store results
-    job_config.destination = temp_table_id
-    job_config.write_disposition = "WRITE_TRUNCATE"
-    
-    # Save the query for debugging
-    debug_dir = os.path.join(os.getcwd(), 'debug')
-    os.makedirs(debug_dir, exist_ok=True)
-    
-    with open(os.path.join(debug_dir, 'identify_new_addresses_query.sql'), 'w') as f:
-        f.write(find_query)
-    
-    logger.info(f"SQL query saved to {os.path.join(debug_dir, 'identify_new_addresses_query.sql')} for debugging")
-    
-    job = client.query(find_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+
+    high_water_marks_query = sql_compiler.compile_high_water_marks_query()
+    source_version = _tables_version(
+        client, sql_compiler.source_tables().values(),
+        hashlib.sha256(high_water_marks_query.encode('utf-8')).hexdigest()
+    )
+    table = _get_table(client, watermark_table)
+    if table is not None and table.labels.get('source_version') == source_version:
+        # The marks staged last were computed from the same source rows; they
+        # are still pending, or were committed by the delivery they were staged for
+        restage_query = f"""
+        UPDATE {watermark_table}
+        SET
+            pending_high_water_mark = COALESCE(pending_high_water_mark, high_water_mark),
+            pending_delivery_id = @delivery_id,
+            updated_at = CURRENT_TIMESTAMP()
+        WHERE TRUE
+        """
+        client.query(restage_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+        logger.info("Source tables unchanged since the watermarks were last staged")
+        return
+
+    stage_query = f"""
+    MERGE {watermark_table} w
+    USING (
+        {high_water_marks_query}
+    ) s
+    ON w.source_name = s.source_name
+    WHEN MATCHED THEN UPDATE SET
+        pending_high_water_mark = s.high_water_mark,
+        pending_delivery_id = @delivery_id,
+        updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (
+        source_name, high_water_mark, pending_high_water_mark, pending_delivery_id, updated_at
+    ) VALUES (
+        s.source_name, NULL, s.high_water_mark, @delivery_id, CURRENT_TIMESTAMP()
+    )
+    """
+    client.query(stage_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+
+    table = _get_table(client, watermark_table)
+    if table is None:
+        return
+    table.labels = {**table.labels, 'source_version': source_version}
+    client.update_table(table, ['labels'])
+
+def commit_watermarks(client, delivery_id):
+    """
+    Advance the watermarks staged for a delivery
+
+    Must only be called once the delivery's metadata has been written. All
+    sources advance together in one transaction, which also records the
+    watermarks they advanced from (see delete_delivery).
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery whose staged watermarks to commit
+    """
+    _run_transaction(
+        client, _commit_watermarks_statements(),
+        [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)]
+    )
+    logger.info(f"Committed source watermarks for delivery ID: {delivery_id}")
+
+def _commit_watermarks_statements():
+    """
+    Statements advancing the watermarks staged for the @delivery_id query
+    parameter, recording the watermarks they advance from in the watermark
+    history table
+    """
+    return watermarks.commit_statements(constants.WATERMARK_TABLE, constants.WATERMARK_HISTORY_TABLE)
+
+def refresh_addresses_table(client, full_rebuild=False):
+    """
+    Refresh the materialized addresses table from the address view
+
+    Incremental refreshes only recompute the addresses of participants whose
+    source rows changed since the committed watermarks: their rows are
+    replaced with a single MERGE. The table is rebuilt from scratch when
+    full_rebuild is set, when it does not exist yet or when the view
+    definition changed since it was built. While the source tables are
+    unmodified since the last refresh the table is left as it is.
+
+    Args:
+        client: BigQuery client
+        full_rebuild: If True, rebuild the whole table instead of merging changes
+    """
+    addresses_table = constants.ADDRESSES_TABLE
+    addresses_view = constants.ADDRESSES_VIEW
+
+    # The table is labelled with a hash of the view it was built from, so a
+    # changed registry or standardization triggers a rebuild. The view is read
+    # once create_address_view() deployed it; a plan deploys nothing, so while
+    # the view is missing or out of date the compiled view query is read instead
+    view_body = _address_view_body()
+    view = _get_table(client, addresses_view)
+    if view is not None and view.labels.get('ddl_hash') == _address_view_ddl_hash(view_body):
+        view_definition = view.view_query
+        view_source = addresses_view
+    else:
+        view_definition = view_body
+        view_source = f"({view_body})"
+    view_hash = hashlib.sha256(view_definition.encode('utf-8')).hexdigest()[:16]
+    source_version = _tables_version(client, sql_compiler.source_tables().values(), view_hash)
+
+    try:
+        table = client.get_table(_table_id(addresses_table))
+        if table.table_type == 'VIEW':
+            # addresses_all used to be a logical view; replace it with the table
+            logger.info(f"Dropping legacy view {addresses_table}")
+            client.delete_table(table)
+            full_rebuild = True
+        elif table.labels.get('view_hash') != view_hash:
+            logger.info("Address view changed since the last refresh, rebuilding addresses table")
+            full_rebuild = True
+        elif not full_rebuild and table.labels.get('source_version') == source_version:
+            logger.info("Source tables unchanged since the last refresh of the addresses table")
+            return
+    except NotFound:
+        full_rebuild = True
+
+    if full_rebuild:
+        logger.info(f"Rebuilding addresses table {addresses_table}")
+        rebuild_query = f"""
+        CREATE OR REPLACE TABLE {addresses_table}
+        PARTITION BY DATE(ts_ingested)
+        CLUSTER BY address_fingerprint, Connect_ID
+        AS
+        SELECT a.*, CURRENT_TIMESTAMP() AS ts_ingested
+        FROM {view_source} a
+        """
+        client.query(rebuild_query, timeout=constants.QUERY_TIMEOUT).result()
+
+        table = _get_table(client, addresses_table)
+        if table is None:
+            return
+        table.labels = {'view_hash': view_hash, 'source_version': source_version}
+        client.update_table(table, ['labels'])
+        logger.info(f"Addresses table rebuilt with {table.num_rows} rows")
+        return
+
+    # Replace the rows of every participant changed since the committed watermarks
+    merge_query = f"""
+    DECLARE changed_ids ARRAY<STRING> DEFAULT (
+        SELECT IFNULL(ARRAY_AGG(DISTINCT Connect_ID), [])
+        FROM (
+            {_changed_participants_query()}
+        )
+    );
+
+    MERGE {addresses_table} t
+    USING (
+        SELECT a.*, CURRENT_TIMESTAMP() AS ts_ingested
+        FROM {view_source} a
+        WHERE a.Connect_ID IN UNNEST(changed_ids)
+    ) s
+    ON FALSE
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT ROW
+    WHEN NOT MATCHED BY SOURCE AND t.Connect_ID IN UNNEST(changed_ids) THEN
+        DELETE;
+
+    SELECT ARRAY_LENGTH(changed_ids) AS changed_participants;
+    """
+
+    job_config = bigquery.QueryJobConfig(query_parameters=_watermark_parameters())
+    job = client.query(merge_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+    changed = list(job.result())[0]['changed_participants']
+    logger.info(f"Addresses table refreshed for {changed} changed participants")
+
+    table = client.get_table(_table_id(addresses_table))
+    table.labels = {**table.labels, 'source_version': source_version}
+    client.update_table(table, ['labels'])
+
+def backfill_fingerprints(client):
+    """
+    Map delivered addresses to the current fingerprint version
+
+    Metadata written before fingerprints existed, or with an older fingerprint
+    version, is matched to the materialized addresses through the legacy
+    address_hash and given the current fingerprint, so previously delivered
+    addresses keep deduplicating. The metadata table is labelled with the
+    version it was mapped to, so this is a no-op once it is up to date.
+
+    Args:
+        client: BigQuery client
+    """
+    metadata_table = constants.METADATA_TABLE
+    version = str(fingerprint.FINGERPRINT_VERSION)
+
+    # A plan on a new dataset has no delivered addresses to map
+    table = _get_table(client, metadata_table)
+    if table is None or table.labels.get('fingerprint_version') == version:
+        return
+
+    logger.info(f"Mapping delivered addresses to fingerprint version {version}")
+
+    backfill_query = f"""
+    UPDATE {metadata_table} m
+    SET
+        address_fingerprint = a.address_fingerprint,
+        fingerprint_version = a.fingerprint_version
+    FROM (
+        SELECT
+            address_hash,
+            ANY_VALUE(address_fingerprint) AS address_fingerprint,
+            ANY_VALUE(fingerprint_version) AS fingerprint_version
+        FROM {constants.ADDRESSES_TABLE}
+        GROUP BY address_hash
+    ) a
+    WHERE m.address_hash = a.address_hash
+      AND (m.fingerprint_version IS NULL OR m.fingerprint_version < a.fingerprint_version)
+    """
+
+    # Collapsed near-duplicates reference both their own and their representative's fingerprint
+    collapse_backfill_query = f"""
+    UPDATE {constants.COLLAPSE_MAP_TABLE} c
+    SET
+        address_fingerprint = a.address_fingerprint,
+        fingerprint_version = a.fingerprint_version,
+        representative_fingerprint = r.address_fingerprint
+    FROM (
+        SELECT address_hash, ANY_VALUE(address_fingerprint) AS address_fingerprint,
+            ANY_VALUE(fingerprint_version) AS fingerprint_version
+        FROM {constants.ADDRESSES_TABLE}
+        GROUP BY address_hash
+    ) a,
+    (
+        SELECT address_hash, ANY_VALUE(address_fingerprint) AS address_fingerprint
+        FROM {constants.ADDRESSES_TABLE}
+        GROUP BY address_hash
+    ) r
+    WHERE c.address_hash = a.address_hash
+      AND c.representative_address_hash = r.address_hash
+      AND (c.fingerprint_version IS NULL OR c.fingerprint_version < a.fingerprint_version)
+    """
+
+    # The two tables are updated independently
+    jobs = scheduler.run_tasks({
+        "metadata": (scheduler.query_task(client, backfill_query), []),
+        "collapse_map": (scheduler.query_task(client, collapse_backfill_query), []),
+    })
+    logger.info(f"Mapped {jobs['metadata'].num_dml_affected_rows} delivered addresses to their fingerprint")
+    logger.info(f"Mapped {jobs['collapse_map'].num_dml_affected_rows} collapsed addresses to their fingerprint")
+
+    table.labels = {**table.labels, 'fingerprint_version': version}
+    client.update_table(table, ['labels'])
+
+def refresh_delivered_fingerprints(client):
+    """
+    Cache the fingerprints of every delivered address in DELIVERED_FINGERPRINTS_TABLE
+
+    Delivered addresses are those in the metadata table, and the near-duplicates
+    collapsed into an address of the same delivery. The table holds each
+    fingerprint once, clustered on it. Every recorded delivery appends its
+    fingerprints in the transaction recording it (see _record_delivery_statements),
+    so the table is only rebuilt when it is not labelled with the current
+    fingerprint version: when it is new, the fingerprint version changed or
+    delete_delivery() removed the label.
+
+    Args:
+        client: BigQuery client
+    """
+    delivered_table = constants.DELIVERED_FINGERPRINTS_TABLE
+    metadata_table = constants.METADATA_TABLE
+    collapse_map_table = constants.COLLAPSE_MAP_TABLE
+
+    version = str(fingerprint.FINGERPRINT_VERSION)
+    try:
+        if client.get_table(_table_id(delivered_table)).labels.get('fingerprint_version') == version:
+            logger.info("The delivered fingerprints are up to date")
+            return
+    except NotFound:
+        pass
+
+    rebuild_query = f"""
+    CREATE OR REPLACE TABLE {delivered_table}
+    CLUSTER BY address_fingerprint
+    OPTIONS (labels = [('fingerprint_version', '{version}')])
+    AS
+    SELECT address_fingerprint
+    FROM {metadata_table}
+    WHERE address_fingerprint IS NOT NULL
+
+    UNION DISTINCT
+
+    -- Near-duplicates collapsed into an address delivered in the same delivery
+    SELECT c.address_fingerprint
+    FROM {collapse_map_table} c
+    JOIN {metadata_table} m
+      ON m.delivery_id = c.delivery_id
+      AND m.address_fingerprint = c.representative_fingerprint
+    """
+    job = client.query(rebuild_query, timeout=constants.QUERY_TIMEOUT)
     job.result()
-    
-    # Step 2: Create the final table using the temp table (without parameters)
-    create_query = f"""
-    CREATE OR REPLACE TABLE {current_delivery_table} AS
-    SELECT * FROM `{temp_table_id}`
+    logger.info(f"Cached delivered fingerprints ({job.total_bytes_processed} bytes processed)")
+
+def _new_addresses_query():
     """
+    Query selecting the addresses of changed participants that haven't been delivered yet
+
+    Reads the delivered fingerprints cached by refresh_delivered_fingerprints().
+    Uses the @delivery_id and watermark query parameters (see _watermark_parameters).
+
+    Only the changes recorded by address_registry.CHANGE_TIMESTAMP_COLUMNS make
+    a participant changed. An eligibility flag changing without one of them
+    (such as the data destruction flag being cleared) is not seen until the
+    participant changes otherwise; clear the watermarks to check everyone again.
+    A participant becoming ineligible is safe: their rows are recomputed, and
+    dropped, before their addresses are checked again.
+    """
+    addresses_table = constants.ADDRESSES_TABLE
+    
+    # Only participants changed since the committed watermarks can have new
+    # addresses. Read the materialized addresses; ts_address_delivered was
+    # frozen when the row was materialized, so stamp it with this delivery's time
+    return f"""
+    WITH changed_participants AS (
+      {_changed_participants_query()}
+    ),
+
+    candidates AS (
+      SELECT *
+      FROM {addresses_table}
+      WHERE Connect_ID IN (SELECT Connect_ID FROM changed_participants)
+    ),
+
+    -- Only look up the candidates' fingerprints, so the scan of the delivered
+    -- fingerprints is pruned to the address_fingerprint clusters that can match
+    already_delivered AS (
+      SELECT address_fingerprint
+      FROM {constants.DELIVERED_FINGERPRINTS_TABLE}
+      WHERE address_fingerprint IN (SELECT address_fingerprint FROM candidates)
+    )
     
-    client.query(create_query, timeout=constants.QUERY_TIMEOUT).result()
-    
-    # Clean up the temporary table
-    client.delete_table(temp_table_id, not_found_ok=True)
-    
-    # Count the new addresses
-    count_query = f"SELECT COUNT(*) as count FROM {current_delivery_table}"
-    count_job = client.query(count_query, timeout=constants.QUERY_TIMEOUT)
-    result = list(count_job.result())[0]
-    count = result['count']
-    
-    logger.info(f"Found {count} new addresses")
-    return count
+    SELECT
+      a.* EXCEPT (ts_ingested) REPLACE (CURRENT_TIMESTAMP() AS ts_address_delivered),
+      @delivery_id AS delivery_id,
+      CURRENT_TIMESTAMP() AS delivery_date
+    FROM candidates a
+    LEFT JOIN already_delivered d
+      ON a.address_fingerprint = d.address_fingerprint
+    WHERE d.address_fingerprint IS NULL
+    """
 
-def update_metadata(client, delivery_id):
-    """Update metadata and comprehensive tables with new addresses"""
-    logger.info(f"Updating metadata for delivery ID: {delivery_id}")
+def _with_location_key_query(source):
+    """Query selecting every row of source (a table or subquery) with the location key of its address"""
+    canonical_sql = fingerprint.sql_canonical_expression(fields=fingerprint.LOCATION_FIELDS)
+    return f"""
+    SELECT * EXCEPT (location_digest), {fingerprint.sql_digest_to_fingerprint('location_digest')} AS location_key
+    FROM (
+        SELECT *, MD5({canonical_sql}) AS location_digest
+        FROM {source}
+    )
+    """
+
+def _insert_location_map_statement(source, resolution):
+    """INSERT recording the delivered addresses of source, with their location keys, in the location map"""
+    columns_str = ", ".join(column for column, _ in LOCATION_MAP_COLUMNS)
+    select_str = ", ".join(column for column, _ in LOCATION_MAP_COLUMNS[:-1])
+    return f"""
+    INSERT INTO {constants.LOCATION_MAP_TABLE} ({columns_str})
+    SELECT {select_str}, '{resolution}' AS resolution
+    FROM {source}
+    """
+
+def _resolve_cached_geocodes_statements():
+    """
+    Statements resolving the current delivery's addresses from the geocode cache
+
+    New addresses at a location the geocode cache holds are recorded in the
+    location map as resolved from the cache and removed from the current
+    delivery, so they are not geocoded again. They are not recorded as
+    delivered, so they are resolved again if their participant changes. The
+    number of resolved addresses is kept in the cached_count script variable,
+    and new_address_count is reduced by it.
+    """
+    current_delivery_table = constants.CURRENT_DELIVERY_TABLE
+    return [
+        f"""
+    -- Rerunning a delivery resolves its addresses again
+    DELETE FROM {constants.LOCATION_MAP_TABLE}
+    WHERE delivery_id = @delivery_id AND resolution = 'cache'
+    """,
+        f"""
+    CREATE TEMP TABLE cache_hits AS
+    SELECT a.*
+    FROM ({_with_location_key_query(current_delivery_table)}) a
+    WHERE a.location_key IN (SELECT location_key FROM {constants.GEOCODE_CACHE_TABLE})
+    """,
+        _insert_location_map_statement('cache_hits', 'cache'),
+        "SET cached_count = @@row_count",
+        f"""
+    DELETE FROM {current_delivery_table}
+    WHERE address_fingerprint IN (SELECT address_fingerprint FROM cache_hits)
+    """,
+        "SET new_address_count = new_address_count - cached_count",
+    ]
+
+def _replace_current_delivery_statements():
+    """
+    Statements replacing the current delivery with the new addresses
+
+    The current delivery table is emptied and refilled with DML, which unlike
+    CREATE OR REPLACE TABLE can run inside a transaction. With
+    RESOLVE_CACHED_GEOCODES, addresses the geocode cache resolves are taken
+    out again (see _resolve_cached_geocodes_statements). The number of new
+    addresses is kept in the new_address_count script variable.
+    """
+    current_delivery_table = constants.CURRENT_DELIVERY_TABLE
+    columns_str = ", ".join(column for column, _ in DELIVERY_COLUMNS)
+    select_str = ", ".join(f"CAST({column} AS {data_type}) AS {column}" for column, data_type in DELIVERY_COLUMNS)
     
+    return [
+        f"DELETE FROM {current_delivery_table} WHERE TRUE",
+        f"""
+    INSERT INTO {current_delivery_table} (
+      {columns_str}
+    )
+    SELECT
+      {select_str}
+    FROM (
+    {_new_addresses_query()}
+    )
+    """,
+        "SET new_address_count = @@row_count",
+    ] + (_resolve_cached_geocodes_statements() if constants.RESOLVE_CACHED_GEOCODES else [])
+
+def _record_delivery_statements():
+    """
+    Statements recording the current delivery in the metadata and comprehensive
+    tables, adding its fingerprints to the delivered fingerprints and advancing
+    the watermarks staged for it
+    """
     metadata_table = constants.METADATA_TABLE
-    comprehensive_table = constants.COMPREHENSIVE_TABLE
     current_delivery_table = constants.CURRENT_DELIVERY_TABLE
     
     # Insert into metadata table - include all fields
@@ -303,7 +1084,9 @@ def update_metadata(client, delivery_id):
       ts_address_delivered,
       address_source,
       historical_order,
-      ts_user_profile_updated
+      ts_user_profile_updated,
+      address_fingerprint,
+      fingerprint_version
     )
     SELECT 
       delivery_id,
@@ -315,42 +1098,18 @@ def update_metadata(client, delivery_id):
       ts_address_delivered,
       address_source,
       historical_order,
-      ts_user_profile_updated
+      ts_user_profile_updated,
+      address_fingerprint,
+      fingerprint_version
     FROM {current_delivery_table}
     """
     
-    # Get the schema of the comprehensive table
-    schema_query = f"SELECT column_name, data_type FROM `{constants.PROJECT_ID}`.{constants.TARGET_DATASET_ID}.INFORMATION_SCHEMA.COLUMNS WHERE table_name = '{constants.COMPREHENSIVE_TABLE.replace('`', '').split('.')[-1]}' ORDER BY ordinal_position"
-    schema_job = client.query(schema_query, timeout=constants.QUERY_TIMEOUT)
-    
-    # Build the column list with explicit CAST statements if needed
-    column_list = []
-    select_list = []
-    
-    for row in schema_job.result():
-        column_name = row.column_name
-        column_list.append(column_name)
-        
-        # Check if the column exists in current_delivery_table
-        if column_name in ["delivery_id", "delivery_date", "Connect_ID", "ts_user_profile_updated",
-                          "address_src_question_cid", "address_nickname", "address_source",
-                          "ts_address_delivered", "historical_order", "address_hash",
-                          "address_line_1", "address_line_2", "street_num", "street_name", 
-                          "apartment_num", "city", "state", "zip_code", "country", 
-                          "cross_street_1", "cross_street_2"]:
-            # Add proper CAST to ensure type compatibility
-            select_list.append(f"CAST({column_name} AS {row.data_type}) AS {column_name}")
-        else:
-            # For columns not in current_delivery_table, use NULL with proper casting
-            select_list.append(f"CAST(NULL AS {row.data_type}) AS {column_name}")
-    
-    # Create the column list strings for the query
-    columns_str = ", ".join(column_list)
-    select_str = ", ".join(select_list)
-    
-    # Insert into comprehensive table with explicit column lists and type casting
+    # Insert into comprehensive table with explicit column lists and type
+    # casting; columns added to the table later are left NULL
+    columns_str = ", ".join(column for column, _ in DELIVERY_COLUMNS)
+    select_str = ", ".join(f"CAST({column} AS {data_type}) AS {column}" for column, data_type in DELIVERY_COLUMNS)
     comprehensive_query = f"""
-    INSERT INTO {comprehensive_table} (
+    INSERT INTO {constants.COMPREHENSIVE_TABLE} (
       {columns_str}
     )
     SELECT
@@ -358,57 +1117,604 @@ def update_metadata(client, delivery_id):
     FROM {current_delivery_table}
     """
     
-    job_config = bigquery.QueryJobConfig()
-    client.query(metadata_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
-    client.query(comprehensive_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+    # The new addresses were not delivered before, so their fingerprints (and
+    # those of the near-duplicates collapsed into them) are only appended
+    delivered_query = f"""
+    INSERT INTO {constants.DELIVERED_FINGERPRINTS_TABLE} (address_fingerprint)
+    SELECT address_fingerprint
+    FROM {current_delivery_table}
+    WHERE address_fingerprint IS NOT NULL
+
+    UNION DISTINCT
+
+    SELECT c.address_fingerprint
+    FROM {constants.COLLAPSE_MAP_TABLE} c
+    JOIN {current_delivery_table} d
+      ON d.address_fingerprint = c.representative_fingerprint
+    WHERE c.delivery_id = @delivery_id
+    """
+
+    return [metadata_query, comprehensive_query, delivered_query] + _commit_watermarks_statements()
+
+def _record_step_statement(step, output_sql="CAST(NULL AS STRING)"):
+    """
+    INSERT recording a step of the @delivery_id delivery as completed
+
+    Rows are only ever appended (concurrent steps' inserts cannot conflict);
+    load_run_state reads the latest row of each step.
+
+    Args:
+        step: Step name
+        output_sql: SQL expression of the step's output as a JSON string
+    """
+    return f"""
+    INSERT INTO {constants.RUN_STATE_TABLE} (delivery_id, step, completed_at, output)
+    VALUES (@delivery_id, '{step}', CURRENT_TIMESTAMP(), {output_sql})
+    """
+
+def _run_transaction(client, statements, query_parameters, debug_name=None):
+    """
+    Run statements in one multi-statement transaction
+
+    If any statement fails the transaction is rolled back and the error
+    raised, so none of the statements take effect and the step can be retried.
+
+    Args:
+        client: BigQuery client
+        statements: SQL statements to run, in order
+        query_parameters: Query parameters the statements use
+        debug_name: Optional name of a file in debug/ to save the script to
+
+    Returns:
+        Row with the new_address_count, collapsed_count, location_count and
+        cached_count script variables (NULL when no statement sets them)
+    """
+    body = ";\n".join(statement.strip() for statement in statements)
+    script = f"""
+    DECLARE new_address_count INT64;
+    DECLARE collapsed_count INT64;
+    DECLARE location_count INT64;
+    DECLARE cached_count INT64;
+
+    BEGIN
+      BEGIN TRANSACTION;
+      {body};
+      COMMIT TRANSACTION;
+    EXCEPTION WHEN ERROR THEN
+      ROLLBACK TRANSACTION;
+      RAISE USING MESSAGE = @@error.message;
+    END;
+
+    SELECT new_address_count, collapsed_count, location_count, cached_count;
+    """
+    
+    if debug_name:
+        # Save the script for debugging
+        debug_dir = os.path.join(os.getcwd(), 'debug')
+        os.makedirs(debug_dir, exist_ok=True)
+        with open(os.path.join(debug_dir, debug_name), 'w') as f:
+            f.write(script)
+        logger.info(f"SQL query saved to {os.path.join(debug_dir, debug_name)} for debugging")
+    
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+    job = client.query(script, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+    result = list(job.result())[0]
+    logger.info(f"Transaction processed {job.total_bytes_processed} bytes")
+    return result
+
+def identify_new_addresses(client, delivery_id):
+    """
+    Identify new addresses that haven't been delivered yet
+
+    The current delivery table is replaced with the new addresses in a single
+    transaction; the count comes from the DML statistics rather than a rescan.
+    New addresses at a location in the geocode cache are resolved from it
+    rather than delivered (see RESOLVE_CACHED_GEOCODES).
+    deliver_new_addresses() also records the delivery in the same transaction.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery
+
+    Returns:
+        Number of new addresses
+    """
+    logger.info(f"Identifying new addresses for delivery ID: {delivery_id}")
+    refresh_delivered_fingerprints(client)
+    
+    result = _run_transaction(
+        client,
+        _replace_current_delivery_statements()
+        + [_record_step_statement("identify_new_addresses", "TO_JSON_STRING(new_address_count)")],
+        [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)] + _watermark_parameters(),
+        debug_name='identify_new_addresses_query.sql'
+    )
+    count = result['new_address_count']
+    
+    if result['cached_count']:
+        logger.info(f"Resolved {result['cached_count']} new addresses from the geocode cache")
+    logger.info(f"Found {count} new addresses")
+    return count
+
+def deliver_new_addresses(client, delivery_id):
+    """
+    Identify new addresses and record them as delivered, in one transaction
+
+    Replaces the current delivery with the new addresses, inserts them into
+    the metadata and comprehensive tables and advances the staged watermarks,
+    all in a single BEGIN/COMMIT script: either the whole delivery is recorded
+    or, if any statement fails, nothing is, and the run can simply be retried.
+    Used instead of identify_new_addresses() followed by update_metadata() when
+    near-duplicates are not collapsed in between.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery
+
+    Returns:
+        Number of new addresses
+    """
+    logger.info(f"Delivering new addresses for delivery ID: {delivery_id}")
+    refresh_delivered_fingerprints(client)
+    
+    result = _run_transaction(
+        client,
+        _replace_current_delivery_statements() + _record_delivery_statements()
+        + [_record_step_statement("deliver_new_addresses", "TO_JSON_STRING(new_address_count)")],
+        [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)] + _watermark_parameters(),
+        debug_name='identify_new_addresses_query.sql'
+    )
+    count = result['new_address_count']
+    
+    if result['cached_count']:
+        logger.info(f"Resolved {result['cached_count']} new addresses from the geocode cache")
+    logger.info(f"Found and recorded {count} new addresses")
+    return count
+
+def collapse_near_duplicates(client, delivery_id, similarity=None):
+    """
+    Collapse near-duplicate addresses of the same participant in the current delivery
+
+    A participant's addresses are compared within blocks sharing a normalized
+    ZIP and street number. An address whose normalized text is at least
+    `similarity` similar (1 - edit distance / length) to a higher ranked
+    address of its block is removed from the delivery and recorded in the
+    collapse map table against that representative. Addresses are ranked
+    current user profile first, then survey slots, then older user profile
+    history. Only representatives that are not collapsed themselves are used,
+    so every collapsed address maps to a delivered one.
+
+    Collapsed addresses count as delivered once their representative's
+    delivery is recorded in the metadata table (see identify_new_addresses).
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID for this delivery
+        similarity: Minimum similarity (defaults to NEAR_DUPLICATE_SIMILARITY)
+
+    Returns:
+        Number of addresses left in the current delivery
+    """
+    if similarity is None:
+        similarity = constants.NEAR_DUPLICATE_SIMILARITY
+    logger.info(f"Collapsing near-duplicate addresses for delivery ID: {delivery_id}")
+
+    current_delivery_table = constants.CURRENT_DELIVERY_TABLE
+    collapse_map_table = constants.COLLAPSE_MAP_TABLE
+    dataset = constants.NORMALIZATION_UDF_DATASET
+
+    def normalized(field):
+        return normalization.sql_normalize_expression(field, field, dataset)
+
+    compare_fields = ["address_line_1", "address_line_2", "street_num", "street_name", "apartment_num", "city"]
+    compare_sql = ",\n            ".join(normalized(field) for field in compare_fields)
+
+    columns_str = ", ".join(column for column, _ in DELIVERY_COLUMNS)
+    statements = [f"""
+    -- Rerunning a delivery replaces its collapsed rows
+    DELETE FROM {collapse_map_table} WHERE delivery_id = @delivery_id;
+
+    CREATE TEMP TABLE ranked AS
+    SELECT
+        *,
+        ROW_NUMBER() OVER (
+            PARTITION BY Connect_ID
+            ORDER BY COALESCE(historical_order, 0), historical_order IS NULL,
+                address_src_question_cid, address_fingerprint
+        ) AS row_rank,
+        {normalized('zip_code')} AS block_zip,
+        COALESCE(
+            {normalized('street_num')},
+            REGEXP_EXTRACT({normalized('address_line_1')}, r'^([0-9]+) ')
+        ) AS block_number,
+        ARRAY_TO_STRING([
+            {compare_sql}
+        ], ' ') AS compare_text
+    FROM {current_delivery_table};
+
+    -- Every pair of a participant's addresses in the same block that are similar enough
+    CREATE TEMP TABLE similar_pairs AS
+    SELECT Connect_ID, row_rank, similar_rank, similarity
+    FROM (
+        SELECT
+            a.Connect_ID,
+            a.row_rank,
+            b.row_rank AS similar_rank,
+            1 - EDIT_DISTANCE(a.compare_text, b.compare_text)
+                / GREATEST(LENGTH(a.compare_text), LENGTH(b.compare_text), 1) AS similarity
+        FROM ranked a
+        JOIN ranked b
+            ON a.Connect_ID = b.Connect_ID
+            AND a.block_zip = b.block_zip
+            AND a.block_number = b.block_number
+            AND b.row_rank < a.row_rank
+    )
+    WHERE similarity >= @similarity;
+
+    -- Addresses with no similar higher ranked address are representatives;
+    -- every other address collapses into its highest ranked similar representative
+    CREATE TEMP TABLE collapsed AS
+    SELECT p.Connect_ID, p.row_rank, p.similar_rank AS representative_rank, p.similarity
+    FROM similar_pairs p
+    LEFT JOIN (SELECT DISTINCT Connect_ID, row_rank FROM similar_pairs) n
+        ON n.Connect_ID = p.Connect_ID AND n.row_rank = p.similar_rank
+    WHERE n.row_rank IS NULL
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY p.Connect_ID, p.row_rank ORDER BY p.similar_rank) = 1;
+
+    INSERT INTO {collapse_map_table} (
+        delivery_id, delivery_date, Connect_ID, address_src_question_cid, address_nickname,
+        address_source, historical_order, address_hash, address_fingerprint, fingerprint_version,
+        representative_address_hash, representative_fingerprint, similarity
+    )
+    SELECT
+        r.delivery_id, r.delivery_date, r.Connect_ID, r.address_src_question_cid, r.address_nickname,
+        r.address_source, r.historical_order, r.address_hash, r.address_fingerprint, r.fingerprint_version,
+        rep.address_hash, rep.address_fingerprint, c.similarity
+    FROM collapsed c
+    JOIN ranked r ON r.Connect_ID = c.Connect_ID AND r.row_rank = c.row_rank
+    JOIN ranked rep ON rep.Connect_ID = c.Connect_ID AND rep.row_rank = c.representative_rank;
+
+    SET collapsed_count = (SELECT COUNT(*) FROM collapsed);
+
+    -- The current delivery keeps the representatives and unique addresses
+    DELETE FROM {current_delivery_table} WHERE TRUE;
+
+    INSERT INTO {current_delivery_table} ({columns_str})
+    SELECT {", ".join(f"r.{column}" for column, _ in DELIVERY_COLUMNS)}
+    FROM ranked r
+    LEFT JOIN collapsed c ON c.Connect_ID = r.Connect_ID AND c.row_rank = r.row_rank
+    WHERE c.row_rank IS NULL;
+
+    SET new_address_count = @@row_count
+    """, _record_step_statement("collapse_near_duplicates", "TO_JSON_STRING(new_address_count)")]
+
+    # One transaction, so a rerun never collapses an already collapsed delivery
+    result = _run_transaction(
+        client,
+        statements,
+        [
+            bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id),
+            bigquery.ScalarQueryParameter("similarity", "FLOAT64", similarity),
+        ]
+    )
+
+    logger.info(
+        f"Collapsed {result['collapsed_count']} near-duplicate addresses, "
+        f"{result['new_address_count']} left to deliver"
+    )
+    return result['new_address_count']
+
+def update_metadata(client, delivery_id):
+    """
+    Record the current delivery in the metadata and comprehensive tables
+
+    Both inserts and the commit of the delivery's staged watermarks run in
+    one transaction, so the tables cannot get out of sync.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery
+    """
+    logger.info(f"Updating metadata for delivery ID: {delivery_id}")
+    
+    _run_transaction(
+        client,
+        _record_delivery_statements() + [_record_step_statement("update_metadata")],
+        [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)]
+    )
     
     logger.info("Metadata updated successfully")
 
-def export_addresses(client, delivery_id, local_export=False, local_dir=None):
+def map_locations(client, delivery_id):
+    """
+    Collapse the current delivery into its distinct locations for a unique-location export
+
+    Every address of the current delivery gets the location key of its
+    normalized address fields (see fingerprint.location_key), shared by all
+    participants at the same physical address. The addresses and their keys
+    are recorded in the location map table, to fan the geocodes of the
+    locations back out to the participants, and the current locations table is
+    replaced with one row per key, in one transaction.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery
+
+    Returns:
+        Number of distinct locations
+    """
+    logger.info(f"Mapping the addresses of delivery {delivery_id} to their locations")
+
+    current_locations_table = constants.CURRENT_LOCATIONS_TABLE
+    dataset = constants.NORMALIZATION_UDF_DATASET
+
+    location_columns_str = ", ".join(column for column, _ in LOCATION_COLUMNS)
+    # Addresses sharing a key share their normalized fields
+    normalized_sql = ",\n        ".join(
+        f"ANY_VALUE({normalization.sql_normalize_expression(field, field, dataset)}) AS {field}"
+        for field in fingerprint.LOCATION_FIELDS
+    )
+
+    statements = [f"""
+    -- Rerunning a delivery's export replaces its mapping
+    DELETE FROM {constants.LOCATION_MAP_TABLE}
+    WHERE delivery_id = @delivery_id AND resolution = 'export';
+
+    CREATE TEMP TABLE located AS
+    {_with_location_key_query(constants.CURRENT_DELIVERY_TABLE)};
+
+    {_insert_location_map_statement('located', 'export')};
+
+    DELETE FROM {current_locations_table} WHERE TRUE;
+
+    INSERT INTO {current_locations_table} ({location_columns_str})
+    SELECT
+        @delivery_id AS delivery_id,
+        MIN(delivery_date) AS delivery_date,
+        location_key,
+        {normalized_sql},
+        COUNT(*) AS address_count,
+        COUNT(DISTINCT Connect_ID) AS participant_count
+    FROM located
+    GROUP BY location_key;
+
+    SET location_count = @@row_count
+    """]
+
+    result = _run_transaction(
+        client, statements, [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)]
+    )
+    location_count = result['location_count']
+    logger.info(f"Mapped the addresses of delivery {delivery_id} to {location_count} distinct locations")
+    return location_count
+
+def _export_source(unique_locations):
+    """
+    Table an export reads, the expression of a row's shard and the order of the rows in a shard
+
+    Addresses are spread over the shards by a hash of their Connect_ID, so all
+    of a participant's addresses land in the same shard; distinct locations
+    by their location key. The shard expression uses the @shard_count parameter.
+    """
+    if unique_locations:
+        return (constants.CURRENT_LOCATIONS_TABLE, "ABS(MOD(location_key, @shard_count))", "location_key")
+    return (constants.CURRENT_DELIVERY_TABLE, "ABS(MOD(FARM_FINGERPRINT(Connect_ID), @shard_count))",
+            "Connect_ID, address_nickname, historical_order")
+
+def _export_local_shards(client, delivery_id, local_dir, base_name, file_format, unique_locations=False):
+    """
+    Export the current delivery to local shard files written in parallel
+
+    Rows are spread over the shards as described in _export_source. One query
+    per shard selects its rows, sorted like a single-file export; the queries
+    run concurrently in BigQuery. A pool of up to
+    LOCAL_EXPORT_WORKERS processes then reads their results as Arrow record
+    batches through the BigQuery Storage Read API and writes one file per
+    shard, holding one batch per worker in memory (see local_export.py).
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID for this delivery
+        local_dir: Directory to write the files to
+        base_name: File name prefix; files are named {base_name}_shard-{shard}.{extension}
+        file_format: 'xlsx', 'csv' or 'parquet'
+        unique_locations: If True, export the current delivery's distinct locations
+
+    Returns:
+        Path of the index file listing the shards
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    table, shard_sql, order_sql = _export_source(unique_locations)
+    row_count = client.get_table(_table_id(table)).num_rows
+    shard_count = local_export.shard_count(row_count)
+
+    query = f"""
+    SELECT * FROM {table}
+    WHERE {shard_sql} = @shard
+    ORDER BY {order_sql}
+    """
+    shard_jobs = []
+    for shard in range(shard_count):
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("shard_count", "INT64", shard_count),
+            bigquery.ScalarQueryParameter("shard", "INT64", shard),
+        ])
+        job = client.query(query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+        shard_jobs.append((shard, job.job_id, job.location,
+                           local_export.shard_path(local_dir, base_name, shard, file_format), file_format))
+
+    workers = min(constants.LOCAL_EXPORT_WORKERS, shard_count)
+    if workers == 1:
+        shards = [local_export.export_bigquery_shard(*shard_job) for shard_job in shard_jobs]
+    else:
+        # Spawn rather than fork the workers: this process runs client threads
+        # (gRPC, the scheduler) a fork would copy in an unknown state
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(local_export.export_bigquery_shard, *shard_job) for shard_job in shard_jobs]
+            shards = [future.result() for future in futures]
+
+    index_path = local_export.write_index(local_dir, base_name, delivery_id, file_format, shards)
+    logger.info(f"Addresses exported successfully to {local_dir}: "
+                f"{sum(shard['row_count'] for shard in shards)} rows in {shard_count} {file_format} shards, "
+                f"index {index_path}")
+    return index_path
+
+# File extension of each EXPORT DATA format
+EXPORT_EXTENSIONS = {
+    'CSV': 'csv',
+    'PARQUET': 'parquet',
+    'AVRO': 'avro',
+}
+
+def _write_export_manifest(client, delivery_id, export_location, shard_count, export_format, compression,
+                           unique_locations=False):
+    """
+    Write a manifest.json listing every exported shard next to the shards
+
+    For each shard the manifest holds its row count and the URI, size and
+    checksums (CRC32C and MD5, base64 as reported by GCS) of each of its files,
+    so consumers can load the shards in parallel and check the delivery is
+    complete without listing the bucket.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID for this delivery
+        export_location: gs:// folder the shards were exported to
+        shard_count: Number of shards
+        export_format: EXPORT DATA format
+        compression: EXPORT DATA compression (or None)
+        unique_locations: If True, the shards hold the current delivery's distinct locations
+
+    Returns:
+        URI of the manifest
+    """
+    from google.cloud import storage
+
+    table, shard_sql, _ = _export_source(unique_locations)
+    count_query = f"""
+    SELECT {shard_sql} AS shard, COUNT(*) AS row_count
+    FROM {table}
+    GROUP BY shard
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("shard_count", "INT64", shard_count)]
+    )
+    row_counts = {
+        row['shard']: row['row_count']
+        for row in client.query(count_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+    }
+
+    bucket_name, _, prefix = export_location[len('gs://'):].partition('/')
+    bucket = storage.Client(project=constants.PROJECT_ID).bucket(bucket_name)
+
+    shards = []
+    for shard in range(shard_count):
+        files = [
+            {
+                'uri': f"gs://{bucket_name}/{blob.name}",
+                'size_bytes': blob.size,
+                'crc32c': blob.crc32c,
+                'md5': blob.md5_hash,
+            }
+            for blob in bucket.list_blobs(prefix=f"{prefix}shard-{shard:04d}-")
+        ]
+        shards.append({'shard': shard, 'row_count': row_counts.get(shard, 0), 'files': files})
+
+    manifest = {
+        'delivery_id': delivery_id,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'format': export_format,
+        'compression': compression,
+        'row_count': sum(shard['row_count'] for shard in shards),
+        'shards': shards,
+    }
+
+    manifest_name = f"{prefix}manifest.json"
+    bucket.blob(manifest_name).upload_from_string(json.dumps(manifest, indent=2), content_type='application/json')
+    return f"gs://{bucket_name}/{manifest_name}"
+
+def export_addresses(client, delivery_id, local_export=False, local_dir=None, unique_locations=False):
     """
     Export addresses either to a GCS bucket or locally
+
+    With unique_locations, only the distinct locations of the delivery are
+    exported, each once with its location key, so an address shared by a
+    household or building is geocoded once; the location map table links
+    every delivered address to its key (see map_locations).
     
     Args:
         client: BigQuery client
         delivery_id: ID for this delivery
-        local_export: If True, export to local file instead of GCS
+        local_export: If True, export to local shard files instead of GCS
         local_dir: Directory to save local files (optional)
+        unique_locations: If True, export distinct locations instead of addresses
+
+    Returns:
+        gs:// folder of the GCS export, or path of the index file of a local export
     """
     logger.info(f"Exporting addresses for delivery ID: {delivery_id}")
     
-    current_delivery_table = constants.CURRENT_DELIVERY_TABLE
     delivery_date = datetime.datetime.now().strftime('%Y%m%d')
+    if unique_locations:
+        map_locations(client, delivery_id)
+    table, shard_sql, order_sql = _export_source(unique_locations)
     
     if not local_export:
-        # Export to GCS bucket
+        # Export to GCS bucket; locations go to their own folder
         export_location = f'gs://{constants.BUCKET_NAME}/{constants.EXPORT_FOLDER}/{delivery_date}/'
+        if unique_locations:
+            export_location += 'locations/'
+        
+        shard_count = max(1, -(-client.get_table(_table_id(table)).num_rows // constants.EXPORT_ROWS_PER_FILE))
+        export_format = constants.EXPORT_FORMAT.upper()
+        compression = (constants.EXPORT_COMPRESSION or '').upper() or None
+        gzipped = export_format == 'CSV' and compression == 'GZIP'
+        extension = EXPORT_EXTENSIONS[export_format] + ('.gz' if gzipped else '')
+        
+        options = [f"format = '{export_format}'", "overwrite = true"]
+        if compression:
+            options.append(f"compression = '{compression}'")
+        if export_format == 'CSV':
+            options += ["header = true", "field_delimiter = ','"]
+        options_sql = ",\n          ".join(options)
         
-        export_query = f"""
+        # One EXPORT DATA per shard; rows are spread over the shards by a hash
+        # (see _export_source), so each shard holds about EXPORT_ROWS_PER_FILE rows
+        export_statements = []
+        query_parameters = [bigquery.ScalarQueryParameter("shard_count", "INT64", shard_count)]
+        for shard in range(shard_count):
+            export_statements.append(f"""
         EXPORT DATA
         OPTIONS (
-          uri = @export_uri,
-          format = 'CSV',
-          overwrite = true,
-          header = true,
-          field_delimiter = ','
+          uri = @export_uri_{shard},
+          {options_sql}
         ) AS (
-          SELECT * FROM {current_delivery_table}
-        )
-        """
+          SELECT * FROM {table}
+          WHERE {shard_sql} = {shard}
+          ORDER BY {order_sql}
+        );""")
+            query_parameters.append(bigquery.ScalarQueryParameter(
+                f"export_uri_{shard}", "STRING", f"{export_location}shard-{shard:04d}-*.{extension}"
+            ))
         
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("export_uri", "STRING", f"{export_location}*.csv")
-            ]
-        )
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+        client.query("\n".join(export_statements), job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
         
-        client.query(export_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+        manifest_uri = _write_export_manifest(
+            client, delivery_id, export_location, shard_count, export_format, compression, unique_locations
+        )
         
-        logger.info(f"Addresses exported successfully to {export_location}")
+        logger.info(
+            f"Addresses exported successfully to {export_location} "
+            f"({shard_count} shards, manifest {manifest_uri})"
+        )
         return export_location
     else:
-        # Export to local file
-        logger.info("Exporting to local file...")
+        # Export to local shard files
+        logger.info("Exporting to local files...")
         
         # Determine local directory
         if local_dir is None:
@@ -417,28 +1723,141 @@ def export_addresses(client, delivery_id, local_export=False, local_dir=None):
         # Create directory if it doesn't exist
         os.makedirs(local_dir, exist_ok=True)
         
-        # Get the data
-        query = f"SELECT * FROM {current_delivery_table}"
-        job_config = bigquery.QueryJobConfig()
-        df = client.query(query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).to_dataframe()
-        
-        # Convert timezone-aware datetime columns to timezone-naive
-        for col in df.select_dtypes(include=['datetime64[ns, UTC]']).columns:
-            df[col] = df[col].dt.tz_localize(None)
+        base_name = f"norc_{'locations' if unique_locations else 'addresses'}_{delivery_date}"
+        return _export_local_shards(client, delivery_id, local_dir, base_name,
+                                    constants.LOCAL_EXPORT_FORMAT, unique_locations)
+    
+def current_delivery_id(client):
+    """
+    Delivery ID of the addresses in the current delivery table
 
-        # Sort the data
-        df.sort_values(by=['Connect_ID', 'address_nickname', 'historical_order'])
+    export_addresses() exports the current delivery, so only this delivery
+    can be exported again.
+
+    Returns:
+        The delivery ID, or None if the current delivery is empty
+    """
+    query = f"SELECT delivery_id FROM {constants.CURRENT_DELIVERY_TABLE} LIMIT 1"
+    rows = list(client.query(query, timeout=constants.QUERY_TIMEOUT).result())
+    return rows[0]['delivery_id'] if rows else None
+
+def _geocode_results_query(staging_table, columns):
+    """
+    Query selecting the location key and geocode fields of loaded geocode results
+
+    Results without a location_key get the key of their address fields;
+    address and geocode fields missing from the results are NULL.
+    """
+    columns = {column.lower() for column in columns}
+    address_fields = geocodes.result_address_fields(columns)
+    fields_sql = ", ".join(
+        f"CAST({field} AS {data_type}) AS {field}" if field in columns else f"CAST(NULL AS {data_type}) AS {field}"
+        for field, data_type in geocodes.GEOCODE_FIELDS
+    )
+    key_sql = "CAST(location_key AS INT64)" if 'location_key' in columns else "CAST(NULL AS INT64)"
+    if not address_fields:
+        return f"SELECT {key_sql} AS location_key, {fields_sql} FROM {staging_table}"
+
+    address_sql = ", ".join(
+        f"CAST({field} AS STRING) AS {field}" if field in address_fields else f"CAST(NULL AS STRING) AS {field}"
+        for field in fingerprint.LOCATION_FIELDS
+    )
+    field_names = ", ".join(field for field, _ in geocodes.GEOCODE_FIELDS)
+    results_sql = f"(SELECT {key_sql} AS result_location_key, {address_sql}, {fields_sql} FROM {staging_table})"
+    return f"""
+    SELECT COALESCE(result_location_key, location_key) AS location_key, {field_names}
+    FROM ({_with_location_key_query(results_sql)})
+    """
+
+def ingest_geocodes(client, uris):
+    """
+    Bulk-load returned geocode result files and merge them into the geocode cache
+
+    The files are loaded into the staging table with load jobs (GCS files in
+    one job per format, local files one job each) rather than streamed, then
+    merged into the geocode cache on their location key. Results without a
+    latitude or longitude are not cached, so their addresses are delivered
+    again; of several results for one location the best match_score is kept.
+
+    Args:
+        client: BigQuery client
+        uris: gs:// URIs (wildcards allowed) or local paths of CSV (with a
+              header row, optionally gzipped) or Parquet result files
+
+    Returns:
+        Number of cached geocodes inserted or updated
+    """
+    logger.info(f"Ingesting geocode results from {len(uris)} files")
+
+    staging_table = _table_id(constants.GEOCODE_STAGING_TABLE)
+    loads = []
+    for source_format in sorted({geocodes.result_format(uri) for uri in uris}):
+        format_uris = [uri for uri in uris if geocodes.result_format(uri) == source_format]
+        gcs_uris = [uri for uri in format_uris if uri.startswith('gs://')]
+        if gcs_uris:
+            loads.append((source_format, gcs_uris))
+        loads += [(source_format, uri) for uri in format_uris if not uri.startswith('gs://')]
+
+    for i, (source_format, source) in enumerate(loads):
+        # The first load replaces the previous ingestion's results
+        job_config = bigquery.LoadJobConfig(
+            source_format=source_format,
+            autodetect=True,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND if i else bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        if i:
+            job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+        if source_format == 'CSV':
+            job_config.skip_leading_rows = 1
+        if isinstance(source, list):
+            job = client.load_table_from_uri(
+                source, staging_table, job_config=job_config, timeout=constants.QUERY_TIMEOUT
+            )
+            job.result()
+        else:
+            with open(source, 'rb') as f:
+                job = client.load_table_from_file(
+                    f, staging_table, job_config=job_config, timeout=constants.QUERY_TIMEOUT
+                )
+                job.result()
+        logger.info(f"Loaded {job.output_rows} geocode results")
+
+    columns = [field.name for field in client.get_table(staging_table).schema]
+    field_names = [field for field, _ in geocodes.GEOCODE_FIELDS]
+    update_sql = ",\n        ".join(f"{field} = s.{field}" for field in field_names)
+    required_sql = " AND ".join(f"{field} IS NOT NULL" for field in ["location_key"] + geocodes.REQUIRED_FIELDS)
+
+    merge_query = f"""
+    MERGE {constants.GEOCODE_CACHE_TABLE} c
+    USING (
+        SELECT *
+        FROM ({_geocode_results_query(constants.GEOCODE_STAGING_TABLE, columns)})
+        WHERE {required_sql}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY location_key ORDER BY match_score DESC) = 1
+    ) s
+    ON c.location_key = s.location_key
+    WHEN MATCHED THEN UPDATE SET
+        {update_sql},
+        geocoded_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (location_key, {", ".join(field_names)}, geocoded_at)
+        VALUES (s.location_key, {", ".join(f"s.{field}" for field in field_names)}, CURRENT_TIMESTAMP())
+    """
+    job = client.query(merge_query, timeout=constants.QUERY_TIMEOUT)
+    job.result()
+    merged = job.num_dml_affected_rows or 0
+    logger.info(f"Merged {merged} geocodes into {constants.GEOCODE_CACHE_TABLE} "
+                f"({job.total_bytes_processed} bytes processed)")
+    return merged
 
-        # Save to Excel file
-        local_file_path = os.path.join(local_dir, f'norc_addresses_{delivery_date}.xlsx')
-        df.to_excel(local_file_path, index=False, engine='xlsxwriter')
-        logger.info(f"Addresses exported successfully to {local_file_path}")
-        return local_file_path
-    
 def delete_delivery(client, delivery_id):
     """
     Delete a delivery from the metadata tables
     
+    The watermarks are rolled back to those the delivery advanced from, so
+    the next run checks the participants it covered again and delivers their
+    addresses anew.
+    
     Args:
         client: BigQuery client
         delivery_id: ID of the delivery to delete
@@ -447,43 +1866,214 @@ def delete_delivery(client, delivery_id):
     
     metadata_table = constants.METADATA_TABLE
     comprehensive_table = constants.COMPREHENSIVE_TABLE
+    collapse_map_table = constants.COLLAPSE_MAP_TABLE
+    
+    # Delivery IDs carry the delivery date; restricting the delete to the
+    # partitions around it avoids scanning the whole delivery history
+    query_parameters = [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)]
+    partition_filter = ""
+    try:
+        delivery_day = datetime.datetime.strptime(delivery_id, 'DELIVERY_%Y%m%d').date()
+        # delivery_date is stamped in UTC while the ID uses the local date, so allow a day either side
+        partition_filter = "AND DATE(delivery_date) BETWEEN @first_day AND @last_day"
+        query_parameters += [
+            bigquery.ScalarQueryParameter("first_day", "DATE", delivery_day - datetime.timedelta(days=1)),
+            bigquery.ScalarQueryParameter("last_day", "DATE", delivery_day + datetime.timedelta(days=1)),
+        ]
+    except ValueError:
+        logger.info(f"Delivery ID {delivery_id} carries no date, deleting without partition pruning")
     
     # Delete from metadata table
     metadata_delete_query = f"""
     DELETE FROM {metadata_table}
     WHERE delivery_id = @delivery_id
+    {partition_filter}
     """
     
     # Delete from comprehensive table
     comprehensive_delete_query = f"""
     DELETE FROM {comprehensive_table}
     WHERE delivery_id = @delivery_id
+    {partition_filter}
     """
     
-    # Execute queries
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)
-        ]
+    # Delete from collapse map table
+    collapse_map_delete_query = f"""
+    DELETE FROM {collapse_map_table}
+    WHERE delivery_id = @delivery_id
+    {partition_filter}
+    """
+    
+    # Roll the watermarks back to those the delivery advanced from (see watermarks.py)
+    watermark_rollback_query = ";\n".join(
+        watermarks.rollback_statements(constants.WATERMARK_TABLE, constants.WATERMARK_HISTORY_TABLE)
     )
     
+    # Delete the delivery's location map, summary statistics and run state, so
+    # it can be run again from scratch
+    summary_stats_delete_query = f"""
+    DELETE FROM {constants.LOCATION_MAP_TABLE}
+    WHERE delivery_id = @delivery_id
+    {partition_filter};
+
+    DELETE FROM {constants.SUMMARY_STATS_TABLE}
+    WHERE delivery_id = @delivery_id;
+
+    DELETE FROM {constants.RUN_STATE_TABLE}
+    WHERE delivery_id = @delivery_id
+    """
+    
+    # Execute queries
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+    
     try:
         # Delete from metadata table
-        client.query(metadata_delete_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
-        logger.info(f"Deleted delivery {delivery_id} from metadata table")
+        job = client.query(metadata_delete_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+        job.result()
+        logger.info(f"Deleted delivery {delivery_id} from metadata table ({job.total_bytes_processed} bytes processed)")
         
         # Delete from comprehensive table
-        client.query(comprehensive_delete_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
-        logger.info(f"Deleted delivery {delivery_id} from comprehensive table")
+        job = client.query(comprehensive_delete_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+        job.result()
+        logger.info(
+            f"Deleted delivery {delivery_id} from comprehensive table "
+            f"({job.total_bytes_processed} bytes processed)"
+        )
+        
+        # Delete from collapse map table
+        job = client.query(collapse_map_delete_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+        job.result()
+        logger.info(
+            f"Deleted delivery {delivery_id} from collapse map table "
+            f"({job.total_bytes_processed} bytes processed)"
+        )
+        
+        # Delete from location map, summary stats and run state tables
+        client.query(summary_stats_delete_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+        
+        # Roll back the watermarks; the marks staged last no longer match the
+        # committed ones, so the next run computes them from the sources again
+        rollback_config = bigquery.QueryJobConfig(query_parameters=query_parameters[:1])
+        client.query(watermark_rollback_query, job_config=rollback_config, timeout=constants.QUERY_TIMEOUT).result()
+        watermark_table = client.get_table(_table_id(constants.WATERMARK_TABLE))
+        watermark_table.labels = {**watermark_table.labels, 'source_version': None}
+        client.update_table(watermark_table, ['labels'])
+        logger.info(f"Rolled back the source watermarks committed by delivery {delivery_id}")
+
+        # The delivery's fingerprints may also have been delivered before, so
+        # rather than deleting them the next run rebuilds the delivered fingerprints
+        try:
+            delivered_table = client.get_table(_table_id(constants.DELIVERED_FINGERPRINTS_TABLE))
+            delivered_table.labels = {**delivered_table.labels, 'fingerprint_version': None}
+            client.update_table(delivered_table, ['labels'])
+        except NotFound:
+            pass
         
         logger.info(f"Successfully deleted delivery: {delivery_id}")
     except Exception as e:
         logger.error(f"Error deleting delivery {delivery_id}: {str(e)}")
         raise
 
+def compute_delivery_stats(client, delivery_ids):
+    """
+    Compute the summary statistics of deliveries and store them in the summary stats table
+
+    The delivered addresses are read once: a single GROUPING SETS aggregation
+    gives the totals, completeness, nickname, source and per-participant counts
+    of every delivery, which are then written as rows of SUMMARY_STATS_TABLE,
+    replacing any previous statistics of the same deliveries.
+
+    Args:
+        client: BigQuery client
+        delivery_ids: IDs of the deliveries to compute
+    """
+    comprehensive_table = constants.COMPREHENSIVE_TABLE
+    summary_stats_table = constants.SUMMARY_STATS_TABLE
+
+    completeness_sql = ",\n        ".join(
+        f"COUNTIF({field} IS NOT NULL) AS {field}_count" for field in reporting.COMPLETENESS_FIELDS
+    )
+    completeness_structs = ",\n            ".join(
+        f"STRUCT('{field}' AS field, {field}_count AS address_count)" for field in reporting.COMPLETENESS_FIELDS
+    )
+
+    stats_query = f"""
+    -- One scan of the delivered addresses, grouped four ways
+    CREATE TEMP TABLE grouped AS
+    SELECT
+        delivery_id,
+        GROUPING(address_nickname) = 0 AS by_nickname,
+        GROUPING(address_source) = 0 AS by_source,
+        GROUPING(Connect_ID) = 0 AS by_participant,
+        address_nickname,
+        address_source,
+        COUNT(*) AS address_count,
+        COUNT(DISTINCT Connect_ID) AS participant_count,
+        {completeness_sql}
+    FROM {comprehensive_table}
+    WHERE delivery_id IN UNNEST(@delivery_ids)
+    GROUP BY GROUPING SETS (
+        (delivery_id),
+        (delivery_id, address_nickname),
+        (delivery_id, address_source),
+        (delivery_id, Connect_ID)
+    );
+
+    DELETE FROM {summary_stats_table}
+    WHERE delivery_id IN UNNEST(@delivery_ids);
+
+    INSERT INTO {summary_stats_table} (
+        delivery_id, computed_at, dimension, value, address_count, participant_count
+    )
+    WITH totals AS (
+        SELECT * FROM grouped
+        WHERE NOT by_nickname AND NOT by_source AND NOT by_participant
+    )
+    SELECT delivery_id, CURRENT_TIMESTAMP(), 'total', CAST(NULL AS STRING),
+        address_count, participant_count
+    FROM totals
+    UNION ALL
+    SELECT delivery_id, CURRENT_TIMESTAMP(), 'nickname', address_nickname,
+        address_count, participant_count
+    FROM grouped
+    WHERE by_nickname
+    UNION ALL
+    SELECT delivery_id, CURRENT_TIMESTAMP(), 'source', address_source,
+        address_count, participant_count
+    FROM grouped
+    WHERE by_source
+    UNION ALL
+    SELECT delivery_id, CURRENT_TIMESTAMP(), 'distribution', CAST(address_count AS STRING),
+        SUM(address_count), COUNT(*)
+    FROM grouped
+    WHERE by_participant
+    GROUP BY delivery_id, address_count
+    UNION ALL
+    SELECT delivery_id, CURRENT_TIMESTAMP(), 'completeness', completeness.field,
+        completeness.address_count, NULL
+    FROM totals, UNNEST([
+            {completeness_structs}
+        ]) AS completeness
+    """
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("delivery_ids", "STRING", list(delivery_ids))]
+    )
+    job = client.query(stats_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+    job.result()
+    logger.info(f"Computed summary statistics of {len(delivery_ids)} deliveries "
+                f"({job.total_bytes_processed} bytes processed)")
+
 def generate_summary_statistics(client, delivery_id=None):
     """
     Generate summary statistics for addresses and print them as ASCII tables
+
+    The statistics of a delivery are computed once and stored (see
+    compute_delivery_stats); the report for all deliveries is rolled up from
+    the stored statistics, computing only those of deliveries that have none
+    yet. Its distinct participants and addresses per participant distribution
+    are counted exactly, from one scan of the delivered participants (see
+    reporting.participants_query).
     
     Args:
         client: BigQuery client
@@ -494,165 +2084,123 @@ def generate_summary_statistics(client, delivery_id=None):
     """
     logger.info("Generating summary statistics...")
     
-    # Define the tables we'll query
-    comprehensive_table = constants.COMPREHENSIVE_TABLE
+    summary_stats_table = constants.SUMMARY_STATS_TABLE
     
-    # Base query for when delivery_id is provided
-    delivery_filter = f"WHERE delivery_id = @delivery_id" if delivery_id else ""
-    delivery_param = [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)] if delivery_id else []
+    if delivery_id:
+        # Recompute, in case the delivery was rerun since its statistics were stored
+        compute_delivery_stats(client, [delivery_id])
+    else:
+        missing_query = f"""
+        SELECT DISTINCT delivery_id
+        FROM {constants.METADATA_TABLE}
+        WHERE delivery_id NOT IN (SELECT delivery_id FROM {summary_stats_table})
+        """
+        missing = [row['delivery_id'] for row in client.query(missing_query, timeout=constants.QUERY_TIMEOUT).result()]
+        if missing:
+            compute_delivery_stats(client, missing)
     
-    # Query 1: Total addresses and unique participants
-    count_query = f"""
-    SELECT 
-        COUNT(*) AS total_addresses,
-        COUNT(DISTINCT Connect_ID) AS total_participants,
-        COUNT(*) / COUNT(DISTINCT Connect_ID) AS avg_addresses_per_participant
-    FROM {comprehensive_table}
+    # Roll the stored statistics up over the requested deliveries
+    delivery_filter = "WHERE delivery_id = @delivery_id" if delivery_id else ""
+    delivery_param = [bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)] if delivery_id else []
+    rollup_query = f"""
+    SELECT
+        dimension,
+        value,
+        SUM(address_count) AS address_count,
+        SUM(participant_count) AS participant_count
+    FROM {summary_stats_table}
     {delivery_filter}
+    GROUP BY dimension, value
     """
-    
-    # Query 2: Addresses by address_nickname
-    nickname_query = f"""
-    SELECT 
-        address_nickname,
-        COUNT(*) AS count,
-        COUNT(*) * 100.0 / SUM(COUNT(*)) OVER() AS percentage
-    FROM {comprehensive_table}
-    {delivery_filter}
-    GROUP BY address_nickname
-    ORDER BY count DESC
+    job_config = bigquery.QueryJobConfig(query_parameters=delivery_param)
+    rollup_job = client.query(rollup_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+    rows = [dict(row) for row in rollup_job.result()]
+    
+    participant_rows = None
+    if not delivery_id:
+        participants_query = reporting.participants_query(constants.COMPREHENSIVE_TABLE)
+        participants_job = client.query(participants_query, timeout=constants.QUERY_TIMEOUT)
+        participant_rows = [dict(row) for row in participants_job.result()]
+    
+    stats = reporting.build_summary_statistics(delivery_id, reporting.rollup_results(rows, participant_rows))
+    reporting.print_summary_statistics(stats)
+    return stats
+
+def record_run_stats(client, report):
     """
-    
-    # Query 3: Addresses by address_source
-    source_query = f"""
-    SELECT 
-        address_source,
-        COUNT(*) AS count,
-        COUNT(*) * 100.0 / SUM(COUNT(*)) OVER() AS percentage
-    FROM {comprehensive_table}
-    {delivery_filter}
-    GROUP BY address_source
-    ORDER BY count DESC
+    Append a run report (see instrumentation.py) to the run stats table
+
+    The row is written with a load job rather than a query, so recording the
+    run is not itself billed or recorded.
+
+    Args:
+        client: BigQuery client
+        report: Run report built by PipelineRun.report
     """
-    
-    # Query 4: Distribution of addresses per participant
-    distribution_query = f"""
-    WITH participant_counts AS (
-        SELECT 
-            Connect_ID, 
-            COUNT(*) AS address_count
-        FROM {comprehensive_table}
-        {delivery_filter}
-        GROUP BY Connect_ID
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        # Run stats tables created before a report field existed drop that field
+        ignore_unknown_values=True
     )
-    SELECT 
-        address_count,
-        COUNT(*) AS participant_count,
-        COUNT(*) * 100.0 / SUM(COUNT(*)) OVER() AS percentage
-    FROM participant_counts
-    GROUP BY address_count
-    ORDER BY address_count
+    job = client.load_table_from_json(
+        [report], _table_id(constants.RUN_STATS_TABLE), job_config=job_config, timeout=constants.QUERY_TIMEOUT
+    )
+    job.result()
+    logger.info(f"Run stats recorded in {constants.RUN_STATS_TABLE}")
+
+def load_run_state(client, delivery_id):
     """
-    
-    # Query 5: Completeness of address fields
-    completeness_query = f"""
-    SELECT
-        COUNT(*) AS total_addresses,
-        COUNTIF(street_num IS NOT NULL) AS street_num_count,
-        COUNTIF(street_name IS NOT NULL) AS street_name_count,
-        COUNTIF(apartment_num IS NOT NULL) AS apartment_num_count,
-        COUNTIF(city IS NOT NULL) AS city_count,
-        COUNTIF(state IS NOT NULL) AS state_count,
-        COUNTIF(zip_code IS NOT NULL) AS zip_code_count,
-        COUNTIF(country IS NOT NULL) AS country_count,
-        COUNTIF(cross_street_1 IS NOT NULL) AS cross_street_1_count,
-        COUNTIF(cross_street_2 IS NOT NULL) AS cross_street_2_count,
-        COUNTIF(address_line_1 IS NOT NULL) AS address_line_1_count,
-        COUNTIF(address_line_2 IS NOT NULL) AS address_line_2_count
-    FROM {comprehensive_table}
-    {delivery_filter}
+    Load the steps earlier runs of a delivery completed
+
+    Creates the run state table if needed, before any step can record itself
+    in it: the completed steps of each delivery and their outputs (JSON), so a
+    rerun of a delivery resumes where it stopped.
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery
+
+    Returns:
+        Dictionary of completed step name to its output
     """
-    
-    # Execute queries
-    job_config = bigquery.QueryJobConfig(query_parameters=delivery_param)
-    
-    count_result = client.query(count_query, job_config=job_config).result()
-    nickname_result = client.query(nickname_query, job_config=job_config).result()
-    source_result = client.query(source_query, job_config=job_config).result()
-    distribution_result = client.query(distribution_query, job_config=job_config).result()
-    completeness_result = client.query(completeness_query, job_config=job_config).result()
-    
-    # Convert results to dictionaries
-    count_stats = list(count_result)[0]
-    nickname_stats = [dict(row) for row in nickname_result]
-    source_stats = [dict(row) for row in source_result]
-    distribution_stats = [dict(row) for row in distribution_result]
-    completeness_stats = list(completeness_result)[0]
-    
-    # Calculate percentages for field completeness
-    field_completeness = []
-    total = completeness_stats.total_addresses
-    if total > 0:
-        for field in ['street_num', 'street_name', 'apartment_num', 'city', 'state', 
-                    'zip_code', 'country', 'cross_street_1', 'cross_street_2',
-                    'address_line_1', 'address_line_2']:
-            count = getattr(completeness_stats, f"{field}_count")
-            percentage = (count / total) * 100
-            field_completeness.append({
-                'field': field,
-                'count': count,
-                'percentage': percentage
-            })
-    
-    # Compile all stats into a dictionary
-    stats = {
-        "delivery_id": delivery_id if delivery_id else "All deliveries",
-        "total_addresses": count_stats.total_addresses,
-        "total_participants": count_stats.total_participants,
-        "avg_addresses_per_participant": count_stats.avg_addresses_per_participant,
-        "addresses_by_nickname": nickname_stats,
-        "addresses_by_source": source_stats,
-        "addresses_per_participant_distribution": distribution_stats,
-        "field_completeness": field_completeness
-    }
-    
-    # Print a formatted report with ASCII tables
-    delivery_info = f" for delivery {delivery_id}" if delivery_id else ""
-    print(f"\n========== Summary Statistics{delivery_info} ==========\n")
-    
-    # Table 1: Overview
-    overview_data = [
-        ["Total Addresses", stats['total_addresses']],
-        ["Total Participants", stats['total_participants']],
-        ["Average Addresses per Participant", f"{stats['avg_addresses_per_participant']:.2f}"]
-    ]
-    print(tabulate(overview_data, headers=["Metric", "Value"], tablefmt="grid"))
-    print("\n")
-    
-    # Table 2: Addresses by Nickname
-    nickname_data = [[item['address_nickname'], item['count'], f"{item['percentage']:.1f}%"] 
-                     for item in stats['addresses_by_nickname']]
-    print(tabulate(nickname_data, headers=["Address Nickname", "Count", "Percentage"], tablefmt="grid"))
-    print("\n")
-    
-    # Table 3: Addresses by Source
-    source_data = [[item['address_source'], item['count'], f"{item['percentage']:.1f}%"] 
-                   for item in stats['addresses_by_source']]
-    print(tabulate(source_data, headers=["Address Source", "Count", "Percentage"], tablefmt="grid"))
-    print("\n")
-    
-    # Table 4: Distribution of Addresses per Participant
-    distribution_data = [[item['address_count'], item['participant_count'], f"{item['percentage']:.1f}%"] 
-                         for item in stats['addresses_per_participant_distribution']]
-    print(tabulate(distribution_data, 
-                   headers=["Addresses per Participant", "Number of Participants", "Percentage"], 
-                   tablefmt="grid"))
-    print("\n")
-    
-    # Table 5: Field Completeness
-    completeness_data = [[item['field'], item['count'], f"{item['percentage']:.1f}%"] 
-                         for item in stats['field_completeness']]
-    print(tabulate(completeness_data, headers=["Field", "Count", "Percentage"], tablefmt="grid"))
-    print("\n")
-    
-    return stats
\ No newline at end of file
+    run_state_table = constants.RUN_STATE_TABLE
+    state_query = f"""
+    CREATE TABLE IF NOT EXISTS {run_state_table} (
+        delivery_id STRING,
+        step STRING,
+        completed_at TIMESTAMP,
+        output STRING
+    )
+    CLUSTER BY delivery_id;
+
+    SELECT step, output
+    FROM {run_state_table}
+    WHERE delivery_id = @delivery_id
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY step ORDER BY completed_at DESC) = 1;
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id)]
+    )
+    rows = client.query(state_query, job_config=job_config, timeout=constants.QUERY_TIMEOUT).result()
+    return {row['step']: json.loads(row['output']) if row['output'] else None for row in rows}
+
+def record_step(client, delivery_id, step, output=None):
+    """
+    Record a step of a delivery as completed
+
+    Args:
+        client: BigQuery client
+        delivery_id: ID of the delivery
+        step: Step name
+        output: JSON-serializable output of the step, returned to a resumed run
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("delivery_id", "STRING", delivery_id),
+            bigquery.ScalarQueryParameter("output", "STRING", json.dumps(output, default=str)),
+        ]
+    )
+    client.query(
+        _record_step_statement(step, "@output"), job_config=job_config, timeout=constants.QUERY_TIMEOUT
+    ).result()
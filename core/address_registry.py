@@ -0,0 +1,495 @@
+# Declarative registry of address sources
+#
+# Every address the pipeline delivers comes from one entry of ADDRESS_SOURCES.
+# An entry names the source table, the question CID and nickname the address is
+# delivered under, the column(s) feeding each address field and the participant
+# eligibility filters that apply. sql_compiler.py turns the registry into the
+# address query; entries that read the same table with the same filters are
+# compiled into a single scan of that table.
+#
+# A list of columns is COALESCEd in order (for module 4 the first column is the
+# US address, the second the non-US fallback). Address fields an entry does not
+# map come through as NULL.
+
+# Output columns of the address queries, in order
+ADDRESS_FIELDS = [
+    "address_line_1",
+    "address_line_2",
+    "street_num",
+    "street_name",
+    "apartment_num",
+    "city",
+    "state",
+    "zip_code",
+    "country",
+    "cross_street_1",
+    "cross_street_2",
+]
+
+# Participant eligibility filters, referenced by name from the address sources.
+# They are applied to the raw participants table (aliased as p); sources that
+# read another table are joined to it on Connect_ID.
+FILTERS = {
+    "has_connect_id": "p.Connect_ID IS NOT NULL",
+    "verified": "p.d_821247024 = 197316935",  # Verification status = verified
+    "no_data_destruction": "p.d_831041022 = 104430631",  # Data destruction requested = no
+    "module4_complete": "p.d_663265240 = 231311385",  # Module 4 is complete
+}
+
+MODULE4_FILTERS = ["verified", "no_data_destruction", "module4_complete"]
+USER_PROFILE_FILTERS = ["has_connect_id", "verified", "no_data_destruction"]
+
+# Columns recording when a row of each source table last changed (TIMESTAMP
+# columns or ISO timestamp strings). A participant is considered changed when
+# any of them is later than the refresh watermark; add columns here if other
+# updates should trigger an incremental refresh of their addresses. Changes of
+# the other eligibility filter columns (such as the data destruction flag) are
+# not tracked.
+CHANGE_TIMESTAMP_COLUMNS = {
+    "participants": [
+        "d_371303487",  # User profile updated
+        "d_914594314",  # Verification status updated
+    ],
+    "module4": [
+        "COMPLETED_TS",  # Module 4 completed
+    ],
+}
+
+# User profile address history: an array of snapshots of the user profile
+# address fields, each stamped with the time of the profile update
+USER_PROFILE_HISTORY_ARRAY = "d_569151507"
+USER_PROFILE_HISTORY_TIMESTAMP = "d_371303487"
+
+MODULE4_ADDRESS_SLOTS = [
+    {
+        "cid": "121490150",
+        "nickname": "home_address_01",
+        "fields": {
+            "street_num": "D_121490150_D_255248624",
+            "street_name": "D_121490150_D_945532934",
+            "apartment_num": "D_121490150_D_469838242",
+            "city": ["D_121490150_D_303500597", "D_920576363_D_725583683"],
+            "state": ["D_121490150_D_195068098", "D_920576363_D_917021073"],
+            "zip_code": ["D_121490150_D_202784871", "D_920576363_D_970000442"],
+            "country": ["D_121490150_D_831127170", "D_920576363_D_500100435"],
+            "cross_street_1": "D_804504024_D_105043152",
+            "cross_street_2": "D_804504024_D_543135391",
+        },
+    },
+    {
+        "cid": "574985342",
+        "nickname": "home_address_02",
+        "fields": {
+            "street_num": "D_574985342_D_985267931",
+            "street_name": "D_574985342_D_111275683",
+            "apartment_num": "D_574985342_D_129226572",
+            "city": ["D_574985342_D_536516743", "D_444145120_D_288498031"],
+            "state": ["D_574985342_D_283900560", "D_444145120_D_195845897"],
+            "zip_code": ["D_574985342_D_467947502", "D_444145120_D_936129960"],
+            "country": ["D_574985342_D_368486703", "D_444145120_D_924583345"],
+            "cross_street_1": "D_398762737_D_553357862",
+            "cross_street_2": "D_398762737_D_474541595",
+        },
+    },
+    {
+        "cid": "828086036",
+        "nickname": "home_address_03",
+        "fields": {
+            "street_num": "D_828086036_D_875706715",
+            "street_name": "D_828086036_D_645150792",
+            "apartment_num": "D_828086036_D_585360350",
+            "city": ["D_828086036_D_588699608", "D_752101258_D_648495207"],
+            "state": ["D_828086036_D_544692849", "D_752101258_D_300933270"],
+            "zip_code": ["D_828086036_D_335435992", "D_752101258_D_649864362"],
+            "country": ["D_828086036_D_337088272", "D_752101258_D_723108194"],
+            "cross_street_1": "D_961572487_D_469679476",
+            "cross_street_2": "D_961572487_D_216954796",
+        },
+    },
+    {
+        "cid": "680046149",
+        "nickname": "home_address_04",
+        "fields": {
+            "street_num": "D_680046149_D_130174162",
+            "street_name": "D_680046149_D_563832508",
+            "apartment_num": "D_680046149_D_817839081",
+            "city": ["D_680046149_D_930511603", "D_879180101_D_931999203"],
+            "state": ["D_680046149_D_756548442", "D_879180101_D_486511102"],
+            "zip_code": ["D_680046149_D_455968200", "D_879180101_D_267027102"],
+            "country": ["D_680046149_D_728704613", "D_879180101_D_734345879"],
+            "cross_street_1": "D_746604821_D_423713680",
+            "cross_street_2": "D_746604821_D_555767576",
+        },
+    },
+    {
+        "cid": "274189667",
+        "nickname": "home_address_05",
+        "fields": {
+            "street_num": "D_274189667_D_838725845",
+            "street_name": "D_274189667_D_565515774",
+            "apartment_num": "D_274189667_D_848348504",
+            "city": ["D_274189667_D_742177990", "D_212343294_D_445867902"],
+            "state": ["D_274189667_D_843508307", "D_212343294_D_348049244"],
+            "zip_code": ["D_274189667_D_554901696", "D_212343294_D_684217044"],
+            "country": ["D_274189667_D_819429013", "D_212343294_D_600319581"],
+            "cross_street_1": "D_298296694_D_915527263",
+            "cross_street_2": "D_298296694_D_325919807",
+        },
+    },
+    {
+        "cid": "113930886",
+        "nickname": "home_address_06",
+        "fields": {
+            "street_num": "D_113930886_D_306805272",
+            "street_name": "D_113930886_D_819844467",
+            "apartment_num": "D_113930886_D_164233037",
+            "city": ["D_113930886_D_418702418", "D_255474241_D_218334768"],
+            "state": ["D_113930886_D_101219440", "D_255474241_D_394294282"],
+            "zip_code": ["D_113930886_D_127963610", "D_255474241_D_803526907"],
+            "country": ["D_113930886_D_882731998", "D_255474241_D_941168091"],
+            "cross_street_1": "D_205492848_D_756458580",
+            "cross_street_2": "D_205492848_D_481599610",
+        },
+    },
+    {
+        "cid": "809728747",
+        "nickname": "home_address_07",
+        "fields": {
+            "street_num": "D_809728747_D_351559015",
+            "street_name": "D_809728747_D_903490632",
+            "apartment_num": "D_809728747_D_906119853",
+            "city": ["D_809728747_D_703944664", "D_201906316_D_476697171"],
+            "state": ["D_809728747_D_390463636", "D_201906316_D_605344820"],
+            "zip_code": ["D_809728747_D_256790385", "D_201906316_D_814644814"],
+            "country": ["D_809728747_D_915222355", "D_201906316_D_627992821"],
+            "cross_street_1": "D_581231591_D_732107715",
+            "cross_street_2": "D_581231591_D_803219073",
+        },
+    },
+    {
+        "cid": "539057792",
+        "nickname": "home_address_08",
+        "fields": {
+            "street_num": "D_539057792_D_893639464",
+            "street_name": "D_539057792_D_438475588",
+            "apartment_num": "D_539057792_D_194165243",
+            "city": ["D_539057792_D_744290061", "D_864213677_D_280877371"],
+            "state": ["D_539057792_D_516936572", "D_864213677_D_463064782"],
+            "zip_code": ["D_539057792_D_673034401", "D_864213677_D_865310914"],
+            "country": ["D_539057792_D_489019597", "D_864213677_D_900377581"],
+            "cross_street_1": "D_123104885_D_707276214",
+            "cross_street_2": "D_123104885_D_462701424",
+        },
+    },
+    {
+        "cid": "537011756",
+        "nickname": "home_address_09",
+        "fields": {
+            "street_num": "D_537011756_D_988266183",
+            "street_name": "D_537011756_D_709374950",
+            "apartment_num": "D_537011756_D_853931010",
+            "city": ["D_537011756_D_351559021", "D_964853797_D_548773158"],
+            "state": ["D_537011756_D_290370013", "D_964853797_D_487043303"],
+            "zip_code": ["D_537011756_D_453691095", "D_964853797_D_659122266"],
+            "country": ["D_537011756_D_202104231", "D_964853797_D_388427546"],
+            "cross_street_1": "D_890661849_D_174111872",
+            "cross_street_2": "D_890661849_D_735022625",
+        },
+    },
+    {
+        "cid": "171937884",
+        "nickname": "home_address_10",
+        "fields": {
+            "street_num": "D_171937884_D_264707783",
+            "street_name": "D_171937884_D_666011940",
+            "apartment_num": "D_171937884_D_981594981",
+            "city": ["D_171937884_D_282089547", "D_787064287_D_891573875"],
+            "state": ["D_171937884_D_612617245", "D_787064287_D_862255177"],
+            "zip_code": ["D_171937884_D_674024553", "D_787064287_D_972332937"],
+            "country": ["D_171937884_D_886247195", "D_787064287_D_429200007"],
+            "cross_street_1": "D_902193418_D_633590687",
+            "cross_street_2": "D_902193418_D_857265979",
+        },
+    },
+    {
+        "cid": "828766803",
+        "nickname": "home_address_11",
+        "fields": {
+            "street_num": "D_828766803_D_622968789",
+            "street_name": "D_828766803_D_696874548",
+            "apartment_num": "D_828766803_D_450630128",
+            "city": ["D_828766803_D_309461541", "D_878688378_D_706592013"],
+            "state": ["D_828766803_D_789637860", "D_878688378_D_585473282"],
+            "zip_code": ["D_828766803_D_795253129", "D_878688378_D_814137809"],
+            "country": ["D_828766803_D_780298998", "D_878688378_D_876521406"],
+            "cross_street_1": "D_440597740_D_573998459",
+            "cross_street_2": "D_440597740_D_760197341",
+        },
+    },
+    {
+        "cid": "376408004",
+        "nickname": "seasonal_address_01",
+        "fields": {
+            "street_num": "D_376408004_D_234037089",
+            "street_name": "D_376408004_D_416862112",
+            "apartment_num": "D_376408004_D_671149035",
+            "city": ["D_376408004_D_556576930", "D_173413183_D_416620941"],
+            "state": ["D_376408004_D_304326324", "D_173413183_D_915859406"],
+            "zip_code": ["D_376408004_D_812433386", "D_173413183_D_354833686"],
+            "country": ["D_376408004_D_477319994", "D_173413183_D_661148931"],
+            "cross_street_1": "D_200086909_D_351319555",
+            "cross_street_2": "D_200086909_D_154163153",
+        },
+    },
+    {
+        "cid": "279093430",
+        "nickname": "seasonal_address_02",
+        "fields": {
+            "street_num": "D_279093430_D_476938134",
+            "street_name": "D_279093430_D_561635035",
+            "apartment_num": "D_279093430_D_134210521",
+            "city": ["D_279093430_D_715370929", "D_657986901_D_726739712"],
+            "state": ["D_279093430_D_109991481", "D_657986901_D_149514187"],
+            "zip_code": ["D_279093430_D_494380686", "D_657986901_D_845446624"],
+            "country": ["D_279093430_D_440796912", "D_657986901_D_677739650"],
+            "cross_street_1": "D_509526051_D_542763783",
+            "cross_street_2": "D_509526051_D_351069956",
+        },
+    },
+    {
+        "cid": "143927994",
+        "nickname": "seasonal_address_03",
+        "fields": {
+            "street_num": "D_143927994_D_119483547",
+            "street_name": "D_143927994_D_194338739",
+            "apartment_num": "D_143927994_D_387077376",
+            "city": ["D_143927994_D_113352592", "D_564684946_D_148846635"],
+            "state": ["D_143927994_D_768114466", "D_564684946_D_192663941"],
+            "zip_code": ["D_143927994_D_938180781", "D_564684946_D_245044197"],
+            "country": ["D_143927994_D_733365745", "D_564684946_D_261025083"],
+            "cross_street_1": "D_370121390_D_580185896",
+            "cross_street_2": "D_370121390_D_599607007",
+        },
+    },
+    {
+        "cid": "935378391",
+        "nickname": "seasonal_address_04",
+        "fields": {
+            "street_num": "D_935378391_D_785588454",
+            "street_name": "D_935378391_D_419659205",
+            "apartment_num": "D_935378391_D_653181757",
+            "city": ["D_935378391_D_733619119", "D_558981691_D_571926996"],
+            "state": ["D_935378391_D_843680322", "D_558981691_D_645589113"],
+            "zip_code": ["D_935378391_D_716343828", "D_558981691_D_701056236"],
+            "country": ["D_935378391_D_497260033", "D_558981691_D_398249766"],
+            "cross_street_1": "D_192184336_D_117544868",
+            "cross_street_2": "D_192184336_D_868650023",
+        },
+    },
+    {
+        "cid": "320166033",
+        "nickname": "seasonal_address_05",
+        "fields": {
+            "street_num": "D_320166033_D_275244758",
+            "street_name": "D_320166033_D_688216428",
+            "apartment_num": "D_320166033_D_843674851",
+            "city": ["D_320166033_D_570311888", "D_194944818_D_101804763"],
+            "state": ["D_320166033_D_557852952", "D_194944818_D_502068619"],
+            "zip_code": ["D_320166033_D_970217879", "D_194944818_D_787391994"],
+            "country": ["D_320166033_D_452103273", "D_194944818_D_540340377"],
+            "cross_street_1": "D_763354979_D_677922318",
+            "cross_street_2": "D_763354979_D_424347938",
+        },
+    },
+    {
+        "cid": "383535171",
+        "nickname": "seasonal_address_06",
+        "fields": {
+            "street_num": "D_383535171_D_666445636",
+            "street_name": "D_383535171_D_398622449",
+            "apartment_num": "D_383535171_D_521925072",
+            "city": ["D_383535171_D_888514303", "D_508587741_D_686611963"],
+            "state": ["D_383535171_D_905002640", "D_508587741_D_900950849"],
+            "zip_code": ["D_383535171_D_687407917", "D_508587741_D_103689435"],
+            "country": ["D_383535171_D_932828568", "D_508587741_D_659457234"],
+            "cross_street_1": "D_355179190_D_115195973",
+            "cross_street_2": "D_355179190_D_706861475",
+        },
+    },
+    {
+        "cid": "133566757",
+        "nickname": "seasonal_address_07",
+        "fields": {
+            "street_num": "D_133566757_D_199489170",
+            "street_name": "D_133566757_D_605155921",
+            "apartment_num": "D_133566757_D_300476868",
+            "city": ["D_133566757_D_384403974", "D_293954660_D_860984191"],
+            "state": ["D_133566757_D_585153023", "D_293954660_D_892150843"],
+            "zip_code": ["D_133566757_D_248996395", "D_293954660_D_230376384"],
+            "country": ["D_133566757_D_525778327", "D_293954660_D_526462982"],
+            "cross_street_1": "D_851731394_D_993557817",
+            "cross_street_2": "D_851731394_D_110516520",
+        },
+    },
+    {
+        "cid": "509553290",
+        "nickname": "seasonal_address_08",
+        "fields": {
+            "street_num": "D_509553290_D_295693777",
+            "street_name": "D_509553290_D_646099557",
+            "apartment_num": "D_509553290_D_886284650",
+            "city": ["D_509553290_D_367684056", "D_268612977_D_599753334"],
+            "state": ["D_509553290_D_389478638", "D_268612977_D_467126157"],
+            "zip_code": ["D_509553290_D_949478044", "D_268612977_D_421779583"],
+            "country": ["D_509553290_D_298170847", "D_268612977_D_587765197"],
+            "cross_street_1": "D_172669345_D_520630754",
+            "cross_street_2": "D_172669345_D_142318726",
+        },
+    },
+    {
+        "cid": "239279719",
+        "nickname": "seasonal_address_09",
+        "fields": {
+            "street_num": "D_239279719_D_143093472",
+            "street_name": "D_239279719_D_746619983",
+            "apartment_num": "D_239279719_D_911964974",
+            "city": ["D_239279719_D_711881258", "D_216096388_D_450433102"],
+            "state": ["D_239279719_D_390941579", "D_216096388_D_181005197"],
+            "zip_code": ["D_239279719_D_737885885", "D_216096388_D_855530921"],
+            "country": ["D_239279719_D_603853574", "D_216096388_D_589689090"],
+            "cross_street_1": "D_921998144_D_872527709",
+            "cross_street_2": "D_921998144_D_686647703",
+        },
+    },
+    {
+        "cid": "778711683",
+        "nickname": "seasonal_address_10",
+        "fields": {
+            "street_num": "D_778711683_D_117703279",
+            "street_name": "D_778711683_D_734790700",
+            "apartment_num": "D_778711683_D_278164536",
+            "city": ["D_778711683_D_160188014", "D_757983656_D_983038259"],
+            "state": ["D_778711683_D_596751155", "D_757983656_D_313586037"],
+            "zip_code": ["D_778711683_D_624226136", "D_757983656_D_158186064"],
+            "country": ["D_778711683_D_807127029", "D_757983656_D_274940131"],
+            "cross_street_1": "D_670316988_D_306092529",
+            "cross_street_2": "D_670316988_D_258544530",
+        },
+    },
+    {
+        "cid": "632533534",
+        "nickname": "childhood_address_01",
+        "fields": {
+            "street_num": "D_632533534_D_284547539",
+            "street_name": "D_632533534_D_802585033",
+            "apartment_num": "D_632533534_D_746533238",
+            "city": ["D_632533534_D_128827522", "D_264797252_D_890792569"],
+            "state": ["D_632533534_D_439447560", "D_264797252_D_451394598"],
+            "zip_code": ["D_632533534_D_286781627", "D_264797252_D_984908796"],
+            "country": ["D_632533534_D_733929451", "D_264797252_D_847327251"],
+            "cross_street_1": "D_469914719_D_952124199",
+            "cross_street_2": "D_469914719_D_204186397",
+        },
+    },
+    {
+        "cid": "596318751",
+        "nickname": "current_work_address_01",
+        "fields": {
+            "street_num": "D_596318751_D_493984171",
+            "street_name": "D_596318751_D_253017624",
+            "apartment_num": "D_596318751_D_404141282",
+            "city": ["D_596318751_D_959804472", "D_263588196_D_583500714"],
+            "state": ["D_596318751_D_774707280", "D_263588196_D_742105146"],
+            "zip_code": ["D_596318751_D_182144476", "D_263588196_D_101341673"],
+            "country": ["D_596318751_D_294634899", "D_263588196_D_237204853"],
+            "cross_street_1": "D_845811202_D_510435329",
+            "cross_street_2": "D_845811202_D_520264332",
+        },
+    },
+    {
+        "cid": "992180692",
+        "nickname": "previous_work_address_01",
+        "fields": {
+            "street_num": "D_992180692_D_903896611",
+            "street_name": "D_992180692_D_855583262",
+            "apartment_num": "D_992180692_D_371588177",
+            "city": ["D_992180692_D_962868433", "D_350394531_D_652022112"],
+            "state": ["D_992180692_D_108530997", "D_350394531_D_730666903"],
+            "zip_code": ["D_992180692_D_110852652", "D_350394531_D_168091937"],
+            "country": ["D_992180692_D_867109611", "D_350394531_D_132779701"],
+            "cross_street_1": "D_733317111_D_584350267",
+            "cross_street_2": "D_733317111_D_840147245",
+        },
+    },
+    {
+        "cid": "914696832",
+        "nickname": "school_address_01",
+        "fields": {
+            "street_num": "D_914696832_D_970996351",
+            "street_name": "D_914696832_D_249657148",
+            "apartment_num": "D_914696832_D_190883115",
+            "city": ["D_914696832_D_161170041", "D_668887646_D_225725599"],
+            "state": ["D_914696832_D_660217075", "D_668887646_D_977086216"],
+            "zip_code": ["D_914696832_D_884494489", "D_668887646_D_997041632"],
+            "country": ["D_914696832_D_403679963", "D_668887646_D_147113671"],
+            "cross_street_1": "D_443679537_D_494271326",
+            "cross_street_2": "D_443679537_D_952170182",
+        },
+    },
+]
+
+USER_PROFILE_ADDRESSES = [
+    {
+        "cid": "207908218",
+        "nickname": "user_profile_physical_address",
+        "fields": {
+            "address_line_1": "d_207908218",
+            "address_line_2": "d_224392018",
+            "city": "d_451993790",
+            "state": "d_187799450",
+            "zip_code": "d_449168732",
+        },
+    },
+    {
+        "cid": "521824358",
+        "nickname": "user_profile_mailing_address",
+        "fields": {
+            "address_line_1": "d_521824358",
+            "address_line_2": "d_442166669",
+            "city": "d_703385619",
+            "state": "d_634434746",
+            "zip_code": "d_892050548",
+        },
+    },
+    {
+        "cid": "284580415",
+        "nickname": "user_profile_alternative_address",
+        "fields": {
+            "address_line_1": "D_284580415",
+            "address_line_2": "D_728926441",
+            "city": "D_907038282",
+            "state": "D_970839481",
+            "zip_code": "D_379899229",
+        },
+    },
+]
+
+ADDRESS_SOURCES = (
+    # Module 4 address questions
+    [
+        dict(slot, table="module4", address_source="module4", filters=MODULE4_FILTERS)
+        for slot in MODULE4_ADDRESS_SLOTS
+    ]
+    # Current user profile addresses (historical_order 0)
+    + [
+        dict(address, table="participants", address_source="user_profile",
+             historical_order=0, filters=USER_PROFILE_FILTERS)
+        for address in USER_PROFILE_ADDRESSES
+    ]
+    # User profile address history (historical_order is the 1-based array position)
+    + [
+        dict(address, table="participants", address_source="user_profile",
+             history_array=USER_PROFILE_HISTORY_ARRAY, filters=USER_PROFILE_FILTERS)
+        for address in USER_PROFILE_ADDRESSES
+    ]
+)
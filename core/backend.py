@@ -0,0 +1,44 @@
+import constants
+
+# Execution backends. Each backend is a module exposing the same pipeline
+# functions (create_required_tables, create_address_view, identify_new_addresses,
+# update_metadata, export_addresses, generate_summary_statistics, ...) taking
+# its own client as first argument. Backends are imported lazily so the local
+# backend does not need the BigQuery libraries and vice versa.
+BACKENDS = ["bigquery", "duckdb"]
+
+
+def get_backend(name=None):
+    """
+    Return the module implementing the pipeline functions of a backend
+
+    Args:
+        name: Backend name, one of BACKENDS (defaults to constants.BACKEND)
+    """
+    if name is None:
+        name = constants.BACKEND
+    if name == "bigquery":
+        import address_processing
+        return address_processing
+    if name == "duckdb":
+        import duckdb_backend
+        return duckdb_backend
+    raise ValueError(f"Unknown backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+
+def get_client(name=None):
+    """
+    Create the client the functions of a backend take
+
+    Args:
+        name: Backend name, one of BACKENDS (defaults to constants.BACKEND)
+
+    Returns:
+        BigQuery client or DuckDB connection
+    """
+    if name is None:
+        name = constants.BACKEND
+    if name == "bigquery":
+        from google.cloud import bigquery
+        return bigquery.Client(project=constants.PROJECT_ID)
+    return get_backend(name).connect()
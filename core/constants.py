@@ -1,5 +1,13 @@
 import os
 
+# Execution Backend
+# 'bigquery' runs the pipeline in BigQuery; 'duckdb' runs the same pipeline
+# locally over Parquet snapshots of the source tables (see duckdb_backend.py)
+BACKEND = os.environ.get("PIPELINE_BACKEND", "bigquery")
+DUCKDB_DATABASE = os.path.join(os.getcwd(), "local", "geocoding.duckdb")
+LOCAL_SNAPSHOT_DIR = os.path.join(os.getcwd(), "local", "snapshots")  # participants.parquet and module4_v1_JP.parquet
+HASH_INDEX_DIR = None  # On-disk index of delivered fingerprints (defaults to hash_index/ next to DUCKDB_DATABASE)
+
 # GCP Project Configuration
 PROJECT_ID = "nih-nci-dceg-connect-prod-6d04"
 
@@ -14,20 +22,103 @@ RAW_PARTICIPANTS_TABLE = f"`{PROJECT_ID}`.{RAW_SOURCE_DATASET_ID}.participants"
 
 # Target Table Names
 METADATA_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.address_delivery_metadata"
-ADDRESSES_VIEW = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.addresses_all"
+ADDRESSES_VIEW = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.addresses_all_view"  # Logical view over the address sources
+ADDRESSES_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.addresses_all"  # Materialized copy of the view
 CURRENT_DELIVERY_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.address_delivery_current"
 COMPREHENSIVE_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.address_deliveries"
+WATERMARK_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.pipeline_watermarks"
+# Watermarks each delivery advanced from, for rolling back deleted deliveries
+WATERMARK_HISTORY_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.pipeline_watermark_history"
+# Collapsed near-duplicates and their delivered representative
+COLLAPSE_MAP_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.address_collapse_map"
+# One row of step and query statistics per run
+RUN_STATS_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.pipeline_run_stats"
+# Summary statistics of each delivery
+SUMMARY_STATS_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.delivery_summary_stats"
+# Completed steps of each delivery, for resuming
+RUN_STATE_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.pipeline_run_state"
+# Cached fingerprints of every delivered address
+DELIVERED_FINGERPRINTS_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.delivered_fingerprints"
+# Location key of every delivered address
+LOCATION_MAP_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.address_location_map"
+# Distinct locations of the current delivery
+CURRENT_LOCATIONS_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.address_delivery_locations"
+# Returned geocodes, keyed by location key
+GEOCODE_CACHE_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.geocode_cache"
+# Result files loaded by the last ingestion
+GEOCODE_STAGING_TABLE = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}.geocode_results_staging"
+
+# Near-Duplicate Collapsing
+# A participant's candidate addresses sharing a ZIP and street number whose
+# normalized text is at least this similar (1 - edit distance / length) are
+# collapsed into one delivered representative
+COLLAPSE_NEAR_DUPLICATES = False
+NEAR_DUPLICATE_SIMILARITY = 0.9
+
+# Geocode Cache
+# New addresses at a location already in the geocode cache are resolved from
+# it (recorded in LOCATION_MAP_TABLE) instead of being delivered again
+RESOLVE_CACHED_GEOCODES = True
+
+# Address Normalization
+NORMALIZATION_UDF_DATASET = f"`{PROJECT_ID}`.{TARGET_DATASET_ID}"  # Dataset holding the normalize_* UDFs
+
+# Materialized Addresses Table
+ADDRESSES_FULL_REBUILD = False  # Set to True to rebuild addresses_all from scratch instead of merging changes
+
+# Change Detection
+# Participants whose source rows changed within this many hours before the
+# last committed watermark are re-checked, so rows landing late are not missed
+WATERMARK_LOOKBACK_HOURS = 48
 
 # Storage Configuration
 BUCKET_NAME = os.environ.get("BUCKET_NAME", "your-default-bucket-name")
 EXPORT_FOLDER = "norc_address_delivery"
+EXPORT_FORMAT = "CSV"  # GCS export format: 'CSV', 'PARQUET' or 'AVRO'
+EXPORT_COMPRESSION = None  # CSV: 'GZIP'; PARQUET: 'SNAPPY', 'GZIP' or 'ZSTD'; AVRO: 'SNAPPY' or 'DEFLATE'
 LOCAL_EXPORT = True  # Set to True to export locally instead of to GCS
 LOCAL_EXPORT_DIR = os.path.join(os.getcwd(), "exports")  # Better path for exports
+LOCAL_EXPORT_FORMAT = "xlsx"  # Local export format: 'xlsx', 'csv' or 'parquet', one file per shard
+# Maximum rows per shard of a local export (xlsx holds at most 1,048,575), and
+# per shard of a GCS export
+EXPORT_ROWS_PER_FILE = 1_000_000
+LOCAL_EXPORT_WORKERS = os.cpu_count() or 1  # Worker processes downloading and writing local export shards in parallel
+LOCAL_EXPORT_MIN_SHARD_ROWS = 100_000  # Smaller local exports are split over fewer shards than LOCAL_EXPORT_WORKERS
+# Set to True to export each distinct location once, mapped back to its
+# addresses in LOCATION_MAP_TABLE
+EXPORT_UNIQUE_LOCATIONS = False
 
 # SQL File Paths
+# The address query is compiled from address_registry.py; the hand-written SQL
+# files are kept as the reference the benchmarks check the compiled query against
 SQL_DIR = "sql"
 ADDRESS_QUERY_SQL = "address_view.sql"
 USER_PROFILE_QUERY_SQL = "user_profile_address_view.sql"
+SQL_CACHE_DIR = os.path.join(os.getcwd(), "cache", "sql")  # Compiled SQL, keyed by registry hash
 
 # Query Timeout (in seconds)
-QUERY_TIMEOUT = 300
\ No newline at end of file
+QUERY_TIMEOUT = 300
+
+# Concurrency
+# Independent queries (and pipeline steps) run at the same time, at most this
+# many at once (see scheduler.py)
+MAX_CONCURRENT_QUERIES = 4
+
+# Resuming Runs
+# A rerun with the same delivery ID skips the steps an earlier, failed run of
+# it completed (see pipeline_run_state), and a delivery that succeeded is not
+# run again; set to False to always run every step
+RESUME_RUNS = True
+
+# Run Instrumentation
+RUN_REPORT_DIR = os.path.join(os.getcwd(), "run_reports")  # JSON report of every run
+RUN_BYTES_BILLED_ALERT = 100 * 1024 ** 3  # Log a warning when a run bills more than this many bytes
+
+# Query Budgets
+# Every BigQuery query is dry-run before it runs. A query whose estimate would
+# take its step past its budget, or the run past RUN_BYTES_BILLED_BUDGET, aborts
+# the run before it starts, and queries run with maximum_bytes_billed set to the
+# budget left. None disables a budget.
+STEP_BYTES_BILLED_BUDGET = 1024 ** 4  # Bytes each pipeline step may bill
+STEP_BYTES_BILLED_BUDGETS = {}  # Budgets of individual steps by name, overriding STEP_BYTES_BILLED_BUDGET
+RUN_BYTES_BILLED_BUDGET = 2 * 1024 ** 4  # Bytes a whole run may bill
\ No newline at end of file
@@ -0,0 +1,1134 @@
+import os
+import json
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import duckdb
+import numpy as np
+import pyarrow as pa
+import constants
+from utils import logger
+import sql_compiler
+import fingerprint
+import normalization
+import reporting
+import local_export
+import hash_index
+import geocodes
+from address_registry import ADDRESS_FIELDS
+
+# Local DuckDB execution backend
+#
+# Runs the same logical pipeline as address_processing.py, with the same
+# function names and arguments, against a DuckDB database instead of
+# BigQuery. The source tables are local Parquet snapshots (see
+# create_snapshots). The address query is compiled from the registry in the
+# DuckDB dialect, and fingerprints and normalization are registered as Python
+# UDFs running the same code as the BigQuery SQL, so both backends deliver the
+# same rows and fingerprints.
+#
+# The snapshots are static, so every run treats every participant as changed:
+# the watermarks are not tracked and the addresses table is always rebuilt.
+#
+# Delivered fingerprints are looked up in an on-disk index (see hash_index.py)
+# rather than by joining the metadata table, so checking candidates does not
+# hold the delivery history in memory.
+
+# Pipeline tables, named after their BigQuery counterparts
+METADATA_TABLE = constants.METADATA_TABLE.split('.')[-1]
+ADDRESSES_VIEW = constants.ADDRESSES_VIEW.split('.')[-1]
+ADDRESSES_TABLE = constants.ADDRESSES_TABLE.split('.')[-1]
+CURRENT_DELIVERY_TABLE = constants.CURRENT_DELIVERY_TABLE.split('.')[-1]
+COMPREHENSIVE_TABLE = constants.COMPREHENSIVE_TABLE.split('.')[-1]
+COLLAPSE_MAP_TABLE = constants.COLLAPSE_MAP_TABLE.split('.')[-1]
+RUN_STATS_TABLE = constants.RUN_STATS_TABLE.split('.')[-1]
+RUN_STATE_TABLE = constants.RUN_STATE_TABLE.split('.')[-1]
+LOCATION_MAP_TABLE = constants.LOCATION_MAP_TABLE.split('.')[-1]
+CURRENT_LOCATIONS_TABLE = constants.CURRENT_LOCATIONS_TABLE.split('.')[-1]
+GEOCODE_CACHE_TABLE = constants.GEOCODE_CACHE_TABLE.split('.')[-1]
+SUMMARY_STATS_TABLE = constants.SUMMARY_STATS_TABLE.split('.')[-1]
+
+# Steps recording their own completion in the same transaction (see
+# address_processing.TRANSACTIONAL_STEPS)
+TRANSACTIONAL_STEPS = ["deliver_new_addresses", "update_metadata"]
+
+# Snapshot file of each source table in LOCAL_SNAPSHOT_DIR
+SNAPSHOT_TABLES = {
+    "participants": constants.RAW_PARTICIPANTS_TABLE,
+    "module4": constants.MODULE_4_TABLE,
+}
+
+# Columns of the delivered address rows, in table order
+DELIVERY_COLUMNS = [
+    "delivery_id",
+    "delivery_date",
+    "Connect_ID",
+    "ts_user_profile_updated",
+    "address_src_question_cid",
+    "address_nickname",
+    "address_source",
+    "ts_address_delivered",
+    "historical_order",
+] + ADDRESS_FIELDS + [
+    "address_hash",
+    "address_fingerprint",
+    "fingerprint_version",
+]
+
+METADATA_COLUMNS = [
+    "delivery_id",
+    "delivery_date",
+    "Connect_ID",
+    "address_src_question_cid",
+    "address_nickname",
+    "address_hash",
+    "ts_address_delivered",
+    "address_source",
+    "historical_order",
+    "ts_user_profile_updated",
+    "address_fingerprint",
+    "fingerprint_version",
+]
+
+# Columns of the location map, in table order
+LOCATION_MAP_COLUMNS = [
+    "delivery_id",
+    "delivery_date",
+    "Connect_ID",
+    "address_src_question_cid",
+    "address_nickname",
+    "address_source",
+    "historical_order",
+    "address_hash",
+    "address_fingerprint",
+    "fingerprint_version",
+    "location_key",
+    "resolution",
+]
+
+# DuckDB names of the BigQuery types of the geocode fields
+GEOCODE_TYPES = {"FLOAT64": "DOUBLE", "STRING": "VARCHAR"}
+
+
+def snapshot_path(table, snapshot_dir=None):
+    """Path of the Parquet snapshot of a source table"""
+    if snapshot_dir is None:
+        snapshot_dir = constants.LOCAL_SNAPSHOT_DIR
+    return os.path.join(snapshot_dir, f"{SNAPSHOT_TABLES[table].split('.')[-1]}.parquet")
+
+
+def create_snapshots(bigquery_client, snapshot_dir=None):
+    """
+    Download the BigQuery source tables to local Parquet snapshots
+
+    Args:
+        bigquery_client: BigQuery client
+        snapshot_dir: Directory to write the snapshots to (defaults to LOCAL_SNAPSHOT_DIR)
+    """
+    import pyarrow.parquet as pa_parquet
+
+    for table, bigquery_table in SNAPSHOT_TABLES.items():
+        path = snapshot_path(table, snapshot_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrow_table = bigquery_client.query(
+            f"SELECT * FROM {bigquery_table}", timeout=constants.QUERY_TIMEOUT
+        ).to_arrow()
+        pa_parquet.write_table(arrow_table, path)
+        logger.info(f"Snapshot of {bigquery_table} written to {path} ({arrow_table.num_rows} rows)")
+
+
+# The fingerprint UDFs take the FINGERPRINT_FIELDS of a row as one list
+def _fingerprint_udf(rows):
+    return pa.array(
+        [fingerprint.fingerprint(dict(zip(fingerprint.FINGERPRINT_FIELDS, row))) for row in rows.to_pylist()],
+        type=pa.int64()
+    )
+
+
+def _legacy_hash_udf(rows):
+    return pa.array(
+        [fingerprint.legacy_address_hash(dict(zip(fingerprint.FINGERPRINT_FIELDS, row))) for row in rows.to_pylist()],
+        type=pa.string()
+    )
+
+
+def _location_key_udf(rows):
+    return pa.array(
+        [fingerprint.location_key(dict(zip(fingerprint.LOCATION_FIELDS, row))) for row in rows.to_pylist()],
+        type=pa.int64()
+    )
+
+
+def _normalize_udf(kind):
+    def normalize(values):
+        return normalization.normalize_values(values, kind)
+    return normalize
+
+
+def _register_functions(client):
+    """Register the fingerprint and normalization UDFs on a connection"""
+    client.create_function("address_fingerprint", _fingerprint_udf, ['VARCHAR[]'],
+                           'BIGINT', type='arrow', null_handling='special')
+    client.create_function("legacy_address_hash", _legacy_hash_udf, ['VARCHAR[]'],
+                           'VARCHAR', type='arrow', null_handling='special')
+    client.create_function("location_key", _location_key_udf, ['VARCHAR[]'],
+                           'BIGINT', type='arrow', null_handling='special')
+
+    for kind in normalization.KINDS:
+        client.create_function(f"normalize_{kind}", _normalize_udf(kind), ['VARCHAR'], 'VARCHAR',
+                               type='arrow', null_handling='special')
+
+
+def connect(database=None, snapshot_dir=None):
+    """
+    Open the local pipeline database
+
+    The source snapshots are attached as the views `participants` and
+    `module4`, and the pipeline UDFs are registered.
+
+    Args:
+        database: DuckDB database file (defaults to DUCKDB_DATABASE)
+        snapshot_dir: Directory holding the source snapshots (defaults to LOCAL_SNAPSHOT_DIR)
+
+    Returns:
+        DuckDB connection, used as the client of the backend functions
+    """
+    if database is None:
+        database = constants.DUCKDB_DATABASE
+    if database != ':memory:':
+        os.makedirs(os.path.dirname(database), exist_ok=True)
+
+    client = duckdb.connect(database)
+    for table in SNAPSHOT_TABLES:
+        path = snapshot_path(table, snapshot_dir).replace("'", "''")
+        client.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+    _register_functions(client)
+    return client
+
+
+def _normalized(field):
+    return f"normalize_{normalization.FIELD_KINDS[field]}({field})"
+
+
+def _column_type(column):
+    if column in ("delivery_date", "ts_user_profile_updated", "ts_address_delivered"):
+        return "TIMESTAMP"
+    if column in ("historical_order", "address_fingerprint", "fingerprint_version", "location_key"):
+        return "INT64"
+    return "STRING"
+
+
+def create_required_tables(client):
+    """Create required tables if they don't exist"""
+    logger.info("Creating required tables if they don't exist")
+
+    metadata_columns_sql = ",\n        ".join(
+        f"{column} {_column_type(column)}" for column in METADATA_COLUMNS
+    )
+    delivery_columns_sql = ",\n        ".join(
+        f"{column} {_column_type(column)}" for column in DELIVERY_COLUMNS
+    )
+
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (
+        {metadata_columns_sql}
+    )
+    """)
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {COMPREHENSIVE_TABLE} (
+        {delivery_columns_sql}
+    )
+    """)
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CURRENT_DELIVERY_TABLE} (
+        {delivery_columns_sql}
+    )
+    """)
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {COLLAPSE_MAP_TABLE} (
+        delivery_id STRING,
+        delivery_date TIMESTAMP,
+        Connect_ID STRING,
+        address_src_question_cid STRING,
+        address_nickname STRING,
+        address_source STRING,
+        historical_order INT64,
+        address_hash STRING,
+        address_fingerprint INT64,
+        fingerprint_version INT64,
+        representative_address_hash STRING,
+        representative_fingerprint INT64,
+        similarity DOUBLE
+    )
+    """)
+    location_map_columns_sql = ",\n        ".join(
+        f"{column} {_column_type(column)}" for column in LOCATION_MAP_COLUMNS
+    )
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {LOCATION_MAP_TABLE} (
+        {location_map_columns_sql}
+    )
+    """)
+    geocode_columns_sql = ",\n        ".join(
+        f"{field} {GEOCODE_TYPES[data_type]}" for field, data_type in geocodes.GEOCODE_FIELDS
+    )
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {GEOCODE_CACHE_TABLE} (
+        location_key INT64,
+        {geocode_columns_sql},
+        geocoded_at TIMESTAMP
+    )
+    """)
+    # Steps are kept as JSON; the local backend issues no jobs to record
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {RUN_STATS_TABLE} (
+        run_id STRING,
+        delivery_id STRING,
+        backend STRING,
+        status STRING,
+        error STRING,
+        started_at TIMESTAMP,
+        ended_at TIMESTAMP,
+        wall_seconds DOUBLE,
+        steps JSON
+    )
+    """)
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SUMMARY_STATS_TABLE} (
+        delivery_id STRING,
+        computed_at TIMESTAMP,
+        dimension STRING,
+        value STRING,
+        address_count INT64,
+        participant_count INT64
+    )
+    """)
+
+    logger.info("Required tables created/verified")
+
+
+def create_address_view(client):
+    """Create or update the address view"""
+    logger.info("Creating/updating address view")
+
+    combined_query = sql_compiler.compile_address_query(
+        tables={table: table for table in SNAPSHOT_TABLES}, dialect="duckdb"
+    )
+
+    standardized_sql = ",\n            ".join(
+        f"NULLIF(TRIM(CAST({field} AS STRING)), '') AS {field}" for field in ADDRESS_FIELDS
+    )
+    populated_sql = " OR\n            ".join(f"{field} IS NOT NULL" for field in ADDRESS_FIELDS)
+    fingerprint_args = ", ".join(fingerprint.FINGERPRINT_FIELDS)
+
+    client.execute(f"""
+    CREATE OR REPLACE VIEW {ADDRESSES_VIEW} AS
+    WITH standardized_addresses AS (
+        SELECT
+            CAST(Connect_ID AS STRING) AS Connect_ID,
+            TRY_CAST(ts_user_profile_updated AS TIMESTAMP) AS ts_user_profile_updated,
+            CAST(ts_address_delivered AS TIMESTAMP) AS ts_address_delivered,
+            CAST(address_src_question_cid AS STRING) AS address_src_question_cid,
+            CAST(address_nickname AS STRING) AS address_nickname,
+            CAST(address_source AS STRING) AS address_source,
+            CAST(historical_order AS INT64) AS historical_order,
+            {standardized_sql}
+        FROM (
+            {combined_query}
+        ) subquery
+    )
+    SELECT
+        *,
+        legacy_address_hash([{fingerprint_args}]) AS address_hash,
+        address_fingerprint([{fingerprint_args}]) AS address_fingerprint,
+        {fingerprint.FINGERPRINT_VERSION} AS fingerprint_version
+    FROM standardized_addresses
+    WHERE
+        {populated_sql}
+    """)
+    logger.info(f"Address view {ADDRESSES_VIEW} created/updated successfully")
+
+
+def stage_watermarks(client, delivery_id):
+    """Watermarks are not tracked locally; every participant of the snapshots is checked"""
+    logger.info("Local backend: checking every participant of the snapshots")
+
+
+def commit_watermarks(client, delivery_id):
+    """Watermarks are not tracked locally (see stage_watermarks)"""
+
+
+def refresh_addresses_table(client, full_rebuild=False):
+    """Rebuild the materialized addresses table from the address view"""
+    client.execute(f"""
+    CREATE OR REPLACE TABLE {ADDRESSES_TABLE} AS
+    SELECT *, CURRENT_TIMESTAMP AS ts_ingested
+    FROM {ADDRESSES_VIEW}
+    """)
+    count = client.execute(f"SELECT COUNT(*) FROM {ADDRESSES_TABLE}").fetchone()[0]
+    logger.info(f"Addresses table rebuilt with {count} rows")
+
+
+def backfill_fingerprints(client):
+    """Map delivered addresses to the current fingerprint version through their legacy address_hash"""
+    for table, representative in [(METADATA_TABLE, False), (COLLAPSE_MAP_TABLE, True)]:
+        representative_sql = (
+            f""",
+        representative_fingerprint = (
+            SELECT ANY_VALUE(r.address_fingerprint) FROM {ADDRESSES_TABLE} r
+            WHERE r.address_hash = {table}.representative_address_hash
+        )""" if representative else ""
+        )
+        client.execute(f"""
+        UPDATE {table}
+        SET
+            address_fingerprint = a.address_fingerprint,
+            fingerprint_version = a.fingerprint_version{representative_sql}
+        FROM (
+            SELECT
+                address_hash,
+                ANY_VALUE(address_fingerprint) AS address_fingerprint,
+                ANY_VALUE(fingerprint_version) AS fingerprint_version
+            FROM {ADDRESSES_TABLE}
+            GROUP BY address_hash
+        ) a
+        WHERE {table}.address_hash = a.address_hash
+          AND ({table}.fingerprint_version IS NULL OR {table}.fingerprint_version < a.fingerprint_version)
+        """)
+
+
+def _hash_index_dir():
+    """Directory of the delivered fingerprint index (HASH_INDEX_DIR, or next to the database)"""
+    if constants.HASH_INDEX_DIR:
+        return constants.HASH_INDEX_DIR
+    return os.path.join(os.path.dirname(os.path.abspath(constants.DUCKDB_DATABASE)), "hash_index")
+
+
+def _delivered_fingerprints_query(filter_deliveries=False):
+    """
+    Query selecting the fingerprints of delivered addresses
+
+    Delivered addresses are those in the metadata table, and the near-duplicates
+    collapsed into an address of the same delivery. With filter_deliveries, only
+    those of the deliveries in the $delivery_ids parameter.
+    """
+    delivery_filter = "AND list_contains($delivery_ids, m.delivery_id)" if filter_deliveries else ""
+    return f"""
+    SELECT m.address_fingerprint
+    FROM {METADATA_TABLE} m
+    WHERE m.address_fingerprint IS NOT NULL {delivery_filter}
+
+    UNION
+
+    SELECT c.address_fingerprint
+    FROM {COLLAPSE_MAP_TABLE} c
+    JOIN {METADATA_TABLE} m
+      ON m.delivery_id = c.delivery_id
+      AND m.address_fingerprint = c.representative_fingerprint
+    WHERE c.address_fingerprint IS NOT NULL {delivery_filter}
+    """
+
+
+def _load_hash_index(client):
+    """
+    Open the delivered fingerprint index, bringing it up to date with the metadata table
+
+    Deliveries recorded since the index was updated are added to it. The index
+    is rebuilt from the metadata table when it holds a delivery that no longer
+    exists or was built with another fingerprint version.
+
+    Returns:
+        HashIndex of the delivered fingerprints
+    """
+    index = hash_index.HashIndex(_hash_index_dir())
+    deliveries = {row[0] for row in client.execute(f"SELECT DISTINCT delivery_id FROM {METADATA_TABLE}").fetchall()}
+
+    if index.fingerprint_version != fingerprint.FINGERPRINT_VERSION or not index.deliveries <= deliveries:
+        logger.info(f"Rebuilding the delivered fingerprint index in {index.directory}")
+        query = _delivered_fingerprints_query()
+        count = client.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+        reader = client.execute(f"""
+        SELECT address_fingerprint FROM ({query}) ORDER BY address_fingerprint
+        """).to_arrow_reader()
+        index.rebuild((batch.column(0).to_numpy() for batch in reader), count,
+                      deliveries, fingerprint.FINGERPRINT_VERSION)
+    elif deliveries - index.deliveries:
+        missing = sorted(deliveries - index.deliveries)
+        fingerprints = client.execute(
+            _delivered_fingerprints_query(filter_deliveries=True), {"delivery_ids": missing}
+        ).fetchnumpy()["address_fingerprint"]
+        index.add(fingerprints, missing, fingerprint.FINGERPRINT_VERSION)
+    return index
+
+
+def _index_delivery(client, delivery_id):
+    """
+    Add the fingerprints of a recorded delivery to the delivered fingerprint index
+
+    The delivery is already recorded, so a failure does not fail the step.
+    The index is cleared instead, and the next identification rebuilds it from
+    the metadata table: a delivery it already lists would otherwise never get
+    the fingerprints it is missing.
+    """
+    try:
+        index = hash_index.HashIndex(_hash_index_dir())
+        if index.fingerprint_version != fingerprint.FINGERPRINT_VERSION:
+            return
+        fingerprints = client.execute(
+            _delivered_fingerprints_query(filter_deliveries=True), {"delivery_ids": [delivery_id]}
+        ).fetchnumpy()["address_fingerprint"]
+        index.add(fingerprints, [delivery_id], fingerprint.FINGERPRINT_VERSION)
+    except Exception as e:
+        logger.warning(f"Could not add delivery {delivery_id} to the fingerprint index, "
+                       f"clearing it to be rebuilt: {str(e)}")
+        try:
+            hash_index.HashIndex(_hash_index_dir()).clear()
+        except Exception as e:
+            logger.error(f"Could not clear the fingerprint index; remove {_hash_index_dir()} "
+                         f"before the next run: {str(e)}")
+
+
+def identify_new_addresses(client, delivery_id):
+    """
+    Identify new addresses that haven't been delivered yet
+
+    The distinct candidate fingerprints are streamed in record batches and
+    checked against the delivered fingerprint index; the current delivery is
+    then selected by the fingerprints not found. New addresses at a location
+    in the geocode cache are resolved from it rather than delivered.
+    """
+    logger.info(f"Identifying new addresses for delivery ID: {delivery_id}")
+
+    index = _load_hash_index(client)
+    reader = client.execute(f"""
+    SELECT DISTINCT address_fingerprint
+    FROM {ADDRESSES_TABLE}
+    WHERE address_fingerprint IS NOT NULL
+    """).to_arrow_reader()
+    new = [np.array([], dtype=np.int64)]
+    for batch in reader:
+        fingerprints = batch.column(0).to_numpy()
+        new.append(fingerprints[~index.contains(fingerprints)])
+
+    client.register("new_fingerprints", pa.table({"address_fingerprint": np.concatenate(new)}))
+    try:
+        client.execute(f"""
+        CREATE OR REPLACE TABLE {CURRENT_DELIVERY_TABLE} AS
+        SELECT
+          a.* EXCLUDE (ts_ingested) REPLACE (CURRENT_TIMESTAMP AS ts_address_delivered),
+          $delivery_id AS delivery_id,
+          CURRENT_TIMESTAMP AS delivery_date
+        FROM {ADDRESSES_TABLE} a
+        WHERE a.address_fingerprint IN (SELECT address_fingerprint FROM new_fingerprints)
+        """, {"delivery_id": delivery_id})
+    finally:
+        client.unregister("new_fingerprints")
+
+    if constants.RESOLVE_CACHED_GEOCODES:
+        cached_count = _resolve_cached_geocodes(client, delivery_id)
+        if cached_count:
+            logger.info(f"Resolved {cached_count} new addresses from the geocode cache")
+
+    count = client.execute(f"SELECT COUNT(*) FROM {CURRENT_DELIVERY_TABLE}").fetchone()[0]
+    logger.info(f"Found {count} new addresses")
+    return count
+
+
+def collapse_near_duplicates(client, delivery_id, similarity=None):
+    """
+    Collapse near-duplicate addresses of the same participant in the current delivery
+
+    See address_processing.collapse_near_duplicates; the similarity is
+    computed with DuckDB's levenshtein instead of EDIT_DISTANCE.
+
+    Returns:
+        Number of addresses left in the current delivery
+    """
+    if similarity is None:
+        similarity = constants.NEAR_DUPLICATE_SIMILARITY
+    logger.info(f"Collapsing near-duplicate addresses for delivery ID: {delivery_id}")
+
+    compare_fields = ["address_line_1", "address_line_2", "street_num", "street_name", "apartment_num", "city"]
+    compare_sql = ", ".join(_normalized(field) for field in compare_fields)
+
+    client.execute(f"DELETE FROM {COLLAPSE_MAP_TABLE} WHERE delivery_id = $delivery_id", {"delivery_id": delivery_id})
+
+    client.execute(f"""
+    CREATE OR REPLACE TEMP TABLE ranked AS
+    SELECT
+        *,
+        ROW_NUMBER() OVER (
+            PARTITION BY Connect_ID
+            ORDER BY COALESCE(historical_order, 0), historical_order IS NULL,
+                address_src_question_cid, address_fingerprint
+        ) AS row_rank,
+        {_normalized('zip_code')} AS block_zip,
+        COALESCE(
+            {_normalized('street_num')},
+            regexp_extract({_normalized('address_line_1')}, '^([0-9]+) ', 1)
+        ) AS block_number,
+        concat_ws(' ', {compare_sql}) AS compare_text
+    FROM {CURRENT_DELIVERY_TABLE}
+    """)
+
+    client.execute("""
+    CREATE OR REPLACE TEMP TABLE similar_pairs AS
+    SELECT Connect_ID, row_rank, similar_rank, similarity
+    FROM (
+        SELECT
+            a.Connect_ID,
+            a.row_rank,
+            b.row_rank AS similar_rank,
+            1 - levenshtein(a.compare_text, b.compare_text)
+                / GREATEST(LENGTH(a.compare_text), LENGTH(b.compare_text), 1) AS similarity
+        FROM ranked a
+        JOIN ranked b
+            ON a.Connect_ID = b.Connect_ID
+            AND a.block_zip = b.block_zip
+            AND a.block_number = b.block_number
+            AND b.row_rank < a.row_rank
+    )
+    WHERE similarity >= $similarity
+    """, {"similarity": similarity})
+
+    client.execute("""
+    CREATE OR REPLACE TEMP TABLE collapsed AS
+    SELECT p.Connect_ID, p.row_rank, p.similar_rank AS representative_rank, p.similarity
+    FROM similar_pairs p
+    LEFT JOIN (SELECT DISTINCT Connect_ID, row_rank FROM similar_pairs) n
+        ON n.Connect_ID = p.Connect_ID AND n.row_rank = p.similar_rank
+    WHERE n.row_rank IS NULL
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY p.Connect_ID, p.row_rank ORDER BY p.similar_rank) = 1
+    """)
+
+    client.execute(f"""
+    INSERT INTO {COLLAPSE_MAP_TABLE}
+    SELECT
+        r.delivery_id, r.delivery_date, r.Connect_ID, r.address_src_question_cid, r.address_nickname,
+        r.address_source, r.historical_order, r.address_hash, r.address_fingerprint, r.fingerprint_version,
+        rep.address_hash, rep.address_fingerprint, c.similarity
+    FROM collapsed c
+    JOIN ranked r ON r.Connect_ID = c.Connect_ID AND r.row_rank = c.row_rank
+    JOIN ranked rep ON rep.Connect_ID = c.Connect_ID AND rep.row_rank = c.representative_rank
+    """)
+
+    client.execute(f"""
+    CREATE OR REPLACE TABLE {CURRENT_DELIVERY_TABLE} AS
+    SELECT r.* EXCLUDE (row_rank, block_zip, block_number, compare_text)
+    FROM ranked r
+    ANTI JOIN collapsed c ON c.Connect_ID = r.Connect_ID AND c.row_rank = r.row_rank
+    """)
+
+    collapsed_count = client.execute("SELECT COUNT(*) FROM collapsed").fetchone()[0]
+    remaining_count = client.execute(f"SELECT COUNT(*) FROM {CURRENT_DELIVERY_TABLE}").fetchone()[0]
+    logger.info(f"Collapsed {collapsed_count} near-duplicate addresses, {remaining_count} left to deliver")
+    return remaining_count
+
+
+def _record_delivery(client):
+    """Insert the current delivery into the metadata and comprehensive tables"""
+    metadata_columns_sql = ", ".join(METADATA_COLUMNS)
+    delivery_columns_sql = ", ".join(DELIVERY_COLUMNS)
+    client.execute(f"""
+    INSERT INTO {METADATA_TABLE} ({metadata_columns_sql})
+    SELECT {metadata_columns_sql} FROM {CURRENT_DELIVERY_TABLE}
+    """)
+    client.execute(f"""
+    INSERT INTO {COMPREHENSIVE_TABLE} ({delivery_columns_sql})
+    SELECT {delivery_columns_sql} FROM {CURRENT_DELIVERY_TABLE}
+    """)
+
+
+def _in_transaction(client, function, *args):
+    """Call function in a transaction, rolling it back if the function raises"""
+    client.execute("BEGIN TRANSACTION")
+    try:
+        result = function(*args)
+    except Exception:
+        client.execute("ROLLBACK")
+        raise
+    client.execute("COMMIT")
+    return result
+
+
+def update_metadata(client, delivery_id):
+    """Update metadata and comprehensive tables with new addresses, in one transaction"""
+    logger.info(f"Updating metadata for delivery ID: {delivery_id}")
+
+    def update():
+        _record_delivery(client)
+        record_step(client, delivery_id, "update_metadata")
+
+    _in_transaction(client, update)
+    _index_delivery(client, delivery_id)
+
+    logger.info("Metadata updated successfully")
+
+
+def deliver_new_addresses(client, delivery_id):
+    """
+    Identify new addresses and record them as delivered, in one transaction
+
+    See address_processing.deliver_new_addresses.
+
+    Returns:
+        Number of new addresses
+    """
+    def deliver():
+        count = identify_new_addresses(client, delivery_id)
+        _record_delivery(client)
+        record_step(client, delivery_id, "deliver_new_addresses", count)
+        return count
+
+    count = _in_transaction(client, deliver)
+    if count > 0:
+        _index_delivery(client, delivery_id)
+    return count
+
+
+def _with_location_key_query(source):
+    """Query selecting every row of source (a table or subquery) with the location key of its address"""
+    return f"SELECT *, location_key([{', '.join(fingerprint.LOCATION_FIELDS)}]) AS location_key FROM {source}"
+
+
+def _record_locations(client, delivery_id, source, resolution):
+    """Replace the location map rows of a delivery with one resolution by the addresses of source"""
+    client.execute(f"DELETE FROM {LOCATION_MAP_TABLE} WHERE delivery_id = $delivery_id AND resolution = $resolution",
+                   {"delivery_id": delivery_id, "resolution": resolution})
+    columns_sql = ", ".join(LOCATION_MAP_COLUMNS[:-1])
+    client.execute(f"""
+    INSERT INTO {LOCATION_MAP_TABLE} ({columns_sql}, resolution)
+    SELECT {columns_sql}, $resolution FROM {source}
+    """, {"resolution": resolution})
+
+
+def _resolve_cached_geocodes(client, delivery_id):
+    """
+    Take the new addresses at a location in the geocode cache out of the current delivery
+
+    See address_processing._resolve_cached_geocodes_statements.
+
+    Returns:
+        Number of addresses resolved from the cache
+    """
+    client.execute(f"""
+    CREATE OR REPLACE TEMP TABLE cache_hits AS
+    SELECT a.*
+    FROM ({_with_location_key_query(CURRENT_DELIVERY_TABLE)}) a
+    SEMI JOIN {GEOCODE_CACHE_TABLE} g ON g.location_key = a.location_key
+    """)
+    _record_locations(client, delivery_id, "cache_hits", "cache")
+    client.execute(f"""
+    DELETE FROM {CURRENT_DELIVERY_TABLE}
+    WHERE address_fingerprint IN (SELECT address_fingerprint FROM cache_hits)
+    """)
+    return client.execute("SELECT COUNT(*) FROM cache_hits").fetchone()[0]
+
+
+def map_locations(client, delivery_id):
+    """
+    Collapse the current delivery into its distinct locations, in one transaction
+
+    See address_processing.map_locations.
+
+    Returns:
+        Number of distinct locations
+    """
+    logger.info(f"Mapping the addresses of delivery {delivery_id} to their locations")
+
+    # Addresses sharing a key share their normalized fields
+    normalized_sql = ",\n        ".join(
+        f"ANY_VALUE({_normalized(field)}) AS {field}" for field in fingerprint.LOCATION_FIELDS
+    )
+
+    def map_addresses():
+        client.execute(f"CREATE OR REPLACE TEMP TABLE located AS {_with_location_key_query(CURRENT_DELIVERY_TABLE)}")
+        _record_locations(client, delivery_id, "located", "export")
+        client.execute(f"""
+        CREATE OR REPLACE TABLE {CURRENT_LOCATIONS_TABLE} AS
+        SELECT
+            CAST($delivery_id AS STRING) AS delivery_id,
+            MIN(delivery_date) AS delivery_date,
+            location_key,
+            {normalized_sql},
+            COUNT(*) AS address_count,
+            COUNT(DISTINCT Connect_ID) AS participant_count
+        FROM located
+        GROUP BY location_key
+        """, {"delivery_id": delivery_id})
+        return client.execute(f"SELECT COUNT(*) FROM {CURRENT_LOCATIONS_TABLE}").fetchone()[0]
+
+    location_count = _in_transaction(client, map_addresses)
+    logger.info(f"Mapped the addresses of delivery {delivery_id} to {location_count} distinct locations")
+    return location_count
+
+
+def _export_source(unique_locations):
+    """Table an export reads, the column its rows are sharded by and the order of the rows in a shard"""
+    if unique_locations:
+        return CURRENT_LOCATIONS_TABLE, "location_key", "location_key"
+    return CURRENT_DELIVERY_TABLE, "Connect_ID", "Connect_ID, address_nickname, historical_order"
+
+
+def _export_shard(cursor, source, shard, shard_count, path, file_format):
+    """Write one shard of an export source (see _export_source) to its file, on its own cursor"""
+    table, shard_column, order_sql = source
+    query = f"""
+        SELECT * FROM {table}
+        WHERE hash({shard_column}) % {shard_count} = {shard}
+        ORDER BY {order_sql}
+    """
+    try:
+        if file_format == 'xlsx':
+            reader = cursor.execute(query).to_arrow_reader()
+            row_count = local_export.write_batches(reader, path, file_format, schema=reader.schema)
+        else:
+            options = "FORMAT parquet" if file_format == 'parquet' else "FORMAT csv, HEADER"
+            row_count = cursor.execute(f"""
+            COPY ({query}) TO '{path.replace("'", "''")}' ({options})
+            """).fetchone()[0]
+    finally:
+        cursor.close()
+    return local_export.describe_shard(shard, path, row_count)
+
+
+def _export_local_shards(client, delivery_id, local_dir, base_name, file_format, unique_locations=False):
+    """
+    Export the current delivery to local shard files written in parallel
+
+    Participants are spread over the shards by a hash of their Connect_ID (see
+    local_export.py), distinct locations by their location key. Each shard is sorted and written on its own cursor, up to
+    LOCAL_EXPORT_WORKERS at once, by threads rather than processes: DuckDB
+    runs queries outside the GIL, and only one process can open the database.
+
+    Returns:
+        Path of the index file listing the shards
+    """
+    source = _export_source(unique_locations)
+    row_count = client.execute(f"SELECT COUNT(*) FROM {source[0]}").fetchone()[0]
+    shard_count = local_export.shard_count(row_count)
+
+    with ThreadPoolExecutor(max_workers=min(constants.LOCAL_EXPORT_WORKERS, shard_count)) as executor:
+        futures = [
+            executor.submit(_export_shard, client.cursor(), source, shard, shard_count,
+                            local_export.shard_path(local_dir, base_name, shard, file_format), file_format)
+            for shard in range(shard_count)
+        ]
+        shards = [future.result() for future in futures]
+
+    index_path = local_export.write_index(local_dir, base_name, delivery_id, file_format, shards)
+    logger.info(f"Addresses exported successfully to {local_dir}: {row_count} rows in "
+                f"{shard_count} {file_format} shards, index {index_path}")
+    return index_path
+
+
+def export_addresses(client, delivery_id, local_export=True, local_dir=None, unique_locations=False):
+    """
+    Export addresses to local shard files in LOCAL_EXPORT_FORMAT
+
+    Args:
+        client: DuckDB connection
+        delivery_id: ID for this delivery
+        local_export: Ignored, exports are always local
+        local_dir: Directory to save the files (optional)
+        unique_locations: If True, export distinct locations instead of
+                          addresses (see address_processing.export_addresses)
+
+    Returns:
+        Path of the index file listing the shards
+    """
+    logger.info(f"Exporting addresses for delivery ID: {delivery_id}")
+
+    delivery_date = datetime.datetime.now().strftime('%Y%m%d')
+    if local_dir is None:
+        local_dir = os.path.join(os.getcwd(), 'exports', delivery_date)
+    os.makedirs(local_dir, exist_ok=True)
+
+    if unique_locations:
+        map_locations(client, delivery_id)
+    base_name = f"norc_{'locations' if unique_locations else 'addresses'}_{delivery_date}"
+    return _export_local_shards(client, delivery_id, local_dir, base_name,
+                                constants.LOCAL_EXPORT_FORMAT, unique_locations)
+
+
+def current_delivery_id(client):
+    """Delivery ID of the current delivery table, or None if it is empty (see address_processing.current_delivery_id)"""
+    row = client.execute(f"SELECT delivery_id FROM {CURRENT_DELIVERY_TABLE} LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def ingest_geocodes(client, uris):
+    """
+    Load returned geocode result files and merge them into the geocode cache
+
+    See address_processing.ingest_geocodes; DuckDB reads the local files directly.
+
+    Args:
+        client: DuckDB connection
+        uris: Paths of CSV (with a header row, optionally gzipped) or Parquet result files
+
+    Returns:
+        Number of cached geocodes inserted or updated
+    """
+    logger.info(f"Ingesting geocode results from {len(uris)} files")
+
+    readers = []
+    for source_format in sorted({geocodes.result_format(uri) for uri in uris}):
+        paths_sql = ", ".join(
+            "'" + uri.replace("'", "''") + "'" for uri in uris if geocodes.result_format(uri) == source_format
+        )
+        function = "read_parquet" if source_format == 'PARQUET' else "read_csv"
+        readers.append(f"SELECT * FROM {function}([{paths_sql}], union_by_name = true)")
+    client.execute(f"CREATE OR REPLACE TEMP TABLE geocode_results AS {' UNION ALL BY NAME '.join(readers)}")
+
+    columns = {row[0].lower() for row in client.execute("DESCRIBE geocode_results").fetchall()}
+    fields_sql = ", ".join(
+        f"CAST({field} AS {GEOCODE_TYPES[data_type]}) AS {field}" if field in columns
+        else f"CAST(NULL AS {GEOCODE_TYPES[data_type]}) AS {field}"
+        for field, data_type in geocodes.GEOCODE_FIELDS
+    )
+    address_fields = geocodes.result_address_fields(columns)
+    key_sql = "CAST(location_key AS INT64)" if 'location_key' in columns else "CAST(NULL AS INT64)"
+    if address_fields:
+        # Rows without a location_key get the key of their address fields
+        address_sql = ", ".join(
+            f"CAST({field} AS STRING) AS {field}" if field in address_fields else f"CAST(NULL AS STRING) AS {field}"
+            for field in fingerprint.LOCATION_FIELDS
+        )
+        results_query = f"""
+        SELECT * REPLACE (COALESCE(result_location_key, location_key) AS location_key)
+        FROM ({_with_location_key_query(f"(SELECT {key_sql} AS result_location_key, {address_sql}, {fields_sql} FROM geocode_results)")})
+        """
+    else:
+        results_query = f"SELECT {key_sql} AS location_key, {fields_sql} FROM geocode_results"
+
+    field_names = ", ".join(field for field, _ in geocodes.GEOCODE_FIELDS)
+    required_sql = " AND ".join(f"{field} IS NOT NULL" for field in ["location_key"] + geocodes.REQUIRED_FIELDS)
+
+    def merge():
+        client.execute(f"""
+        CREATE OR REPLACE TEMP TABLE merged_geocodes AS
+        SELECT location_key, {field_names}
+        FROM ({results_query})
+        WHERE {required_sql}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY location_key ORDER BY match_score DESC NULLS LAST) = 1
+        """)
+        client.execute(f"""
+        DELETE FROM {GEOCODE_CACHE_TABLE}
+        WHERE location_key IN (SELECT location_key FROM merged_geocodes)
+        """)
+        client.execute(f"""
+        INSERT INTO {GEOCODE_CACHE_TABLE} (location_key, {field_names}, geocoded_at)
+        SELECT location_key, {field_names}, CURRENT_TIMESTAMP FROM merged_geocodes
+        """)
+        return client.execute("SELECT COUNT(*) FROM merged_geocodes").fetchone()[0]
+
+    merged = _in_transaction(client, merge)
+    logger.info(f"Merged {merged} geocodes into {GEOCODE_CACHE_TABLE}")
+    return merged
+
+
+def delete_delivery(client, delivery_id):
+    """Delete a delivery from the metadata tables"""
+    logger.info(f"Deleting delivery ID: {delivery_id}")
+
+    for table in [METADATA_TABLE, COMPREHENSIVE_TABLE, COLLAPSE_MAP_TABLE, LOCATION_MAP_TABLE, RUN_STATE_TABLE,
+                  SUMMARY_STATS_TABLE]:
+        client.execute(f"DELETE FROM {table} WHERE delivery_id = $delivery_id", {"delivery_id": delivery_id})
+
+    # Fingerprints cannot be removed from the Bloom filter; the index is
+    # rebuilt by the next identification
+    hash_index.HashIndex(_hash_index_dir()).clear()
+
+    logger.info(f"Successfully deleted delivery: {delivery_id}")
+
+
+def compute_delivery_stats(client, delivery_ids):
+    """
+    Compute the summary statistics of deliveries and store them in the summary stats table
+
+    The delivered addresses are read once, grouped four ways with GROUPING
+    SETS, and written as rows of SUMMARY_STATS_TABLE replacing any previous
+    statistics of the same deliveries (see address_processing.compute_delivery_stats).
+
+    Args:
+        client: DuckDB connection
+        delivery_ids: IDs of the deliveries to compute
+    """
+    completeness_sql = ",\n        ".join(
+        f"COUNTIF({field} IS NOT NULL) AS {field}_count" for field in reporting.COMPLETENESS_FIELDS
+    )
+    completeness_structs = ",\n            ".join(
+        f"{{'field': '{field}', 'address_count': {field}_count}}" for field in reporting.COMPLETENESS_FIELDS
+    )
+
+    def compute():
+        client.execute(f"""
+        CREATE OR REPLACE TEMP TABLE grouped AS
+        SELECT
+            delivery_id,
+            GROUPING(address_nickname) = 0 AS by_nickname,
+            GROUPING(address_source) = 0 AS by_source,
+            GROUPING(Connect_ID) = 0 AS by_participant,
+            address_nickname,
+            address_source,
+            COUNT(*) AS address_count,
+            COUNT(DISTINCT Connect_ID) AS participant_count,
+            {completeness_sql}
+        FROM {COMPREHENSIVE_TABLE}
+        WHERE delivery_id IN (SELECT UNNEST($delivery_ids))
+        GROUP BY GROUPING SETS (
+            (delivery_id),
+            (delivery_id, address_nickname),
+            (delivery_id, address_source),
+            (delivery_id, Connect_ID)
+        )
+        """, {"delivery_ids": list(delivery_ids)})
+        client.execute(f"DELETE FROM {SUMMARY_STATS_TABLE} WHERE delivery_id IN (SELECT UNNEST($delivery_ids))",
+                       {"delivery_ids": list(delivery_ids)})
+        client.execute(f"""
+        INSERT INTO {SUMMARY_STATS_TABLE}
+        WITH totals AS (
+            SELECT * FROM grouped
+            WHERE NOT by_nickname AND NOT by_source AND NOT by_participant
+        )
+        SELECT delivery_id, CURRENT_TIMESTAMP, 'total', NULL, address_count, participant_count
+        FROM totals
+        UNION ALL
+        SELECT delivery_id, CURRENT_TIMESTAMP, 'nickname', address_nickname, address_count, participant_count
+        FROM grouped
+        WHERE by_nickname
+        UNION ALL
+        SELECT delivery_id, CURRENT_TIMESTAMP, 'source', address_source, address_count, participant_count
+        FROM grouped
+        WHERE by_source
+        UNION ALL
+        SELECT delivery_id, CURRENT_TIMESTAMP, 'distribution', CAST(address_count AS STRING),
+            SUM(address_count), COUNT(*)
+        FROM grouped
+        WHERE by_participant
+        GROUP BY delivery_id, address_count
+        UNION ALL
+        SELECT delivery_id, CURRENT_TIMESTAMP, 'completeness', completeness.field, completeness.address_count, NULL
+        FROM (
+            SELECT delivery_id, UNNEST([
+                {completeness_structs}
+            ]) AS completeness
+            FROM totals
+        )
+        """)
+        client.execute("DROP TABLE grouped")
+
+    _in_transaction(client, compute)
+    logger.info(f"Computed summary statistics of {len(delivery_ids)} deliveries")
+
+
+def generate_summary_statistics(client, delivery_id=None):
+    """
+    Generate summary statistics for addresses and print them as ASCII tables
+
+    As in address_processing.generate_summary_statistics, the statistics of a
+    delivery are computed once and stored, and the report for all deliveries
+    is rolled up from the stored statistics, with its participants counted
+    from the delivered addresses (see reporting.participants_query).
+
+    Args:
+        client: DuckDB connection
+        delivery_id: Optional ID to filter for a specific delivery
+
+    Returns:
+        Dictionary containing summary statistics
+    """
+    logger.info("Generating summary statistics...")
+
+    if delivery_id:
+        # Recompute, in case the delivery was rerun since its statistics were stored
+        compute_delivery_stats(client, [delivery_id])
+    else:
+        missing = [row[0] for row in client.execute(f"""
+        SELECT DISTINCT delivery_id
+        FROM {METADATA_TABLE}
+        WHERE delivery_id NOT IN (SELECT delivery_id FROM {SUMMARY_STATS_TABLE})
+        """).fetchall()]
+        if missing:
+            compute_delivery_stats(client, missing)
+
+    # Roll the stored statistics up over the requested deliveries
+    delivery_filter = "WHERE delivery_id = $delivery_id" if delivery_id else ""
+    parameters = {"delivery_id": delivery_id} if delivery_id else {}
+    cursor = client.execute(f"""
+    SELECT
+        dimension,
+        value,
+        SUM(address_count) AS address_count,
+        SUM(participant_count) AS participant_count
+    FROM {SUMMARY_STATS_TABLE}
+    {delivery_filter}
+    GROUP BY dimension, value
+    """, parameters)
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    participant_rows = None
+    if not delivery_id:
+        cursor = client.execute(reporting.participants_query(COMPREHENSIVE_TABLE))
+        columns = [column[0] for column in cursor.description]
+        participant_rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    stats = reporting.build_summary_statistics(delivery_id, reporting.rollup_results(rows, participant_rows))
+    reporting.print_summary_statistics(stats)
+    return stats
+
+
+def record_run_stats(client, report):
+    """
+    Append a run report (see instrumentation.py) to the run stats table
+
+    Args:
+        client: DuckDB connection
+        report: Run report built by PipelineRun.report
+    """
+    client.execute(f"""
+    INSERT INTO {RUN_STATS_TABLE}
+    VALUES ($run_id, $delivery_id, $backend, $status, $error,
+            CAST($started_at AS TIMESTAMP), CAST($ended_at AS TIMESTAMP), $wall_seconds, $steps)
+    """, {
+        "run_id": report["run_id"],
+        "delivery_id": report["delivery_id"],
+        "backend": report["backend"],
+        "status": report["status"],
+        "error": report["error"],
+        "started_at": report["started_at"],
+        "ended_at": report["ended_at"],
+        "wall_seconds": report["wall_seconds"],
+        "steps": json.dumps(report["steps"]),
+    })
+    logger.info(f"Run stats recorded in {RUN_STATS_TABLE}")
+
+
+def load_run_state(client, delivery_id):
+    """
+    Load the steps earlier runs of a delivery completed
+
+    Returns:
+        Dictionary of completed step name to its output
+    """
+    client.execute(f"""
+    CREATE TABLE IF NOT EXISTS {RUN_STATE_TABLE} (
+        delivery_id STRING,
+        step STRING,
+        completed_at TIMESTAMP,
+        output STRING
+    )
+    """)
+    rows = client.execute(
+        f"SELECT step, output FROM {RUN_STATE_TABLE} WHERE delivery_id = $delivery_id", {"delivery_id": delivery_id}
+    ).fetchall()
+    return {step: json.loads(output) if output else None for step, output in rows}
+
+
+def record_step(client, delivery_id, step, output=None):
+    """Record a step of a delivery as completed (see address_processing.record_step)"""
+    client.execute(f"DELETE FROM {RUN_STATE_TABLE} WHERE delivery_id = $delivery_id AND step = $step",
+                   {"delivery_id": delivery_id, "step": step})
+    client.execute(f"INSERT INTO {RUN_STATE_TABLE} VALUES ($delivery_id, $step, CURRENT_TIMESTAMP, $output)",
+                   {"delivery_id": delivery_id, "step": step, "output": json.dumps(output, default=str)})
@@ -0,0 +1,141 @@
+import hashlib
+import constants
+import normalization
+from address_registry import ADDRESS_FIELDS
+
+# Versioned address fingerprints
+#
+# Version 1 is the legacy address_hash: TO_HEX(MD5(CONCAT(...))) over the raw
+# fields, a 32 character STRING. CONCAT without a separator lets different
+# splits of the same characters collide ('12' + '3 Main' vs '1' + '23 Main').
+#
+# Version 2 serializes the fields delimiter-safely (every value escaped, NULL
+# distinct from '') and keeps the first 64 bits of its MD5 as a signed INT64.
+# MD5 is used rather than FARM_FINGERPRINT so the same fingerprint can be
+# computed in Python and in local backends, not only in BigQuery.
+#
+# Version 3 serializes the address fields after normalization (see
+# normalization.py), so spelling variants of one address share a fingerprint.
+#
+# Version 4 upper-cases only ASCII letters during normalization, so Python and
+# BigQuery agree on addresses holding other letters.
+#
+# Bump FINGERPRINT_VERSION whenever the serialization or its inputs change;
+# delivered addresses fingerprinted with an older version are re-mapped through
+# their legacy address_hash (see address_processing.backfill_fingerprints).
+#
+# Location keys are fingerprints of the normalized address fields alone,
+# without the participant and question fields, so every participant living at
+# the same physical address shares one key. They identify the rows of a
+# unique-location export (see address_processing.map_locations).
+LEGACY_VERSION = 1
+NORMALIZED_VERSION = 3  # First version fingerprinting normalized address fields
+FINGERPRINT_VERSION = 4
+
+# Fields identifying an address, in serialization order
+FINGERPRINT_FIELDS = [
+    "Connect_ID",
+    "address_src_question_cid",
+    "address_nickname",
+    "address_source",
+] + ADDRESS_FIELDS
+
+# Fields identifying a physical address, in serialization order
+LOCATION_FIELDS = ADDRESS_FIELDS
+
+SEPARATOR = "|"
+ESCAPE = "\\"
+NULL_MARKER = "\\N"
+
+
+def _escape(value):
+    """Escape one field value for the canonical serialization"""
+    if value is None:
+        return NULL_MARKER
+    return str(value).replace(ESCAPE, ESCAPE * 2).replace(SEPARATOR, ESCAPE + SEPARATOR)
+
+
+def canonical_string(record, version=FINGERPRINT_VERSION, fields=None):
+    """
+    Serialize an address record delimiter-safely
+
+    Args:
+        record: Mapping of field name to value (missing fields are NULL)
+        version: Fingerprint version prefixed to the serialization
+        fields: Fields to serialize (defaults to FINGERPRINT_FIELDS)
+
+    Returns:
+        Canonical string the fingerprint is computed from
+    """
+    if fields is None:
+        fields = FINGERPRINT_FIELDS
+    if version >= NORMALIZED_VERSION:
+        record = normalization.normalize_record(record)
+    values = [f"v{version}"] + [_escape(record.get(field)) for field in fields]
+    return SEPARATOR.join(values)
+
+
+def fingerprint_canonical(canonical):
+    """Fingerprint a canonical string: the first 64 bits of its MD5 as a signed integer"""
+    digest = hashlib.md5(canonical.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def fingerprint(record):
+    """Compute the current-version fingerprint of an address record"""
+    return fingerprint_canonical(canonical_string(record))
+
+
+def location_key(record):
+    """Compute the location key of an address record (see LOCATION_FIELDS)"""
+    return fingerprint_canonical(canonical_string(record, fields=LOCATION_FIELDS))
+
+
+def legacy_address_hash(record):
+    """Compute the version 1 address_hash of an address record"""
+    concatenated = "".join(record.get(field) or "" for field in FINGERPRINT_FIELDS)
+    return hashlib.md5(concatenated.encode('utf-8')).hexdigest()
+
+
+def sql_canonical_expression(alias=None, version=FINGERPRINT_VERSION, udf_dataset=None, fields=None):
+    """
+    BigQuery expression serializing an address row like canonical_string()
+
+    From NORMALIZED_VERSION on, address fields are passed through the
+    normalization UDFs created in udf_dataset (defaults to NORMALIZATION_UDF_DATASET).
+    """
+    prefix = f"{alias}." if alias else ""
+    if udf_dataset is None:
+        udf_dataset = constants.NORMALIZATION_UDF_DATASET
+    if fields is None:
+        fields = FINGERPRINT_FIELDS
+
+    columns = []
+    for field in fields:
+        column = f"{prefix}{field}"
+        if version >= NORMALIZED_VERSION and field in normalization.FIELD_KINDS:
+            column = normalization.sql_normalize_expression(field, column, udf_dataset)
+        columns.append(column)
+
+    values = [f"'v{version}'"] + [
+        rf"IFNULL(REPLACE(REPLACE({column}, '\\', '\\\\'), '|', '\\|'), '\\N')"
+        for column in columns
+    ]
+    values_sql = ",\n        ".join(values)
+    return f"ARRAY_TO_STRING([\n        {values_sql}\n    ], '{SEPARATOR}')"
+
+
+def sql_digest_to_fingerprint(digest):
+    """BigQuery expression turning an MD5 digest (BYTES) into the INT64 fingerprint"""
+    # There is no BYTES to INT64 cast, so the two 32-bit halves are cast from hex
+    return (
+        f"((CAST(CONCAT('0x', TO_HEX(SUBSTR({digest}, 1, 4))) AS INT64) << 32) "
+        f"| CAST(CONCAT('0x', TO_HEX(SUBSTR({digest}, 5, 4))) AS INT64))"
+    )
+
+
+def sql_legacy_hash_expression(alias=None):
+    """BigQuery expression computing the version 1 address_hash"""
+    prefix = f"{alias}." if alias else ""
+    values_sql = ",\n        ".join(f"IFNULL({prefix}{field}, '')" for field in FINGERPRINT_FIELDS)
+    return f"TO_HEX(MD5(CONCAT(\n        {values_sql}\n    )))"
@@ -0,0 +1,68 @@
+from fingerprint import LOCATION_FIELDS
+
+# Returned geocodes shared by the execution backends
+#
+# The vendor returns one result row per exported row: a location of a
+# unique-location export, identified by its location_key, or an address of an
+# address export, carrying the address fields its location key is computed
+# from. Result files are bulk-loaded and merged into the geocode cache, keyed
+# by location key, so an address already geocoded for any participant or
+# delivery is resolved from the cache instead of being delivered again.
+
+# Geocode fields of a result row and of the geocode cache, with their BigQuery types
+GEOCODE_FIELDS = [
+    ("latitude", "FLOAT64"),
+    ("longitude", "FLOAT64"),
+    ("fips_code", "STRING"),  # Census block FIPS code
+    ("match_status", "STRING"),
+    ("match_score", "FLOAT64"),
+]
+
+# Fields every result file must have; results missing either value are not cached
+REQUIRED_FIELDS = ["latitude", "longitude"]
+
+# Load format of result files, by extension
+RESULT_FORMATS = {
+    '.csv': 'CSV',
+    '.csv.gz': 'CSV',
+    '.parquet': 'PARQUET',
+}
+
+
+def result_format(uri):
+    """
+    Load format of a result file from its extension
+
+    Args:
+        uri: gs:// URI or local path of a result file
+
+    Returns:
+        'CSV' or 'PARQUET'
+    """
+    for extension, source_format in RESULT_FORMATS.items():
+        if uri.lower().endswith(extension):
+            return source_format
+    raise ValueError(f"Unsupported geocode result file {uri} (expected one of {', '.join(RESULT_FORMATS)})")
+
+
+def result_address_fields(columns):
+    """
+    Check the columns of loaded result files
+
+    Results are keyed by their location_key column; rows without one get the
+    location key of their address fields.
+
+    Args:
+        columns: Column names of the loaded results
+
+    Returns:
+        The LOCATION_FIELDS among the columns, to compute missing location keys from
+    """
+    columns = {column.lower() for column in columns}
+    missing = [field for field in REQUIRED_FIELDS if field not in columns]
+    if missing:
+        raise ValueError(f"Geocode results are missing the columns {', '.join(missing)}")
+    address_fields = [field for field in LOCATION_FIELDS if field in columns]
+    if 'location_key' not in columns and not address_fields:
+        raise ValueError("Geocode results have neither a location_key nor any address field column")
+    return address_fields
@@ -0,0 +1,283 @@
+import os
+import json
+import math
+import numpy as np
+
+# Persistent on-disk index of delivered address fingerprints
+#
+# The local backend checks candidate addresses against every fingerprint ever
+# delivered. Instead of holding that history in memory, HashIndex keeps it on
+# disk as sorted segments of INT64 fingerprints (.npy files, memory-mapped for
+# lookups) behind a Bloom filter (a memory-mapped bit array). Most candidates
+# are new addresses, which the Bloom filter rejects without touching the
+# segments; the rest are binary searched in each segment. Lookups and updates
+# work on numpy arrays of whole batches.
+#
+# New fingerprints are appended as a small sorted segment. Segments are merged
+# pairwise, streaming in chunks, once the newer one has grown to about the size
+# of the older one, so there are O(log n) segments. Resident memory stays a
+# few chunks plus the pages of the files the OS keeps cached: the Bloom filter
+# takes about 1.2 bytes and the segments 8 bytes per fingerprint on disk.
+#
+# meta.json lists the segments, the Bloom filter parameters and the deliveries
+# indexed; it is replaced atomically after the files it lists are written, so
+# an interrupted update leaves the previous index intact.
+
+# Target false positive rate of the Bloom filter at its capacity
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+# Smallest Bloom filter capacity, in fingerprints
+MIN_BLOOM_CAPACITY = 1_000_000
+
+# Fingerprints processed at once when merging segments or rebuilding the Bloom filter
+CHUNK_SIZE = 1_000_000
+
+META_FILE = "meta.json"
+
+
+def _bloom_parameters(capacity):
+    """Bits and hash functions of a Bloom filter holding capacity items at BLOOM_FALSE_POSITIVE_RATE"""
+    bits = math.ceil(-capacity * math.log(BLOOM_FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    # Round up to whole bytes
+    return -(-bits // 8) * 8, hashes
+
+
+def _bloom_positions(fingerprints, bits, hashes):
+    """
+    Yield the bit position of every fingerprint for each Bloom filter hash function
+
+    Fingerprints are already uniform 64-bit hashes, so the hash functions are
+    derived from their two 32-bit halves by double hashing.
+    """
+    values = fingerprints.astype(np.int64, copy=False).view(np.uint64)
+    low = values & np.uint64(0xFFFFFFFF)
+    high = values >> np.uint64(32)
+    for i in range(hashes):
+        yield (low + np.uint64(i) * high) % np.uint64(bits)
+
+
+def _merge_segments(older, newer, path):
+    """
+    Merge two disjoint sorted segments into a new segment file, CHUNK_SIZE at a time
+
+    Returns:
+        The merged segment, memory-mapped
+    """
+    merged = np.lib.format.open_memmap(path, mode='w+', dtype=np.int64, shape=(len(older) + len(newer),))
+    i = j = written = 0
+    while i < len(older) or j < len(newer):
+        a = older[i:i + CHUNK_SIZE]
+        b = newer[j:j + CHUNK_SIZE]
+        # Everything up to the smaller of the two chunk ends can be written
+        if len(a) and len(b):
+            cutoff = min(a[-1], b[-1])
+            a = a[:np.searchsorted(a, cutoff, side='right')]
+            b = b[:np.searchsorted(b, cutoff, side='right')]
+        chunk = np.sort(np.concatenate([a, b]), kind='mergesort')
+        merged[written:written + len(chunk)] = chunk
+        written += len(chunk)
+        i += len(a)
+        j += len(b)
+    merged.flush()
+    return merged
+
+
+class HashIndex:
+    """On-disk index of delivered address fingerprints in one directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        self.bloom = None
+        self.bloom_bits = 0
+        self.bloom_hashes = 0
+        self.bloom_capacity = 0
+        self.count = 0
+        self.fingerprint_version = None
+        self.deliveries = set()
+        self._next_file = 0
+
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.segments = [
+                np.load(os.path.join(directory, name), mmap_mode='r') for name in meta['segments']
+            ]
+            self._segment_names = meta['segments']
+            self.bloom_bits = meta['bloom_bits']
+            self.bloom_hashes = meta['bloom_hashes']
+            self.bloom_capacity = meta['bloom_capacity']
+            self.count = meta['count']
+            self.fingerprint_version = meta['fingerprint_version']
+            self.deliveries = set(meta['deliveries'])
+            self._next_file = meta['next_file']
+            self.bloom = np.load(os.path.join(directory, meta['bloom']), mmap_mode='r+')
+            self._bloom_name = meta['bloom']
+        else:
+            self._segment_names = []
+            self._bloom_name = None
+
+    def contains(self, fingerprints):
+        """
+        Check which fingerprints are in the index
+
+        Args:
+            fingerprints: numpy array of INT64 fingerprints
+
+        Returns:
+            Boolean numpy array, True for the fingerprints in the index
+        """
+        fingerprints = np.asarray(fingerprints, dtype=np.int64)
+        found = np.zeros(len(fingerprints), dtype=bool)
+        if self.count == 0 or len(fingerprints) == 0:
+            return found
+
+        maybe = np.ones(len(fingerprints), dtype=bool)
+        for positions in _bloom_positions(fingerprints, self.bloom_bits, self.bloom_hashes):
+            bytes_ = self.bloom[positions >> np.uint64(3)]
+            maybe &= ((bytes_ >> (positions & np.uint64(7)).astype(np.uint8)) & 1).astype(bool)
+
+        candidates = np.flatnonzero(maybe)
+        values = fingerprints[candidates]
+        # Sorted keys keep the binary searches on nearby pages of the segments
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        hit = np.zeros(len(values), dtype=bool)
+        for segment in self.segments:
+            positions = np.searchsorted(segment, values)
+            inside = positions < len(segment)
+            hit[inside] |= segment[positions[inside]] == values[inside]
+        found[candidates[order]] = hit
+        return found
+
+    def _file_name(self, prefix):
+        name = f"{prefix}-{self._next_file:06d}.npy"
+        self._next_file += 1
+        return name
+
+    def _set_bloom_bits(self, fingerprints):
+        for positions in _bloom_positions(fingerprints, self.bloom_bits, self.bloom_hashes):
+            np.bitwise_or.at(self.bloom, positions >> np.uint64(3),
+                             np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def _build_bloom(self, capacity):
+        """Write a new Bloom filter sized for capacity and fill it from the segments"""
+        self.bloom_capacity = max(MIN_BLOOM_CAPACITY, capacity)
+        self.bloom_bits, self.bloom_hashes = _bloom_parameters(self.bloom_capacity)
+        self._bloom_name = self._file_name("bloom")
+        self.bloom = np.lib.format.open_memmap(
+            os.path.join(self.directory, self._bloom_name), mode='w+', dtype=np.uint8,
+            shape=(self.bloom_bits // 8,)
+        )
+        for segment in self.segments:
+            for start in range(0, len(segment), CHUNK_SIZE):
+                self._set_bloom_bits(np.asarray(segment[start:start + CHUNK_SIZE]))
+
+    def _write_meta(self):
+        meta = {
+            'segments': self._segment_names,
+            'bloom': self._bloom_name,
+            'bloom_bits': self.bloom_bits,
+            'bloom_hashes': self.bloom_hashes,
+            'bloom_capacity': self.bloom_capacity,
+            'count': self.count,
+            'fingerprint_version': self.fingerprint_version,
+            'deliveries': sorted(self.deliveries),
+            'next_file': self._next_file,
+        }
+        self.bloom.flush()
+        meta_path = os.path.join(self.directory, META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+        self._remove_unlisted_files()
+
+    def _remove_unlisted_files(self):
+        listed = set(self._segment_names) | {self._bloom_name, META_FILE}
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and name not in listed:
+                os.remove(os.path.join(self.directory, name))
+
+    def clear(self):
+        """Remove the index files, leaving an empty index"""
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name == META_FILE or name.endswith('.npy'):
+                    os.remove(os.path.join(self.directory, name))
+        self.__init__(self.directory)
+
+    def add(self, fingerprints, deliveries, fingerprint_version):
+        """
+        Add the fingerprints of deliveries to the index
+
+        The new fingerprints are written as a sorted segment, which is merged
+        with older segments of similar size. The Bloom filter is rebuilt at
+        twice the size once the index outgrows its capacity.
+
+        Args:
+            fingerprints: numpy array of INT64 fingerprints
+            deliveries: IDs of the deliveries the fingerprints belong to
+            fingerprint_version: Fingerprint version of the fingerprints
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fingerprints = np.unique(np.asarray(fingerprints, dtype=np.int64))
+        fingerprints = fingerprints[~self.contains(fingerprints)]
+
+        if len(fingerprints):
+            name = self._file_name("segment")
+            np.save(os.path.join(self.directory, name), fingerprints)
+            self.segments.append(np.load(os.path.join(self.directory, name), mmap_mode='r'))
+            self._segment_names.append(name)
+            self.count += len(fingerprints)
+
+            # Merge the newest segment into the one before while they are of similar size
+            while len(self.segments) > 1 and len(self.segments[-2]) <= 2 * len(self.segments[-1]):
+                name = self._file_name("segment")
+                merged = _merge_segments(self.segments[-2], self.segments[-1], os.path.join(self.directory, name))
+                self.segments[-2:] = [merged]
+                self._segment_names[-2:] = [name]
+
+            if self.bloom is None or self.count > self.bloom_capacity:
+                self._build_bloom(2 * self.count)
+            else:
+                self._set_bloom_bits(fingerprints)
+        elif self.bloom is None:
+            self._build_bloom(0)
+
+        self.deliveries |= set(deliveries)
+        self.fingerprint_version = fingerprint_version
+        self._write_meta()
+
+    def rebuild(self, sorted_batches, count, deliveries, fingerprint_version):
+        """
+        Replace the index with the fingerprints of sorted_batches
+
+        Args:
+            sorted_batches: Iterable of numpy arrays holding the distinct
+                            fingerprints in ascending order
+            count: Total number of fingerprints in the batches
+            deliveries: IDs of the deliveries the fingerprints belong to
+            fingerprint_version: Fingerprint version of the fingerprints
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = self._file_name("segment")
+        segment = np.lib.format.open_memmap(
+            os.path.join(self.directory, name), mode='w+', dtype=np.int64, shape=(count,)
+        )
+        written = 0
+        for batch in sorted_batches:
+            segment[written:written + len(batch)] = batch
+            written += len(batch)
+        if written != count:
+            raise ValueError(f"Expected {count} fingerprints to index, got {written}")
+        segment.flush()
+
+        self.segments = [segment] if count else []
+        self._segment_names = [name] if count else []
+        self.count = count
+        self._build_bloom(2 * count)
+        self.deliveries = set(deliveries)
+        self.fingerprint_version = fingerprint_version
+        self._write_meta()
@@ -0,0 +1,516 @@
+import os
+import re
+import json
+import time
+import uuid
+import datetime
+import contextlib
+import contextvars
+import threading
+import constants
+from utils import logger
+
+# Per-run instrumentation
+#
+# main.main() runs every pipeline step inside PipelineRun.step() and issues its
+# queries through the client returned by PipelineRun.instrument(). Every
+# BigQuery job started during a step is recorded with that step's name; when
+# the run finishes, the job statistics are collected into a per-run report,
+# written as JSON to RUN_REPORT_DIR and stored as one row of RUN_STATS_TABLE
+# (see record_run_stats in the backends).
+#
+# Steps run through PipelineRun.call() (or task()) are also checkpointed: once
+# checkpoint() is called, every step completed is recorded in the backend's run
+# state table, and steps an earlier, failed run of the same delivery completed
+# are skipped, returning their recorded output. A run that succeeds records
+# RUN_COMPLETED_STEP, and a delivery that succeeded is not run again.
+#
+# Every query is dry-run first and its estimate checked against the bytes
+# billed budgets (STEP_BYTES_BILLED_BUDGET, RUN_BYTES_BILLED_BUDGET); a query
+# that would exceed them raises BudgetExceededError before it starts, and the
+# others run with maximum_bytes_billed capped at the budget left. Scripts reading
+# temp tables they create are estimated statement by statement; a query that
+# cannot be estimated at all is refused while a budget is set. A run created
+# with plan=True only dry-runs its queries, reporting their estimates.
+
+# Step the running code belongs to; a context variable so steps and queries
+# running concurrently on scheduler threads (see scheduler.py) are attributed
+# to the right step
+_current_step = contextvars.ContextVar("current_step", default=None)
+
+
+# Client methods changing tables other than through queries, skipped by a plan
+PLAN_SKIPPED_METHODS = {
+    "update_table", "delete_table", "load_table_from_json",
+    "load_table_from_uri", "load_table_from_file", "load_table_from_dataframe",
+}
+
+
+# Statements of a script assigning a variable from a subquery, and creating a
+# (temp or permanent) table from a query
+_ASSIGNMENT = re.compile(r"^(?:SET\s+\w+\s*=|DECLARE\s+\w+\s.*?\bDEFAULT)\s*\((.*)\)$", re.S | re.I)
+_CREATED_TABLE = re.compile(
+    r"^CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP(?:ORARY)?\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\S+)\s"
+    r".*?\bAS\s+((?:SELECT|WITH)\b.*)$",
+    re.S | re.I,
+)
+
+
+# Step recorded in the run state table once a run of a delivery succeeded
+RUN_COMPLETED_STEP = "run_completed"
+
+
+class DeliveryCompletedError(RuntimeError):
+    """A run of the delivery already succeeded, so there is nothing to resume"""
+
+
+class BudgetExceededError(RuntimeError):
+    """A query is estimated to bill more bytes than its step or run has left, or cannot be estimated"""
+
+
+def _estimable_statements(script):
+    """
+    Statements of a script to dry-run one by one, with the tables it creates inlined
+
+    Tables a script creates from a query (temp tables, or CREATE [OR REPLACE]
+    TABLE ... AS) may not exist while it is dry-run, so every later read of
+    one is replaced by the query creating it (estimating the read as
+    recomputing the table), and the table is estimated by its query.
+    Variables are estimated by the subquery assigned to them. Statements
+    reading no table (transaction control, variables, INSERT ... VALUES) and
+    ASSERT checks bill nothing or next to nothing and are left out.
+
+    Args:
+        script: SQL script, statements separated by semicolons at the end of a line
+
+    Returns:
+        List of statements, each of which can be dry-run on its own
+    """
+    created_tables = {}
+    statements = []
+    for statement in re.split(r";\s*(?:\n|$)", script):
+        statement = "\n".join(line for line in statement.splitlines() if not line.strip().startswith("--")).strip()
+        if not re.search(r"\bFROM\b", statement, re.I) or re.match(r"ASSERT\b", statement, re.I):
+            continue
+        for name, query in created_tables.items():
+            statement = re.sub(rf"\b(FROM|JOIN)\s+{re.escape(name)}(?![\w.`])",
+                               lambda match: f"{match.group(1)} ({query})", statement, flags=re.I)
+        created_table = _CREATED_TABLE.match(statement)
+        assignment = _ASSIGNMENT.match(statement)
+        if created_table:
+            created_tables[created_table.group(1)] = created_table.group(2)
+            statement = created_table.group(2)
+        elif assignment:
+            statement = assignment.group(1)
+        statements.append(statement)
+    return statements
+
+
+class _PlannedRow:
+    """Result row of a planned query: every value is unknown"""
+
+    def __getitem__(self, key):
+        return None
+
+    def get(self, key, default=None):
+        return default
+
+    def keys(self):
+        return []
+
+
+class PlannedJob:
+    """Stand-in for the job of a planned query, reporting its dry run"""
+
+    def __init__(self, dry_run_job):
+        self._dry_run_job = dry_run_job
+
+    def result(self, *args, **kwargs):
+        return [_PlannedRow()]
+
+    def __getattr__(self, name):
+        return getattr(self._dry_run_job, name, None)
+
+
+def _job_config_copy(job_config, **properties):
+    """Copy of a QueryJobConfig (or a new one) with properties set"""
+    from google.cloud import bigquery
+
+    config = bigquery.QueryJobConfig()
+    if job_config is not None:
+        config = bigquery.QueryJobConfig.from_api_repr(job_config.to_api_repr())
+    for name, value in properties.items():
+        setattr(config, name, value)
+    return config
+
+
+class QueryRecordingClient:
+    """Wrap a BigQuery client, budgeting and recording every query job started through it"""
+
+    def __init__(self, client, run):
+        self._client = client
+        self._run = run
+        # Pipeline functions skip the reads and writes a plan cannot do
+        self.plan = run.plan
+
+    def _dry_run(self, query, job_config, **kwargs):
+        """Dry-run a query; returns the dry run job, or None if BigQuery cannot estimate it"""
+        config = _job_config_copy(job_config, dry_run=True, use_query_cache=False)
+        try:
+            return self._client.query(query, job_config=config, **kwargs)
+        except Exception as e:
+            logger.info(f"Could not dry-run a query of {_current_step.get()}: {str(e).split(chr(10))[0]}")
+            return None
+
+    def _estimate_statements(self, query, job_config, **kwargs):
+        """
+        Estimate a query that cannot be dry-run as a whole statement by statement (see _estimable_statements)
+
+        Returns:
+            Estimated bytes, or None if a statement cannot be estimated either
+        """
+        estimate = 0
+        for statement in _estimable_statements(query):
+            dry_run_job = self._dry_run(statement, job_config, **kwargs)
+            if dry_run_job is None:
+                logger.warning(f"Could not estimate a query of {_current_step.get()}")
+                return None
+            estimate += dry_run_job.total_bytes_processed or 0
+        return estimate
+
+    def query(self, query, job_config=None, **kwargs):
+        step = _current_step.get()
+        # The caller may only ask for an estimate itself
+        estimate_only = job_config is not None and job_config.dry_run
+        dry_run_job = self._dry_run(query, job_config, **kwargs)
+        if dry_run_job is not None:
+            estimate = dry_run_job.total_bytes_processed
+        elif estimate_only:
+            estimate = None
+        else:
+            # Scripts reading temp tables they create cannot be dry-run as a whole
+            estimate = self._estimate_statements(query, job_config, **kwargs)
+        cap = self._run.check_budget(step, estimate, executed=not estimate_only)
+
+        if self._run.plan:
+            job = PlannedJob(dry_run_job)
+        elif estimate_only:
+            if dry_run_job is None:
+                # Raise the error the dry run failed with
+                return self._client.query(query, job_config=job_config, **kwargs)
+            return dry_run_job
+        else:
+            if cap is not None:
+                if job_config is not None and job_config.maximum_bytes_billed is not None:
+                    cap = min(cap, int(job_config.maximum_bytes_billed))
+                job_config = _job_config_copy(job_config, maximum_bytes_billed=cap)
+            job = self._client.query(query, job_config=job_config, **kwargs)
+        self._run.jobs.append((step, job, estimate))
+        return job
+
+    def __getattr__(self, name):
+        if self._run.plan and name in PLAN_SKIPPED_METHODS:
+            def skip(*args, **kwargs):
+                logger.info(f"Plan: skipping {name}")
+            return skip
+        return getattr(self._client, name)
+
+
+def _seconds_between(start, end):
+    if start is None or end is None:
+        return None
+    return round((end - start).total_seconds(), 3)
+
+
+def job_statistics(step, job, estimate=None):
+    """
+    Statistics of a finished BigQuery query job
+
+    Args:
+        step: Pipeline step that started the job
+        job: QueryJob
+        estimate: Bytes its dry run estimated it would process
+
+    Returns:
+        Dictionary of the job statistics; values the job did not report are None
+    """
+    return {
+        "job_id": job.job_id,
+        "step": step,
+        "statement_type": job.statement_type,
+        "state": job.state,
+        "wall_seconds": _seconds_between(job.created, job.ended),
+        "slot_millis": job.slot_millis,
+        "estimated_bytes_processed": estimate,
+        "total_bytes_processed": job.total_bytes_processed,
+        "total_bytes_billed": job.total_bytes_billed,
+        "cache_hit": job.cache_hit,
+        "rows_affected": job.num_dml_affected_rows,
+    }
+
+
+def _total(items, key):
+    return sum(item[key] or 0 for item in items)
+
+
+def _total_estimate(queries):
+    """Estimated bytes of queries, None (unknown) if any of them could not be estimated"""
+    if any(query["estimated_bytes_processed"] is None for query in queries):
+        return None
+    return _total(queries, "estimated_bytes_processed")
+
+
+def _format_estimate(estimate):
+    return "unknown" if estimate is None else str(estimate)
+
+
+class PipelineRun:
+    """Time the steps of one pipeline run and collect the statistics of its queries"""
+
+    def __init__(self, delivery_id, backend_name, plan=False):
+        self.run_id = f"{delivery_id}_{uuid.uuid4().hex[:8]}"
+        self.delivery_id = delivery_id
+        self.backend = backend_name
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.steps = []
+        self.jobs = []
+        self.pipeline = None
+        self.client = None
+        self.completed = {}
+        self.plan = plan
+        # Estimated bytes of the queries started, in total and per step
+        self.estimated_bytes = 0
+        self.step_estimated_bytes = {}
+        self._budget_lock = threading.Lock()
+
+    def instrument(self, client):
+        """Return the client to run the pipeline with, recording queries on BigQuery"""
+        if self.backend == "bigquery":
+            return QueryRecordingClient(client, self)
+        return client
+
+    def check_budget(self, step, estimate, executed=True):
+        """
+        Check a query estimate against the budgets of its step and of the run
+
+        Args:
+            step: Pipeline step starting the query
+            estimate: Bytes the query is estimated to process (None if unknown)
+            executed: Whether the query will run, counting its estimate against the budgets
+
+        Returns:
+            Bytes the query may bill, to cap it with maximum_bytes_billed (None when unbudgeted)
+
+        Raises:
+            BudgetExceededError: The estimate exceeds what the step or the run has
+                                 left, or a query to run under a budget has no
+                                 estimate (a plan logs a warning instead)
+        """
+        step_budget = constants.STEP_BYTES_BILLED_BUDGETS.get(step, constants.STEP_BYTES_BILLED_BUDGET)
+        with self._budget_lock:
+            step_spent = self.step_estimated_bytes.get(step, 0)
+            left = [
+                (f"step {step}", step_budget, step_spent),
+                (f"run {self.run_id}", constants.RUN_BYTES_BILLED_BUDGET, self.estimated_bytes),
+            ]
+            left = [(name, budget - spent) for name, budget, spent in left if budget is not None]
+            if estimate is None and executed and left:
+                message = (f"A query of {step} could not be estimated, so it cannot be checked "
+                           f"against the budget of {left[0][0]}")
+                if not self.plan:
+                    raise BudgetExceededError(message)
+                logger.warning(f"Plan: {message}; a run would refuse it")
+            for name, remaining in left:
+                if estimate is not None and estimate > remaining:
+                    message = (f"A query of {step} is estimated to process {estimate} bytes, "
+                               f"more than the {max(remaining, 0)} bytes left in the budget of {name}")
+                    if not self.plan:
+                        raise BudgetExceededError(message)
+                    logger.warning(f"Plan: {message}")
+            if executed and estimate is not None:
+                self.step_estimated_bytes[step] = step_spent + estimate
+                self.estimated_bytes += estimate
+        if not left:
+            return None
+        return max(min(remaining for name, remaining in left), 0)
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """Time a pipeline step; queries started inside it are attributed to it"""
+        token = _current_step.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append({"step": name, "wall_seconds": round(time.perf_counter() - start, 3)})
+            _current_step.reset(token)
+
+    def checkpoint(self, pipeline, client, resume=True):
+        """
+        Record the completed steps of this run in the run state table of a backend
+
+        Args:
+            pipeline: Backend module the run uses
+            client: Client the run uses
+            resume: Skip the steps an earlier, failed run of the same delivery completed
+
+        Raises:
+            DeliveryCompletedError: An earlier run of the delivery succeeded (only when resuming)
+        """
+        self.pipeline = pipeline
+        self.client = client
+        completed = pipeline.load_run_state(client, self.delivery_id)
+        if resume and RUN_COMPLETED_STEP in completed:
+            raise DeliveryCompletedError(
+                f"Delivery {self.delivery_id} already completed successfully; delete it "
+                f"(python main.py delete {self.delivery_id}) to run it again"
+            )
+        self.completed = completed if resume else {}
+        if self.completed:
+            logger.info(f"Resuming delivery {self.delivery_id}; already completed: {', '.join(self.completed)}")
+
+    def call(self, function, *args, **kwargs):
+        """
+        Run a pipeline step, named after the function and timed like step()
+
+        A step completed by an earlier run of the delivery is skipped and its
+        recorded output returned. Otherwise the step is run and, once it is
+        done, recorded as completed, unless it records itself in its own
+        transaction (TRANSACTIONAL_STEPS of the backend).
+
+        Args:
+            function: Pipeline function to call
+            *args, **kwargs: Arguments to call it with
+
+        Returns:
+            Return value of the pipeline function, or its recorded output
+        """
+        name = function.__name__
+        if name in self.completed:
+            logger.info(f"Skipping {name}: completed by an earlier run of {self.delivery_id}")
+            return self.completed[name]
+
+        with self.step(name):
+            output = function(*args, **kwargs)
+
+        if self.pipeline is not None and name not in self.pipeline.TRANSACTIONAL_STEPS:
+            self.pipeline.record_step(self.client, self.delivery_id, name, output)
+        return output
+
+    def task(self, function, *args, **kwargs):
+        """
+        Build a scheduler task function (see scheduler.py) running a pipeline step with call()
+
+        Returns:
+            Task function returning the return value of the pipeline function
+        """
+        def run_step(results):
+            return self.call(function, *args, **kwargs)
+        return run_step
+
+    def report(self, status, error=None):
+        """
+        Build the run report
+
+        Args:
+            status: 'succeeded', 'failed' or 'skipped'
+            error: Error message of a failed run
+
+        Returns:
+            Dictionary with run totals, one entry per step and one per query
+        """
+        ended_at = datetime.datetime.now(datetime.timezone.utc)
+        queries = [job_statistics(step, job, estimate) for step, job, estimate in self.jobs]
+
+        steps = []
+        for step in self.steps:
+            step_queries = [query for query in queries if query["step"] == step["step"]]
+            steps.append({
+                **step,
+                "query_count": len(step_queries),
+                "slot_millis": _total(step_queries, "slot_millis"),
+                "estimated_bytes_processed": _total_estimate(step_queries),
+                "total_bytes_processed": _total(step_queries, "total_bytes_processed"),
+                "total_bytes_billed": _total(step_queries, "total_bytes_billed"),
+            })
+
+        return {
+            "run_id": self.run_id,
+            "delivery_id": self.delivery_id,
+            "backend": self.backend,
+            "plan": self.plan,
+            "status": status,
+            "error": error,
+            "started_at": self.started_at.isoformat(),
+            "ended_at": ended_at.isoformat(),
+            "wall_seconds": _seconds_between(self.started_at, ended_at),
+            "query_count": len(queries),
+            "slot_millis": _total(queries, "slot_millis"),
+            "estimated_bytes_processed": _total_estimate(queries),
+            "total_bytes_processed": _total(queries, "total_bytes_processed"),
+            "total_bytes_billed": _total(queries, "total_bytes_billed"),
+            "steps": steps,
+            "queries": queries,
+        }
+
+    def finish(self, pipeline, client, status, error=None):
+        """
+        Write the run report to RUN_REPORT_DIR and the backend's run stats table
+
+        The estimated bytes of every step are logged next to the bytes it
+        billed, as unknown when a query of the step could not be estimated; a
+        plan logs its estimates only and is not stored as a run. A
+        checkpointed run that succeeded is recorded as completed in the run
+        state table (RUN_COMPLETED_STEP). Failing to store the report is
+        logged but does not fail the run.
+
+        Args:
+            pipeline: Backend module the run used
+            client: Client the run used
+            status: 'succeeded', 'failed' or 'skipped' (the delivery already succeeded)
+            error: Error message of a failed run
+
+        Returns:
+            The run report
+        """
+        report = self.report(status, error)
+
+        kind = "plan" if self.plan else "run"
+        for item in report["steps"] + [{**report, "step": f"{kind} {self.run_id} ({status})"}]:
+            costs = ""
+            if self.plan:
+                costs = (f", {item['query_count']} queries, "
+                         f"{_format_estimate(item['estimated_bytes_processed'])} bytes estimated")
+            elif self.jobs:
+                costs = (f", {item['query_count']} queries, "
+                         f"{_format_estimate(item['estimated_bytes_processed'])} bytes estimated, "
+                         f"{item['total_bytes_billed']} bytes billed, {item['slot_millis']} slot ms")
+            logger.info(f"{item['step']}: {item['wall_seconds']:.1f}s{costs}")
+        if report["total_bytes_billed"] > constants.RUN_BYTES_BILLED_ALERT:
+            logger.warning(f"Run {self.run_id} billed {report['total_bytes_billed']} bytes, "
+                           f"above RUN_BYTES_BILLED_ALERT ({constants.RUN_BYTES_BILLED_ALERT})")
+
+        try:
+            os.makedirs(constants.RUN_REPORT_DIR, exist_ok=True)
+            report_path = os.path.join(constants.RUN_REPORT_DIR, f"{self.run_id}_{kind}.json" if self.plan else f"{self.run_id}.json")
+            with open(report_path, "w") as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Run report written to {report_path}")
+        except OSError as e:
+            logger.warning(f"Could not write run report: {str(e)}")
+
+        if self.plan:
+            return report
+
+        if status == "succeeded" and self.pipeline is not None:
+            try:
+                self.pipeline.record_step(self.client, self.delivery_id, RUN_COMPLETED_STEP)
+            except Exception as e:
+                logger.warning(f"Could not record delivery {self.delivery_id} as completed: {str(e)}")
+
+        try:
+            pipeline.record_run_stats(client, report)
+        except Exception as e:
+            logger.warning(f"Could not record run stats: {str(e)}")
+
+        return report
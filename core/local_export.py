@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import datetime
+import constants
+
+# Sharded local exports shared by the execution backends
+#
+# The current delivery is split into shards by a hash of Connect_ID, so all of
+# a participant's addresses land in the same shard, and each shard is sorted
+# like a single-file export. The backends download and write the shards in
+# parallel, each shard to its own file, holding at most one record batch per
+# worker in memory. An index file next to the shards lists every shard with its
+# file, row count, size and checksum, so consumers can load them in parallel
+# and check the export is complete.
+
+# Rows an xlsx worksheet holds below its header row
+XLSX_MAX_ROWS = 1_048_575
+
+# File extension of each LOCAL_EXPORT_FORMAT
+LOCAL_EXTENSIONS = {
+    'xlsx': 'xlsx',
+    'csv': 'csv',
+    'parquet': 'parquet',
+}
+
+
+def shard_count(row_count):
+    """
+    Number of shards to split a local export of row_count rows into
+
+    Shards hold about EXPORT_ROWS_PER_FILE rows at most. Larger exports are spread
+    over up to LOCAL_EXPORT_WORKERS shards, so every worker gets one, but a
+    shard is not made smaller than LOCAL_EXPORT_MIN_SHARD_ROWS rows.
+
+    Args:
+        row_count: Rows in the current delivery
+
+    Returns:
+        Number of shards, at least 1
+    """
+    by_size = -(-row_count // constants.EXPORT_ROWS_PER_FILE)
+    by_workers = min(constants.LOCAL_EXPORT_WORKERS, row_count // constants.LOCAL_EXPORT_MIN_SHARD_ROWS)
+    return max(1, by_size, by_workers)
+
+
+def shard_path(local_dir, base_name, shard, file_format):
+    """Path of the file of one shard"""
+    return os.path.join(local_dir, f'{base_name}_shard-{shard:04d}.{LOCAL_EXTENSIONS[file_format]}')
+
+
+def _write_xlsx(batches, path):
+    """Write record batches to one worksheet row by row, keeping one row in memory"""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'remove_timezone': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    worksheet = workbook.add_worksheet()
+    row_count = 0
+    try:
+        for batch in batches:
+            if row_count == 0:
+                worksheet.write_row(0, 0, batch.schema.names)
+            if row_count + batch.num_rows > XLSX_MAX_ROWS:
+                raise ValueError(f"Shard {path} has more than {XLSX_MAX_ROWS} rows, "
+                                 f"the xlsx limit; lower EXPORT_ROWS_PER_FILE")
+            for row in zip(*(column.to_pylist() for column in batch.columns)):
+                row_count += 1
+                worksheet.write_row(row_count, 0, row)
+    finally:
+        workbook.close()
+    return row_count
+
+
+def write_batches(batches, path, file_format, schema=None):
+    """
+    Write Arrow record batches to one file
+
+    Args:
+        batches: Iterable of pyarrow RecordBatches
+        path: File to write
+        file_format: 'xlsx', 'csv' or 'parquet'
+        schema: Schema of the batches, to write an empty file when there are
+                none (optional; without it no file is written)
+
+    Returns:
+        Number of rows written
+    """
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+
+    if file_format == 'xlsx':
+        return _write_xlsx(batches, path)
+
+    def open_writer(schema):
+        if file_format == 'parquet':
+            return pa_parquet.ParquetWriter(path, schema)
+        return pa_csv.CSVWriter(path, schema)
+
+    writer = None
+    row_count = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = open_writer(batch.schema)
+            writer.write_batch(batch)
+            row_count += batch.num_rows
+        if writer is None and schema is not None:
+            writer = open_writer(schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+def describe_shard(shard, path, row_count):
+    """
+    Index entry of a written shard: its file, row count, size and MD5 checksum
+
+    Args:
+        shard: Shard number
+        path: File of the shard
+        row_count: Rows in the shard
+
+    Returns:
+        Dictionary for the index file; file is None if the shard wrote no file
+    """
+    if not os.path.exists(path):
+        return {'shard': shard, 'file': None, 'row_count': row_count, 'size_bytes': 0, 'md5': None}
+
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return {
+        'shard': shard,
+        'file': os.path.basename(path),
+        'row_count': row_count,
+        'size_bytes': os.path.getsize(path),
+        'md5': md5.hexdigest(),
+    }
+
+
+def export_bigquery_shard(shard, job_id, location, path, file_format):
+    """
+    Write the results of a finished BigQuery shard query to the shard's file
+
+    Runs in a worker process, with its own BigQuery clients; results are read
+    as Arrow record batches through the BigQuery Storage Read API, keeping the
+    order of the query's ORDER BY.
+
+    Args:
+        shard: Shard number
+        job_id: ID of the query job selecting the shard's rows
+        location: Location of the query job
+        path: File to write
+        file_format: 'xlsx', 'csv' or 'parquet'
+
+    Returns:
+        Index entry of the shard (see describe_shard)
+    """
+    from google.cloud import bigquery
+    from google.cloud import bigquery_storage
+
+    client = bigquery.Client(project=constants.PROJECT_ID)
+    rows = client.get_job(job_id, location=location).result(timeout=constants.QUERY_TIMEOUT)
+    batches = rows.to_arrow_iterable(bqstorage_client=bigquery_storage.BigQueryReadClient())
+    return describe_shard(shard, path, write_batches(batches, path, file_format))
+
+
+def write_index(local_dir, base_name, delivery_id, file_format, shards):
+    """
+    Write the index file of a sharded local export next to the shards
+
+    Args:
+        local_dir: Directory the shards were written to
+        base_name: File name prefix of the shards
+        delivery_id: ID for this delivery
+        file_format: Format of the shards
+        shards: Index entries of the shards (see describe_shard)
+
+    Returns:
+        Path of the index file
+    """
+    shards = sorted(shards, key=lambda shard: shard['shard'])
+    index = {
+        'delivery_id': delivery_id,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'format': file_format,
+        'row_count': sum(shard['row_count'] for shard in shards),
+        'shard_count': len(shards),
+        'shards': shards,
+    }
+
+    index_path = os.path.join(local_dir, f'{base_name}_index.json')
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    return index_path
@@ -1,53 +1,258 @@
+import argparse
 import datetime
-from google.cloud import bigquery
 import constants
 from utils import logger
-import address_processing
+import backend
+import instrumentation
+import scheduler
 
-def main():
+# Command line interface
+#
+# `python main.py` (or `python main.py run`) runs the pipeline for today's
+# delivery, `python main.py run DELIVERY_ID` for a given one; the other commands run one operation of the configured backend.
+# Only the standard library and the lightweight pipeline modules are imported
+# at startup: the backend module (and with it the BigQuery or DuckDB
+# libraries) is imported by the command that needs it, and tabulate only when
+# statistics are printed. The commands of one invocation share one client.
+
+# Client shared by the commands of this invocation (see _client)
+_shared_client = None
+
+
+def _client():
+    """Client of the configured backend, created on first use"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = backend.get_client()
+    return _shared_client
+
+
+def main(plan=False, client=None, delivery_id=None):
+    """
+    Run the pipeline for today's delivery, or for the given delivery
+
+    Today's delivery is skipped once a run of it succeeded, so the pipeline can
+    be scheduled more often than daily; a given delivery that already
+    succeeded raises DeliveryCompletedError instead.
+
+    Args:
+        plan: Only dry-run the queries up to delivering the new addresses,
+              reporting the bytes each step is estimated to process
+        client: Client of the configured backend (created if not given)
+        delivery_id: Delivery to run or resume (defaults to today's)
+    """
     # Generate a delivery ID
-    delivery_id = f"DELIVERY_{datetime.datetime.now().strftime('%Y%m%d')}"
-    
+    requested = delivery_id is not None
+    if not requested:
+        delivery_id = f"DELIVERY_{datetime.datetime.now().strftime('%Y%m%d')}"
+
     logger.info(f"Starting geocoding pipeline with delivery ID: {delivery_id}")
-    
-    # Initialize BigQuery client
-    client = bigquery.Client(project=constants.PROJECT_ID)
-    
+
+    # Select the execution backend (BigQuery, or DuckDB over local snapshots)
+    pipeline = backend.get_backend()
+
+    # A plan dry-runs BigQuery queries; DuckDB runs bill nothing
+    if plan and constants.BACKEND != "bigquery":
+        raise ValueError("Plan mode estimates BigQuery queries; set BACKEND to 'bigquery'")
+
+    # Time every step and record the statistics of every query it runs
+    run = instrumentation.PipelineRun(delivery_id, constants.BACKEND, plan=plan)
+    client = run.instrument(client if client is not None else backend.get_client())
+    status, error = "failed", None
+
+    # Independent steps run concurrently on BigQuery; a DuckDB connection
+    # runs one statement at a time
+    concurrency = constants.MAX_CONCURRENT_QUERIES if constants.BACKEND == "bigquery" else 1
+
     try:
-        # Step 0: Create required tables if they don't exist
-        address_processing.create_required_tables(client)
-
-        # Step 1: Create/update the address view
-        address_processing.create_address_view(client)
-        
-        # Step 2: Identify new addresses
-        count = address_processing.identify_new_addresses(client, delivery_id)
-        
+        # Record completed steps, skipping those an earlier, failed run of this
+        # delivery completed; a delivery that succeeded is not run again (a plan
+        # records nothing and estimates every step)
+        if not plan:
+            try:
+                run.checkpoint(pipeline, client, resume=constants.RESUME_RUNS)
+            except instrumentation.DeliveryCompletedError as e:
+                if requested:
+                    raise
+                status = "skipped"
+                logger.info(f"Nothing to do: {str(e)}")
+                return
+
+        # Steps 0-1d: each step runs once the steps it depends on are done
+        scheduler.run_tasks({
+            # Create required tables if they don't exist
+            "create_required_tables": (run.task(pipeline.create_required_tables, client), []),
+            # Create/update the address view
+            "create_address_view": (run.task(pipeline.create_address_view, client), []),
+            # Record the source watermarks this delivery will cover
+            "stage_watermarks": (
+                run.task(pipeline.stage_watermarks, client, delivery_id),
+                ["create_required_tables"]
+            ),
+            # Refresh the materialized addresses table
+            "refresh_addresses_table": (
+                run.task(pipeline.refresh_addresses_table, client,
+                         full_rebuild=constants.ADDRESSES_FULL_REBUILD),
+                ["create_address_view", "stage_watermarks"]
+            ),
+            # Map delivered addresses to the current fingerprint version
+            "backfill_fingerprints": (
+                run.task(pipeline.backfill_fingerprints, client),
+                ["refresh_addresses_table"]
+            ),
+        }, max_concurrent=concurrency)
+
+        if constants.COLLAPSE_NEAR_DUPLICATES:
+            # Step 2: Identify new addresses
+            count = run.call(pipeline.identify_new_addresses, client, delivery_id)
+
+            # Step 2b: Collapse each participant's near-duplicate addresses
+            if plan or count > 0:
+                count = run.call(pipeline.collapse_near_duplicates, client, delivery_id)
+
+            # Step 3: Update metadata and advance the watermarks, in one transaction
+            run.call(pipeline.update_metadata, client, delivery_id)
+        else:
+            # Steps 2-3: Identify new addresses, update metadata and advance the
+            # watermarks, in one transaction
+            count = run.call(pipeline.deliver_new_addresses, client, delivery_id)
+
+        # Exporting and summarizing depend on the addresses found, so a plan stops here
+        if plan:
+            status = "succeeded"
+            logger.info("Plan complete: no query was run")
+            return
+
         # If no new addresses, stop here
         if count == 0:
+            status = "succeeded"
             logger.info("No new addresses found. Pipeline complete.")
             return
-        
-        # Step 3: Update metadata
-        address_processing.update_metadata(client, delivery_id)
-        
-        # Step 4: Export addresses
-        export_location = address_processing.export_addresses(
-            client, 
-            delivery_id,
-            local_export=constants.LOCAL_EXPORT,
-            local_dir=constants.LOCAL_EXPORT_DIR
-        )
-        
-        logger.info(f"Pipeline completed successfully: {count} addresses exported to {export_location}")
-
-        # Step 5: Generate summary statistics for this delivery
-        logger.info("Generating summary statistics for this delivery...")
-        address_processing.generate_summary_statistics(client, delivery_id)
-        
+
+        # Steps 4-5: Export addresses and generate summary statistics for this
+        # delivery; both only read what was recorded above
+        results = scheduler.run_tasks({
+            "export_addresses": (
+                run.task(pipeline.export_addresses, client, delivery_id,
+                         local_export=constants.LOCAL_EXPORT,
+                         local_dir=constants.LOCAL_EXPORT_DIR,
+                         unique_locations=constants.EXPORT_UNIQUE_LOCATIONS),
+                []
+            ),
+            "generate_summary_statistics": (
+                run.task(pipeline.generate_summary_statistics, client, delivery_id),
+                []
+            ),
+        }, max_concurrent=concurrency)
+
+        logger.info(f"Pipeline completed successfully: {count} addresses exported to {results['export_addresses']}")
+        status = "succeeded"
+
     except Exception as e:
-        logger.error(f"Error in pipeline: {str(e)}")
+        error = str(e)
+        logger.error(f"Error in pipeline: {error}")
         raise
+    finally:
+        # Write the run report, also for failed runs
+        run.finish(pipeline, client, status, error)
+
+def run_command(args):
+    """Run the pipeline for today's delivery, or resume a given delivery"""
+    main(client=_client(), delivery_id=getattr(args, "delivery_id", None))
+
+
+def plan_command(args):
+    """Dry-run the pipeline queries and report their estimated bytes"""
+    main(plan=True, client=_client())
+
+
+def stats_command(args):
+    """Print the summary statistics of deliveries, or of all deliveries"""
+    pipeline = backend.get_backend()
+    for delivery_id in args.delivery_ids or [None]:
+        pipeline.generate_summary_statistics(_client(), delivery_id)
+
+
+def delete_command(args):
+    """Delete deliveries from the delivery tables"""
+    pipeline = backend.get_backend()
+    for delivery_id in args.delivery_ids:
+        pipeline.delete_delivery(_client(), delivery_id)
+
+
+def export_command(args):
+    """Export the addresses of the current delivery again"""
+    pipeline = backend.get_backend()
+    # The export reads the current delivery table, which only holds the latest delivery
+    current_id = pipeline.current_delivery_id(_client())
+    if args.delivery_id != current_id:
+        raise ValueError(f"Only the current delivery ({current_id or 'none'}) can be exported again, "
+                         f"not {args.delivery_id}")
+    location = pipeline.export_addresses(_client(), args.delivery_id,
+                                         local_export=args.local,
+                                         local_dir=args.local_dir,
+                                         unique_locations=args.unique_locations)
+    logger.info(f"Delivery {args.delivery_id} exported to {location}")
+
+
+def ingest_command(args):
+    """Merge returned geocode result files into the geocode cache"""
+    pipeline = backend.get_backend()
+    count = pipeline.ingest_geocodes(_client(), args.uris)
+    logger.info(f"{count} geocodes cached")
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line
+
+    Args:
+        argv: Arguments to parse (defaults to sys.argv[1:])
+
+    Returns:
+        Parsed arguments; args.command is the function running the command
+    """
+    parser = argparse.ArgumentParser(description="Geocoding pipeline")
+    parser.add_argument("--backend", choices=backend.BACKENDS, default=constants.BACKEND,
+                        help=f"Execution backend (default: {constants.BACKEND})")
+    parser.set_defaults(command=run_command)
+    commands = parser.add_subparsers(title="commands")
+
+    run = commands.add_parser("run", help=run_command.__doc__)
+    run.add_argument("delivery_id", nargs="?", metavar="DELIVERY_ID",
+                     help="Delivery to run or resume (default: today's); fails if it already succeeded")
+    run.set_defaults(command=run_command)
+    commands.add_parser("plan", help=plan_command.__doc__).set_defaults(command=plan_command)
+
+    stats = commands.add_parser("stats", help=stats_command.__doc__)
+    stats.add_argument("delivery_ids", nargs="*", metavar="DELIVERY_ID",
+                       help="Deliveries to report (default: all deliveries)")
+    stats.set_defaults(command=stats_command)
+
+    delete = commands.add_parser("delete", help=delete_command.__doc__)
+    delete.add_argument("delivery_ids", nargs="+", metavar="DELIVERY_ID")
+    delete.set_defaults(command=delete_command)
+
+    export = commands.add_parser("export", help=export_command.__doc__)
+    export.add_argument("delivery_id", metavar="DELIVERY_ID")
+    export.add_argument("--local", action=argparse.BooleanOptionalAction, default=constants.LOCAL_EXPORT,
+                        help="Export to local shard files instead of GCS")
+    export.add_argument("--local-dir", default=constants.LOCAL_EXPORT_DIR,
+                        help="Directory of a local export")
+    export.add_argument("--unique-locations", action=argparse.BooleanOptionalAction,
+                        default=constants.EXPORT_UNIQUE_LOCATIONS,
+                        help="Export the distinct locations instead of the addresses")
+    export.set_defaults(command=export_command)
+
+    ingest = commands.add_parser("ingest", help=ingest_command.__doc__)
+    ingest.add_argument("uris", nargs="+", metavar="URI",
+                        help="gs:// URIs or local paths of CSV or Parquet result files")
+    ingest.set_defaults(command=ingest_command)
+
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    constants.BACKEND = args.backend
+    args.command(args)
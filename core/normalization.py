@@ -0,0 +1,367 @@
+import re
+
+# Address normalization
+#
+# Canonicalizes address field values so trivially different spellings of the
+# same address ("123 Main St." / "123 MAIN STREET") fingerprint identically.
+# Every rule is implemented twice from the same lookup tables: in Python for
+# local paths (normalize_value, normalize_column) and as BigQuery SQL UDFs for
+# the address view (sql_udf_statements). Keep the two in step: any change to
+# the rules or tables must bump fingerprint.FINGERPRINT_VERSION.
+#
+# Rules, applied in order:
+#   1. Uppercase ASCII letters; other characters are kept as they are, since
+#      Python and BigQuery upper-case them differently ('ß' -> 'SS' / 'ß')
+#   2. Drop periods and apostrophes ("ST." -> "ST", "O'NEIL" -> "ONEIL")
+#   3. Turn other separating punctuation into spaces
+#   4. Split '#' into its own token ("#5" -> "# 5")
+#   5. Collapse runs of whitespace into one space and trim; empty -> NULL
+#   6. Field specific lookups:
+#      street  - USPS street suffixes, directionals and unit designators, word by word;
+#                repeated unit markers collapsed ("APT #5" -> "# 5")
+#      unit    - unit designators dropped, leaving the unit number
+#      city    - common abbreviations (SAINT -> ST), word by word
+#      state   - full state names to USPS codes, whole value
+#      zip     - ZIP+4 truncated to ZIP5, 4-digit ZIPs that lost their leading zero padded
+#      country - United States spellings to US, whole value
+#      text    - no lookups
+
+# USPS street suffix abbreviations (Publication 28, appendix C1, common forms)
+STREET_SUFFIXES = {
+    "ALLEY": "ALY", "ALLY": "ALY",
+    "AVENUE": "AVE", "AV": "AVE", "AVEN": "AVE", "AVENU": "AVE", "AVN": "AVE", "AVNUE": "AVE",
+    "BOULEVARD": "BLVD", "BOUL": "BLVD", "BOULV": "BLVD",
+    "BRIDGE": "BRG",
+    "BYPASS": "BYP",
+    "CENTER": "CTR", "CENTRE": "CTR", "CENTR": "CTR", "CNTR": "CTR",
+    "CIRCLE": "CIR", "CIRC": "CIR", "CIRCL": "CIR", "CRCL": "CIR",
+    "COURT": "CT", "CRT": "CT",
+    "COURTS": "CTS",
+    "COVE": "CV",
+    "CREEK": "CRK",
+    "CRESCENT": "CRES",
+    "CROSSING": "XING",
+    "DRIVE": "DR", "DRIV": "DR", "DRV": "DR",
+    "EXPRESSWAY": "EXPY", "EXPRESS": "EXPY",
+    "EXTENSION": "EXT",
+    "FREEWAY": "FWY",
+    "GARDENS": "GDNS",
+    "GROVE": "GRV",
+    "HEIGHTS": "HTS",
+    "HIGHWAY": "HWY", "HIWAY": "HWY",
+    "HOLLOW": "HOLW",
+    "JUNCTION": "JCT",
+    "LANE": "LN",
+    "MANOR": "MNR",
+    "MEADOWS": "MDWS",
+    "MOUNTAIN": "MTN",
+    "PARKWAY": "PKWY", "PARKWY": "PKWY", "PKY": "PKWY",
+    "PLACE": "PL",
+    "PLAZA": "PLZ",
+    "POINT": "PT",
+    "RIDGE": "RDG",
+    "ROAD": "RD",
+    "ROUTE": "RTE",
+    "SQUARE": "SQ",
+    "STREET": "ST", "STR": "ST", "STRT": "ST",
+    "TERRACE": "TER", "TERR": "TER",
+    "TRAIL": "TRL", "TRAILS": "TRL",
+    "TURNPIKE": "TPKE",
+    "VALLEY": "VLY",
+    "VIEW": "VW",
+    "VILLAGE": "VLG",
+}
+
+DIRECTIONALS = {
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+    "NORTHEAST": "NE", "NORTHWEST": "NW", "SOUTHEAST": "SE", "SOUTHWEST": "SW",
+}
+
+# Secondary unit designators. Within a street line they all become '#', so
+# "APT 5", "UNIT 5" and "#5" agree; in the apartment number field, which only
+# holds the unit, they are dropped altogether.
+UNIT_DESIGNATORS = ["APARTMENT", "APT", "UNIT", "SUITE", "STE", "ROOM", "RM", "#"]
+
+OTHER_DESIGNATORS = {
+    "BUILDING": "BLDG",
+    "FLOOR": "FL", "FLR": "FL",
+}
+
+CITY_WORDS = {
+    "SAINT": "ST",
+    "FORT": "FT",
+    "MOUNT": "MT",
+}
+
+STATES = {
+    "ALABAMA": "AL", "ALASKA": "AK", "ARIZONA": "AZ", "ARKANSAS": "AR", "CALIFORNIA": "CA",
+    "COLORADO": "CO", "CONNECTICUT": "CT", "DELAWARE": "DE", "DISTRICT OF COLUMBIA": "DC",
+    "FLORIDA": "FL", "GEORGIA": "GA", "HAWAII": "HI", "IDAHO": "ID", "ILLINOIS": "IL",
+    "INDIANA": "IN", "IOWA": "IA", "KANSAS": "KS", "KENTUCKY": "KY", "LOUISIANA": "LA",
+    "MAINE": "ME", "MARYLAND": "MD", "MASSACHUSETTS": "MA", "MICHIGAN": "MI", "MINNESOTA": "MN",
+    "MISSISSIPPI": "MS", "MISSOURI": "MO", "MONTANA": "MT", "NEBRASKA": "NE", "NEVADA": "NV",
+    "NEW HAMPSHIRE": "NH", "NEW JERSEY": "NJ", "NEW MEXICO": "NM", "NEW YORK": "NY",
+    "NORTH CAROLINA": "NC", "NORTH DAKOTA": "ND", "OHIO": "OH", "OKLAHOMA": "OK", "OREGON": "OR",
+    "PENNSYLVANIA": "PA", "RHODE ISLAND": "RI", "SOUTH CAROLINA": "SC", "SOUTH DAKOTA": "SD",
+    "TENNESSEE": "TN", "TEXAS": "TX", "UTAH": "UT", "VERMONT": "VT", "VIRGINIA": "VA",
+    "WASHINGTON": "WA", "WEST VIRGINIA": "WV", "WISCONSIN": "WI", "WYOMING": "WY",
+    "AMERICAN SAMOA": "AS", "GUAM": "GU", "NORTHERN MARIANA ISLANDS": "MP", "PUERTO RICO": "PR",
+    "VIRGIN ISLANDS": "VI", "US VIRGIN ISLANDS": "VI",
+}
+
+COUNTRIES = {
+    "UNITED STATES": "US", "UNITED STATES OF AMERICA": "US", "USA": "US", "AMERICA": "US",
+}
+
+# Word-by-word lookups per field kind; an empty replacement drops the word
+WORD_LOOKUPS = {
+    "street": {
+        **STREET_SUFFIXES,
+        **DIRECTIONALS,
+        **OTHER_DESIGNATORS,
+        **{designator: "#" for designator in UNIT_DESIGNATORS},
+    },
+    "unit": {
+        **OTHER_DESIGNATORS,
+        **{designator: "" for designator in UNIT_DESIGNATORS},
+    },
+    "city": CITY_WORDS,
+}
+
+# Whole-value lookups per field kind
+VALUE_LOOKUPS = {
+    "state": STATES,
+    "country": COUNTRIES,
+}
+
+# Kind of every address field
+FIELD_KINDS = {
+    "address_line_1": "street",
+    "address_line_2": "street",
+    "street_num": "text",
+    "street_name": "street",
+    "apartment_num": "unit",
+    "city": "city",
+    "state": "state",
+    "zip_code": "zip",
+    "country": "country",
+    "cross_street_1": "street",
+    "cross_street_2": "street",
+}
+
+KINDS = ["street", "unit", "city", "state", "zip", "country", "text"]
+
+# Letters upper-cased by rule 1, shared by the Python and SQL implementations
+ASCII_LOWERCASE = "abcdefghijklmnopqrstuvwxyz"
+ASCII_UPPERCASE = ASCII_LOWERCASE.upper()
+
+# Patterns shared by the Python and SQL implementations (RE2 compatible)
+DROP_PATTERN = r"[.']"
+SPACE_PATTERN = r'[,;:"()]'
+WHITESPACE_PATTERN = r"[ \t\n\r\f]+"
+ZIP_PATTERN = r"^[0-9]{5}(?:[- ]?[0-9]{4})?$"
+SHORT_ZIP_PATTERN = r"^[0-9]{4}$"
+REPEATED_UNIT_PATTERN = r"#(?: #)+"
+
+_UPPERCASE = str.maketrans(ASCII_LOWERCASE, ASCII_UPPERCASE)
+_DROP_RE = re.compile(DROP_PATTERN)
+_SPACE_RE = re.compile(SPACE_PATTERN)
+_WHITESPACE_RE = re.compile(WHITESPACE_PATTERN)
+_ZIP_RE = re.compile(ZIP_PATTERN)
+_SHORT_ZIP_RE = re.compile(SHORT_ZIP_PATTERN)
+_REPEATED_UNIT_RE = re.compile(REPEATED_UNIT_PATTERN)
+
+
+def _base(value):
+    """Rules 1-5: case, punctuation and whitespace"""
+    value = value.translate(_UPPERCASE)
+    value = _DROP_RE.sub("", value)
+    value = _SPACE_RE.sub(" ", value)
+    value = value.replace("#", " # ")
+    value = _WHITESPACE_RE.sub(" ", value).strip(" ")
+    return value or None
+
+
+def _map_words(value, lookup):
+    words = [lookup.get(word, word) for word in value.split(" ")]
+    return " ".join(word for word in words if word) or None
+
+
+def normalize_value(value, kind):
+    """
+    Normalize one address field value
+
+    Args:
+        value: Field value (None passes through)
+        kind: Field kind, one of KINDS
+
+    Returns:
+        Normalized string, or None if nothing is left
+    """
+    if value is None:
+        return None
+    value = _base(str(value))
+    if value is None:
+        return None
+
+    if kind in WORD_LOOKUPS:
+        value = _map_words(value, WORD_LOOKUPS[kind])
+        if value is not None and kind == "street":
+            value = _REPEATED_UNIT_RE.sub("#", value)
+        return value
+    if kind in VALUE_LOOKUPS:
+        return VALUE_LOOKUPS[kind].get(value, value)
+    if kind == "zip":
+        if _ZIP_RE.match(value):
+            return value[:5]
+        if _SHORT_ZIP_RE.match(value):
+            return "0" + value
+    return value
+
+
+def normalize_field(field, value):
+    """Normalize the value of an address field (see FIELD_KINDS)"""
+    return normalize_value(value, FIELD_KINDS[field])
+
+
+def normalize_record(record):
+    """Return a copy of an address record with every address field normalized"""
+    normalized = dict(record)
+    for field, kind in FIELD_KINDS.items():
+        if field in normalized:
+            normalized[field] = normalize_value(normalized[field], kind)
+    return normalized
+
+
+def normalize_column(values, field):
+    """
+    Normalize a whole column of one address field
+
+    Each distinct value is normalized once and the results are mapped back, so
+    the cost scales with the number of distinct values rather than rows.
+
+    Args:
+        values: pandas Series, pyarrow Array/ChunkedArray or any iterable of values
+        field: Address field name (see FIELD_KINDS)
+
+    Returns:
+        Normalized values of the same container type (a list for plain iterables)
+    """
+    return normalize_values(values, FIELD_KINDS[field])
+
+
+def normalize_values(values, kind):
+    """Normalize a whole column of values of one field kind (see normalize_column)"""
+    module = type(values).__module__
+
+    if module.startswith("pandas"):
+        uniques = values.dropna().unique()
+        mapping = {value: normalize_value(value, kind) for value in uniques}
+        return values.map(mapping)
+
+    if module.startswith("pyarrow"):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if isinstance(values, pa.ChunkedArray):
+            values = values.combine_chunks()
+        encoded = pc.dictionary_encode(values)
+        dictionary = [normalize_value(value, kind) for value in encoded.dictionary.to_pylist()]
+        return pa.array(dictionary, type=pa.string()).take(encoded.indices)
+
+    cache = {}
+    normalized = []
+    for value in values:
+        if value not in cache:
+            cache[value] = normalize_value(value, kind)
+        normalized.append(cache[value])
+    return normalized
+
+
+def _sql_string(value):
+    """Quote a lookup word as a BigQuery string literal"""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _sql_lookup_array(lookup):
+    entries = ",\n            ".join(
+        f"STRUCT({_sql_string(word)} AS word, {_sql_string(replacement)} AS replacement)"
+        for word, replacement in sorted(lookup.items())
+    )
+    return f"[\n            {entries}\n        ]"
+
+
+def _sql_base(value):
+    """Rules 1-5 in BigQuery SQL"""
+    value = f"TRANSLATE({value}, '{ASCII_LOWERCASE}', '{ASCII_UPPERCASE}')"
+    value = f"REGEXP_REPLACE({value}, r\"{DROP_PATTERN}\", '')"
+    value = f"REGEXP_REPLACE({value}, r'{SPACE_PATTERN}', ' ')"
+    value = f"REPLACE({value}, '#', ' # ')"
+    value = f"REGEXP_REPLACE({value}, r'{WHITESPACE_PATTERN}', ' ')"
+    return f"NULLIF(TRIM({value}, ' '), '')"
+
+
+def _sql_kind_body(kind):
+    """Body of the UDF normalizing one field kind, in terms of its argument value"""
+    base = _sql_base("value")
+
+    if kind in WORD_LOOKUPS:
+        mapped = f"""(
+    SELECT NULLIF(STRING_AGG(mapped, ' ' ORDER BY position), '')
+    FROM (
+        SELECT position, COALESCE(lookup.replacement, token) AS mapped
+        FROM UNNEST(SPLIT({base}, ' ')) AS token WITH OFFSET AS position
+        LEFT JOIN UNNEST({_sql_lookup_array(WORD_LOOKUPS[kind])}) AS lookup
+        ON lookup.word = token
+    )
+    WHERE mapped != ''
+)"""
+        if kind == "street":
+            return f"REGEXP_REPLACE({mapped}, r'{REPEATED_UNIT_PATTERN}', '#')"
+        return mapped
+    if kind in VALUE_LOOKUPS:
+        return f"""(
+    SELECT COALESCE(
+        (SELECT lookup.replacement FROM UNNEST({_sql_lookup_array(VALUE_LOOKUPS[kind])}) AS lookup
+         WHERE lookup.word = base_value),
+        base_value
+    )
+    FROM UNNEST([{base}]) AS base_value
+)"""
+    if kind == "zip":
+        return f"""(
+    SELECT CASE
+        WHEN REGEXP_CONTAINS(base_value, r'{ZIP_PATTERN}') THEN SUBSTR(base_value, 1, 5)
+        WHEN REGEXP_CONTAINS(base_value, r'{SHORT_ZIP_PATTERN}') THEN CONCAT('0', base_value)
+        ELSE base_value
+    END
+    FROM UNNEST([{base}]) AS base_value
+)"""
+    return base
+
+
+def sql_udf_name(kind, dataset):
+    """Fully qualified name of the UDF normalizing one field kind"""
+    return f"{dataset}.normalize_{kind}"
+
+
+def sql_udf_statements(dataset):
+    """
+    Generate the BigQuery DDL creating one normalization UDF per field kind
+
+    Args:
+        dataset: Dataset reference the functions are created in, e.g. `project`.dataset
+
+    Returns:
+        List of CREATE OR REPLACE FUNCTION statements
+    """
+    return [
+        f"CREATE OR REPLACE FUNCTION {sql_udf_name(kind, dataset)}(value STRING)\n"
+        f"RETURNS STRING AS ({_sql_kind_body(kind)})"
+        for kind in KINDS
+    ]
+
+
+def sql_normalize_expression(field, column, dataset):
+    """BigQuery expression normalizing an address field column with its UDF"""
+    return f"{sql_udf_name(FIELD_KINDS[field], dataset)}({column})"
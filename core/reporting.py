@@ -0,0 +1,259 @@
+# Summary statistics shared by the execution backends. Both backends roll their
+# reports up from stored per-delivery statistics (see rollup_results), except
+# for the participants of a report across deliveries: per-delivery counts of
+# one participant cannot be added up, so those are counted in one pass over
+# the delivered participants (see participants_query). The
+# direct summary queries only use SQL both BigQuery and DuckDB understand; they
+# scan the delivered addresses once per table and are kept as the reference
+# the tests check the stored statistics against.
+
+COMPLETENESS_FIELDS = ['street_num', 'street_name', 'apartment_num', 'city', 'state',
+                       'zip_code', 'country', 'cross_street_1', 'cross_street_2',
+                       'address_line_1', 'address_line_2']
+
+
+def summary_queries(comprehensive_table, delivery_filter=""):
+    """
+    Build the summary statistics queries
+
+    Args:
+        comprehensive_table: Table holding the delivered addresses
+        delivery_filter: Optional WHERE clause restricting the rows to one delivery
+
+    Returns:
+        Dictionary of query name to SQL
+    """
+    completeness_sql = ",\n        ".join(
+        f"COUNTIF({field} IS NOT NULL) AS {field}_count" for field in COMPLETENESS_FIELDS
+    )
+
+    return {
+        # Total addresses and unique participants
+        "count": f"""
+    SELECT
+        COUNT(*) AS total_addresses,
+        COUNT(DISTINCT Connect_ID) AS total_participants,
+        COUNT(*) / COUNT(DISTINCT Connect_ID) AS avg_addresses_per_participant
+    FROM {comprehensive_table}
+    {delivery_filter}
+    """,
+        # Addresses by address_nickname
+        "nickname": f"""
+    SELECT
+        address_nickname,
+        COUNT(*) AS count,
+        COUNT(*) * 100.0 / SUM(COUNT(*)) OVER() AS percentage
+    FROM {comprehensive_table}
+    {delivery_filter}
+    GROUP BY address_nickname
+    ORDER BY count DESC
+    """,
+        # Addresses by address_source
+        "source": f"""
+    SELECT
+        address_source,
+        COUNT(*) AS count,
+        COUNT(*) * 100.0 / SUM(COUNT(*)) OVER() AS percentage
+    FROM {comprehensive_table}
+    {delivery_filter}
+    GROUP BY address_source
+    ORDER BY count DESC
+    """,
+        # Distribution of addresses per participant
+        "distribution": f"""
+    WITH participant_counts AS (
+        SELECT
+            Connect_ID,
+            COUNT(*) AS address_count
+        FROM {comprehensive_table}
+        {delivery_filter}
+        GROUP BY Connect_ID
+    )
+    SELECT
+        address_count,
+        COUNT(*) AS participant_count,
+        COUNT(*) * 100.0 / SUM(COUNT(*)) OVER() AS percentage
+    FROM participant_counts
+    GROUP BY address_count
+    ORDER BY address_count
+    """,
+        # Completeness of address fields
+        "completeness": f"""
+    SELECT
+        COUNT(*) AS total_addresses,
+        {completeness_sql}
+    FROM {comprehensive_table}
+    {delivery_filter}
+    """,
+    }
+
+
+def participants_query(comprehensive_table):
+    """
+    Build the query counting participants by their number of delivered addresses
+
+    Args:
+        comprehensive_table: Table holding the delivered addresses of every delivery
+
+    Returns:
+        SQL returning one (address_count, participant_count) row per number of
+        addresses, counting each participant's addresses across all deliveries
+    """
+    return f"""
+    SELECT
+        address_count,
+        COUNT(*) AS participant_count
+    FROM (
+        SELECT Connect_ID, COUNT(*) AS address_count
+        FROM {comprehensive_table}
+        GROUP BY Connect_ID
+    )
+    GROUP BY address_count
+    """
+
+
+def rollup_results(rows, participant_rows=None):
+    """
+    Turn rolled-up summary stats rows into the rows of the summary queries
+
+    Args:
+        rows: Dictionaries with dimension, value, address_count and
+              participant_count, one per dimension and value
+        participant_rows: Rows of participants_query, for a report across
+                          deliveries; the participants and their distribution
+                          are then counted from them instead of from rows
+
+    Returns:
+        Dictionary of query name (see summary_queries) to a list of row dictionaries
+    """
+    by_dimension = {}
+    for row in rows:
+        by_dimension.setdefault(row['dimension'], []).append(row)
+    if participant_rows is not None:
+        by_dimension['distribution'] = [
+            {'value': row['address_count'], 'participant_count': row['participant_count']}
+            for row in participant_rows
+        ]
+
+    total = (by_dimension.get('total') or [{}])[0]
+    total_addresses = total.get('address_count') or 0
+    if participant_rows is not None:
+        total_participants = sum(row['participant_count'] for row in participant_rows)
+    else:
+        total_participants = total.get('participant_count') or 0
+
+    def shares(dimension, name):
+        items = sorted(by_dimension.get(dimension, []), key=lambda row: row['address_count'], reverse=True)
+        return [
+            {name: row['value'], 'count': row['address_count'],
+             'percentage': row['address_count'] * 100.0 / total_addresses}
+            for row in items
+        ]
+
+    distribution = sorted(by_dimension.get('distribution', []), key=lambda row: int(row['value']))
+    distribution_total = sum(row['participant_count'] for row in distribution)
+
+    completeness = {row['value']: row['address_count'] for row in by_dimension.get('completeness', [])}
+
+    return {
+        "count": [{
+            'total_addresses': total_addresses,
+            'total_participants': total_participants,
+            'avg_addresses_per_participant': total_addresses / total_participants if total_participants else None,
+        }],
+        "nickname": shares('nickname', 'address_nickname'),
+        "source": shares('source', 'address_source'),
+        "distribution": [
+            {'address_count': int(row['value']), 'participant_count': row['participant_count'],
+             'percentage': row['participant_count'] * 100.0 / distribution_total}
+            for row in distribution
+        ],
+        "completeness": [{
+            'total_addresses': total_addresses,
+            **{f"{field}_count": completeness.get(field, 0) for field in COMPLETENESS_FIELDS},
+        }],
+    }
+
+
+def build_summary_statistics(delivery_id, results):
+    """
+    Compile the summary statistics from the rows of the summary queries
+
+    Args:
+        delivery_id: Delivery the statistics cover (None for all deliveries)
+        results: Dictionary of query name (see summary_queries) to a list of row dictionaries
+
+    Returns:
+        Dictionary containing summary statistics
+    """
+    count_stats = results["count"][0]
+    completeness_stats = results["completeness"][0]
+
+    # Calculate percentages for field completeness
+    field_completeness = []
+    total = completeness_stats['total_addresses']
+    if total > 0:
+        for field in COMPLETENESS_FIELDS:
+            count = completeness_stats[f"{field}_count"]
+            percentage = (count / total) * 100
+            field_completeness.append({
+                'field': field,
+                'count': count,
+                'percentage': percentage
+            })
+
+    return {
+        "delivery_id": delivery_id if delivery_id else "All deliveries",
+        "total_addresses": count_stats['total_addresses'],
+        "total_participants": count_stats['total_participants'],
+        "avg_addresses_per_participant": count_stats['avg_addresses_per_participant'],
+        "addresses_by_nickname": results["nickname"],
+        "addresses_by_source": results["source"],
+        "addresses_per_participant_distribution": results["distribution"],
+        "field_completeness": field_completeness
+    }
+
+
+def print_summary_statistics(stats):
+    """Print summary statistics as ASCII tables"""
+    # Imported here so only commands printing statistics load it
+    from tabulate import tabulate
+
+    delivery_id = stats['delivery_id']
+    delivery_info = f" for delivery {delivery_id}" if delivery_id != "All deliveries" else ""
+    print(f"\n========== Summary Statistics{delivery_info} ==========\n")
+
+    # Table 1: Overview
+    overview_data = [
+        ["Total Addresses", stats['total_addresses']],
+        ["Total Participants", stats['total_participants']],
+        ["Average Addresses per Participant", f"{stats['avg_addresses_per_participant'] or 0:.2f}"]
+    ]
+    print(tabulate(overview_data, headers=["Metric", "Value"], tablefmt="grid"))
+    print("\n")
+
+    # Table 2: Addresses by Nickname
+    nickname_data = [[item['address_nickname'], item['count'], f"{item['percentage']:.1f}%"]
+                     for item in stats['addresses_by_nickname']]
+    print(tabulate(nickname_data, headers=["Address Nickname", "Count", "Percentage"], tablefmt="grid"))
+    print("\n")
+
+    # Table 3: Addresses by Source
+    source_data = [[item['address_source'], item['count'], f"{item['percentage']:.1f}%"]
+                   for item in stats['addresses_by_source']]
+    print(tabulate(source_data, headers=["Address Source", "Count", "Percentage"], tablefmt="grid"))
+    print("\n")
+
+    # Table 4: Distribution of Addresses per Participant
+    distribution_data = [[item['address_count'], item['participant_count'], f"{item['percentage']:.1f}%"]
+                         for item in stats['addresses_per_participant_distribution']]
+    print(tabulate(distribution_data,
+                   headers=["Addresses per Participant", "Number of Participants", "Percentage"],
+                   tablefmt="grid"))
+    print("\n")
+
+    # Table 5: Field Completeness
+    completeness_data = [[item['field'], item['count'], f"{item['percentage']:.1f}%"]
+                         for item in stats['field_completeness']]
+    print(tabulate(completeness_data, headers=["Field", "Count", "Percentage"], tablefmt="grid"))
+    print("\n")
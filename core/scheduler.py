@@ -0,0 +1,85 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import constants
+
+# Concurrent execution of independent pipeline work
+#
+# A task is a function taking the results of the tasks that finished before it,
+# paired with the names of the tasks it depends on. run_tasks starts every task
+# whose dependencies have finished on a thread pool, so independent BigQuery
+# jobs wait on their results at the same time and the wall time of a group of
+# tasks is its critical path rather than the sum of its round trips.
+
+
+def run_tasks(tasks, max_concurrent=None):
+    """
+    Run tasks concurrently, each once all of its dependencies have finished
+
+    Tasks become ready in declaration order. If a task fails, no further tasks
+    are started; the tasks already running are waited for and the first error
+    is raised.
+
+    Args:
+        tasks: Dictionary of task name to a (function, dependency names) pair.
+               The function is called with the dictionary of the results of
+               the finished tasks.
+        max_concurrent: Maximum number of tasks running at once
+                        (defaults to MAX_CONCURRENT_QUERIES)
+
+    Returns:
+        Dictionary of task name to the return value of its function
+    """
+    if max_concurrent is None:
+        max_concurrent = constants.MAX_CONCURRENT_QUERIES
+
+    for name, (_, dependencies) in tasks.items():
+        unknown = [dependency for dependency in dependencies if dependency not in tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown tasks: {', '.join(unknown)}")
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        while pending or running:
+            for name, (function, dependencies) in list(pending.items()):
+                if len(running) >= max_concurrent:
+                    break
+                if all(dependency in results for dependency in dependencies):
+                    del pending[name]
+                    # Run in a copy of the caller's context, so context variables
+                    # (such as the current pipeline step) carry over to the task
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, function, dict(results))] = name
+
+            if not running:
+                raise ValueError(f"Circular task dependencies between: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                # Re-raises the task's error; the executor waits for the running tasks
+                results[name] = future.result()
+
+    return results
+
+
+def query_task(client, query, job_config=None, fetch_rows=False):
+    """
+    Build a task function that runs a BigQuery query
+
+    Args:
+        client: BigQuery client
+        query: SQL to run
+        job_config: Optional QueryJobConfig
+        fetch_rows: Return the result rows instead of the job
+
+    Returns:
+        Task function returning the finished QueryJob, or its rows as dictionaries
+    """
+    def run_query(results):
+        job = client.query(query, job_config=job_config, timeout=constants.QUERY_TIMEOUT)
+        rows = job.result()
+        return [dict(row) for row in rows] if fetch_rows else job
+    return run_query
@@ -0,0 +1,323 @@
+import os
+import json
+import hashlib
+import constants
+import address_registry
+from address_registry import ADDRESS_FIELDS
+from utils import logger
+
+# Bump when the generated SQL changes for an unchanged registry, so cached
+# queries compiled by an older compiler are not reused
+COMPILER_VERSION = 2
+
+# Table aliases used in the generated SQL
+PARTICIPANTS_ALIAS = "p"
+SOURCE_ALIAS = "m"
+HISTORY_ALIAS = "element"
+
+# SQL dialects the address query can be compiled to: BigQuery for the
+# pipeline, DuckDB for the local backend (see duckdb_backend.py)
+DIALECTS = ["bigquery", "duckdb"]
+
+
+def source_tables():
+    """Map the logical table names used in the registry to BigQuery tables"""
+    return {
+        "module4": constants.MODULE_4_TABLE,
+        "participants": constants.RAW_PARTICIPANTS_TABLE,
+    }
+
+
+def _scan_key(source):
+    """Sources with the same scan key are compiled into a single table scan"""
+    return (source["table"], tuple(source["filters"]))
+
+
+def _group_sources(sources):
+    """Group sources by scan key, keeping the registry order"""
+    groups = {}
+    for source in sources:
+        groups.setdefault(_scan_key(source), []).append(source)
+    return list(groups.values())
+
+
+def _column_expression(columns, alias):
+    """Build the SQL expression reading one address field"""
+    if columns is None:
+        return "CAST(NULL AS STRING)"
+    if isinstance(columns, str):
+        return f"CAST({alias}.{columns} AS STRING)"
+    coalesced = ", ".join(f"{alias}.{column}" for column in columns)
+    return f"CAST(COALESCE({coalesced}) AS STRING)"
+
+
+def _struct_literal(members, dialect):
+    """Build a STRUCT literal from (expression, name) pairs"""
+    if dialect == "duckdb":
+        members_sql = ",\n            ".join(f"{name} := {expression}" for expression, name in members)
+        return f"""struct_pack(
+            {members_sql}
+        )"""
+    members_sql = ",\n            ".join(f"{expression} AS {name}" for expression, name in members)
+    return f"""STRUCT(
+            {members_sql}
+        )"""
+
+
+def _current_timestamp(dialect):
+    return "CURRENT_TIMESTAMP" if dialect == "duckdb" else "CURRENT_TIMESTAMP()"
+
+
+def _source_struct(source, row_alias, dialect="bigquery"):
+    """Build the STRUCT literal turning one source of a scanned row into an address row"""
+    if source.get("history_array"):
+        ts_user_profile_updated = (
+            f"CAST({row_alias}.{address_registry.USER_PROFILE_HISTORY_TIMESTAMP} AS STRING)"
+        )
+        historical_order = f"{HISTORY_ALIAS}_position + 1"  # Converting 0-based to 1-based
+    else:
+        ts_user_profile_updated = "CAST(NULL AS STRING)"
+        historical_order = source.get("historical_order")
+        historical_order = "CAST(NULL AS INT64)" if historical_order is None else str(int(historical_order))
+
+    members = [
+        (ts_user_profile_updated, "ts_user_profile_updated"),
+        (f"'{source['cid']}'", "address_src_question_cid"),
+        (f"'{source['nickname']}'", "address_nickname"),
+        (f"'{source['address_source']}'", "address_source"),
+        (historical_order, "historical_order"),
+    ]
+    for field in ADDRESS_FIELDS:
+        members.append((_column_expression(source["fields"].get(field), row_alias), field))
+    return _struct_literal(members, dialect)
+
+
+def _history_addresses(history_array, sources, row_alias, dialect="bigquery"):
+    """
+    Build the array of address rows a scanned row holds in one of its history arrays
+
+    The history array is unnested once in a correlated subquery, expanding
+    every history entry into one address row per source.
+    """
+    array = f"{row_alias}.{history_array}"
+    structs_sql = ",\n            ".join(_source_struct(source, HISTORY_ALIAS, dialect) for source in sources)
+
+    if dialect == "duckdb":
+        # DuckDB has no WITH OFFSET; pair each element with its 0-based subscript
+        return f"""(
+        SELECT list(history_address)
+        FROM (SELECT UNNEST({array}) AS {HISTORY_ALIAS}, generate_subscripts({array}, 1) - 1 AS {HISTORY_ALIAS}_position) history
+        CROSS JOIN UNNEST([
+            {structs_sql}
+        ]) AS h(history_address)
+    )"""
+    return f"""ARRAY(
+        SELECT history_address
+        FROM UNNEST({array}) AS {HISTORY_ALIAS} WITH OFFSET AS {HISTORY_ALIAS}_position
+        CROSS JOIN UNNEST([
+            {structs_sql}
+        ]) AS history_address
+    )"""
+
+
+def _compile_scan(sources, tables, dialect="bigquery"):
+    """
+    Compile a group of sources sharing a scan key into one SELECT
+
+    Each scanned row is filtered once and expanded into the address rows of
+    all sources: the sources reading its columns directly, and those reading a
+    history array, whose entries are unnested once per array.
+    """
+    table, filters = _scan_key(sources[0])
+
+    if table == "participants":
+        from_sql = f"FROM {tables['participants']} {PARTICIPANTS_ALIAS}"
+        connect_id = f"{PARTICIPANTS_ALIAS}.Connect_ID"
+        row_alias = PARTICIPANTS_ALIAS
+    else:
+        from_sql = (
+            f"FROM {tables[table]} {SOURCE_ALIAS}\n"
+            f"JOIN {tables['participants']} {PARTICIPANTS_ALIAS} "
+            f"ON CAST({SOURCE_ALIAS}.Connect_ID AS STRING) = CAST({PARTICIPANTS_ALIAS}.Connect_ID AS STRING)"
+        )
+        connect_id = f"{SOURCE_ALIAS}.Connect_ID"
+        row_alias = SOURCE_ALIAS
+
+    arrays = []
+    row_sources = [source for source in sources if not source.get("history_array")]
+    if row_sources:
+        structs_sql = ",\n        ".join(_source_struct(source, row_alias, dialect) for source in row_sources)
+        arrays.append(f"""[
+        {structs_sql}
+    ]""")
+    history_sources = {}
+    for source in sources:
+        if source.get("history_array"):
+            history_sources.setdefault(source["history_array"], []).append(source)
+    for history_array, array_sources in history_sources.items():
+        arrays.append(_history_addresses(history_array, array_sources, row_alias, dialect))
+
+    # Concatenate the arrays pairwise, which both dialects support
+    concat = "list_concat" if dialect == "duckdb" else "ARRAY_CONCAT"
+    addresses_sql = arrays[0]
+    for array in arrays[1:]:
+        addresses_sql = f"{concat}({addresses_sql}, {array})"
+
+    address_alias = "t(address)" if dialect == "duckdb" else "address"
+    field_columns_sql = ",\n    ".join(f"address.{field}" for field in ADDRESS_FIELDS)
+    filters_sql = "\n    AND ".join(address_registry.FILTERS[name] for name in filters)
+    non_empty_sql = " OR\n        ".join(
+        f"(address.{field} IS NOT NULL AND address.{field} != '')" for field in ADDRESS_FIELDS
+    )
+
+    return f"""
+SELECT
+    CAST({connect_id} AS STRING) AS Connect_ID,
+    address.ts_user_profile_updated,
+    {_current_timestamp(dialect)} AS ts_address_delivered,
+    address.address_src_question_cid,
+    address.address_nickname,
+    address.address_source,
+    address.historical_order,
+    {field_columns_sql}
+{from_sql}
+CROSS JOIN UNNEST({addresses_sql}) AS {address_alias}
+WHERE
+    {filters_sql}
+    AND (
+        {non_empty_sql}
+    )
+"""
+
+
+def compile_address_query(sources=None, tables=None, dialect="bigquery"):
+    """
+    Compile the address registry into a single address query
+
+    Sources reading the same table with the same filters are merged into one
+    scan: every scanned row is expanded into one address row per source by
+    UNNESTing an array with one STRUCT per source. Sources reading a history
+    array of the row (the user profile history) add one STRUCT per source and
+    history entry to that array, so the current and historical addresses of a
+    participant come out of the same scan.
+
+    Args:
+        sources: Optional list of address sources (defaults to ADDRESS_SOURCES)
+        tables: Optional mapping of logical table names to tables (defaults to source_tables())
+        dialect: SQL dialect to compile to, one of DIALECTS
+
+    Returns:
+        SQL string returning one row per address
+    """
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown SQL dialect: {dialect}")
+    if sources is None:
+        sources = address_registry.ADDRESS_SOURCES
+    if tables is None:
+        tables = source_tables()
+
+    scans = [_compile_scan(group, tables, dialect) for group in _group_sources(sources)]
+    return "\nUNION ALL\n".join(scan.strip() for scan in scans)
+
+
+def _changed_at_expression(table, alias):
+    """Latest change timestamp of a source row"""
+    columns = address_registry.CHANGE_TIMESTAMP_COLUMNS[table]
+    timestamps = ", ".join(
+        f"SAFE_CAST(CAST({alias}.{column} AS STRING) AS TIMESTAMP)" for column in columns
+    )
+    return f"(SELECT MAX(ts) FROM UNNEST([{timestamps}]) ts)"
+
+
+def _change_tracked_tables():
+    """Logical names of the tables the address sources read"""
+    return sorted({source["table"] for source in address_registry.ADDRESS_SOURCES})
+
+
+def compile_changed_participants_query(since, tables=None):
+    """
+    Compile a query returning the Connect_IDs whose source rows changed after a watermark
+
+    Args:
+        since: Mapping of logical table name to a SQL expression holding that
+            table's watermark; a NULL watermark treats every participant as changed
+        tables: Optional mapping of logical table names to tables (defaults to source_tables())
+
+    Returns:
+        SQL string returning one Connect_ID per changed participant
+    """
+    if tables is None:
+        tables = source_tables()
+
+    scans = []
+    for table in _change_tracked_tables():
+        scans.append(f"""
+SELECT CAST(t.Connect_ID AS STRING) AS Connect_ID
+FROM {tables[table]} t
+WHERE {since[table]} IS NULL
+    OR {_changed_at_expression(table, 't')} > {since[table]}""".strip())
+    return "\nUNION DISTINCT\n".join(scans)
+
+
+def compile_high_water_marks_query(tables=None):
+    """
+    Compile a query returning the latest change timestamp of every source table
+
+    Returns:
+        SQL string returning one (source_name, high_water_mark) row per table
+    """
+    if tables is None:
+        tables = source_tables()
+
+    scans = []
+    for table in _change_tracked_tables():
+        scans.append(f"""
+SELECT '{table}' AS source_name, MAX({_changed_at_expression(table, 't')}) AS high_water_mark
+FROM {tables[table]} t""".strip())
+    return "\nUNION ALL\n".join(scans)
+
+
+def registry_hash(sources=None, tables=None):
+    """Hash the registry, table mapping and compiler version"""
+    if sources is None:
+        sources = address_registry.ADDRESS_SOURCES
+    if tables is None:
+        tables = source_tables()
+
+    payload = json.dumps({
+        "compiler_version": COMPILER_VERSION,
+        "address_fields": ADDRESS_FIELDS,
+        "filters": address_registry.FILTERS,
+        "history_timestamp": address_registry.USER_PROFILE_HISTORY_TIMESTAMP,
+        "change_timestamps": address_registry.CHANGE_TIMESTAMP_COLUMNS,
+        "sources": sources,
+        "tables": tables,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_address_query(sources=None, tables=None):
+    """
+    Return the compiled address query, reusing the cached copy if the registry is unchanged
+
+    The compiled SQL is cached in SQL_CACHE_DIR under the registry hash, so a
+    changed registry, table mapping or compiler version always recompiles.
+    """
+    key = registry_hash(sources, tables)
+    cache_path = os.path.join(constants.SQL_CACHE_DIR, f"address_query_{key[:16]}.sql")
+
+    if os.path.exists(cache_path):
+        logger.info(f"Using cached address query {cache_path}")
+        with open(cache_path, 'r') as f:
+            return f.read()
+
+    query = compile_address_query(sources, tables)
+
+    os.makedirs(constants.SQL_CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first so a crash never leaves a truncated query in the cache
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(query)
+    os.replace(temp_path, cache_path)
+    logger.info(f"Compiled address query cached to {cache_path}")
+    return query
@@ -0,0 +1,121 @@
+# Source watermark bookkeeping
+#
+# The watermark table holds one row per source table: the high water mark of
+# the source changes covered by a completed delivery, and the mark staged for
+# the running delivery (see address_processing.stage_watermarks). Committing a
+# delivery advances the staged marks and records the marks they advanced from
+# in the watermark history table, so deleting the delivery can roll them back.
+#
+# Only the BigQuery backend tracks watermarks, but the statements below only
+# use SQL both BigQuery and DuckDB understand, so the tests run them on DuckDB.
+# The delivery ID is passed as a query parameter, named by delivery_id_param
+# in the backend's syntax (@delivery_id for BigQuery, $delivery_id for DuckDB).
+
+
+def create_table_statements(watermark_table, history_table):
+    """Statements creating the watermark and watermark history tables if they don't exist"""
+    return [
+        f"""
+    CREATE TABLE IF NOT EXISTS {watermark_table} (
+        source_name STRING,
+        high_water_mark TIMESTAMP,  -- Latest source change covered by a completed delivery
+        pending_high_water_mark TIMESTAMP,  -- Watermark the running delivery will commit
+        pending_delivery_id STRING,
+        updated_at TIMESTAMP
+    )
+    """,
+        # The watermarks each delivery advanced from and to, so deleting a
+        # delivery can roll them back
+        f"""
+    CREATE TABLE IF NOT EXISTS {history_table} (
+        delivery_id STRING,
+        source_name STRING,
+        previous_high_water_mark TIMESTAMP,  -- Watermark before the delivery was committed
+        high_water_mark TIMESTAMP,  -- Watermark the delivery committed
+        committed_at TIMESTAMP
+    )
+    """,
+    ]
+
+
+def commit_statements(watermark_table, history_table, delivery_id_param="@delivery_id"):
+    """
+    Statements advancing the watermarks staged for a delivery
+
+    The marks they advance from are recorded in the history table first.
+
+    Args:
+        watermark_table: Watermark table
+        history_table: Watermark history table
+        delivery_id_param: Query parameter holding the delivery ID
+
+    Returns:
+        List of statements, to run in the transaction recording the delivery
+    """
+    history_query = f"""
+    INSERT INTO {history_table} (
+        delivery_id, source_name, previous_high_water_mark, high_water_mark, committed_at
+    )
+    SELECT
+        {delivery_id_param},
+        source_name,
+        high_water_mark,
+        COALESCE(pending_high_water_mark, high_water_mark),
+        CURRENT_TIMESTAMP
+    FROM {watermark_table}
+    WHERE pending_delivery_id = {delivery_id_param}
+    """
+    commit_query = f"""
+    UPDATE {watermark_table}
+    SET
+        high_water_mark = COALESCE(pending_high_water_mark, high_water_mark),
+        pending_high_water_mark = NULL,
+        pending_delivery_id = NULL,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE pending_delivery_id = {delivery_id_param}
+    """
+    return [history_query, commit_query]
+
+
+def rollback_statements(watermark_table, history_table, delivery_id_param="@delivery_id"):
+    """
+    Statements rolling back the watermarks a deleted delivery committed
+
+    Each watermark is rolled back to the mark the delivery advanced it from. A
+    later delivery may have advanced it further, so the earlier of that mark
+    and the current one is kept; a NULL mark (check every participant) wins
+    over any other. The delivery's history rows are deleted.
+
+    Args:
+        watermark_table: Watermark table
+        history_table: Watermark history table
+        delivery_id_param: Query parameter holding the delivery ID
+
+    Returns:
+        List of statements
+    """
+    rollback_query = f"""
+    UPDATE {watermark_table} w
+    SET
+        high_water_mark = IF(
+            h.restores_null OR w.high_water_mark IS NULL,
+            NULL,
+            LEAST(w.high_water_mark, h.previous_high_water_mark)
+        ),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT
+            source_name,
+            COUNTIF(previous_high_water_mark IS NULL) > 0 AS restores_null,
+            MIN(previous_high_water_mark) AS previous_high_water_mark
+        FROM {history_table}
+        WHERE delivery_id = {delivery_id_param}
+        GROUP BY source_name
+    ) h
+    WHERE w.source_name = h.source_name
+    """
+    history_delete_query = f"""
+    DELETE FROM {history_table}
+    WHERE delivery_id = {delivery_id_param}
+    """
+    return [rollback_query, history_delete_query]
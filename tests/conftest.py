@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The pipeline modules import each other by name, as they do when run from core/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'core'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import constants
+import synthetic_cohort
+
+
+@pytest.fixture
+def local_pipeline(tmp_path, monkeypatch):
+    """Configure the local backend over a synthetic cohort in tmp_path"""
+    snapshot_dir = tmp_path / "snapshots"
+    synthetic_cohort.generate_cohort(300, str(snapshot_dir), seed=4)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(constants, "BACKEND", "duckdb")
+    monkeypatch.setattr(constants, "DUCKDB_DATABASE", str(tmp_path / "geocoding.duckdb"))
+    monkeypatch.setattr(constants, "LOCAL_SNAPSHOT_DIR", str(snapshot_dir))
+    monkeypatch.setattr(constants, "HASH_INDEX_DIR", None)
+    monkeypatch.setattr(constants, "LOCAL_EXPORT_DIR", str(tmp_path / "exports"))
+    monkeypatch.setattr(constants, "LOCAL_EXPORT_FORMAT", "csv")
+    monkeypatch.setattr(constants, "LOCAL_EXPORT_WORKERS", 1)
+    monkeypatch.setattr(constants, "RUN_REPORT_DIR", str(tmp_path / "run_reports"))
+    monkeypatch.setattr(constants, "SQL_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path
@@ -0,0 +1,244 @@
+"""
+Parity of the address query compiled from the registry with the legacy
+hand-written queries in sql/, run on the same data through DuckDB.
+
+The legacy queries are BigQuery SQL; legacy_duckdb_query() translates the few
+constructs DuckDB does not understand. Rows are compared as multisets on the
+output columns, without ts_address_delivered (the current time in both).
+The user profile queries also run on a synthetic cohort (see
+benchmarks/synthetic_cohort.py).
+"""
+import os
+import re
+import random
+from collections import Counter
+
+import duckdb
+import pyarrow as pa
+import pytest
+
+import constants
+import sql_compiler
+import address_registry
+import synthetic_cohort
+from address_registry import ADDRESS_FIELDS
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), constants.SQL_DIR)
+
+COMPARED_COLUMNS = [
+    "Connect_ID",
+    "ts_user_profile_updated",
+    "address_src_question_cid",
+    "address_nickname",
+    "address_source",
+    "historical_order",
+] + ADDRESS_FIELDS
+
+TABLES = {"module4": "module4", "participants": "participants"}
+
+VERIFIED = 197316935
+NO_DESTRUCTION = 104430631
+MODULE4_COMPLETE = 231311385
+
+MODULE4_SOURCES = [source for source in address_registry.ADDRESS_SOURCES if source["table"] == "module4"]
+PROFILE_SOURCES = [source for source in address_registry.ADDRESS_SOURCES if source["table"] == "participants"]
+
+
+def legacy_duckdb_query(file_name):
+    """Read a legacy query from sql/ and translate it to DuckDB"""
+    with open(os.path.join(SQL_DIR, file_name)) as f:
+        query = f.read()
+    query = query.replace('@flat_module4', TABLES["module4"])
+    query = query.replace('@raw_participants', TABLES["participants"])
+    query = query.replace('CURRENT_TIMESTAMP()', 'CURRENT_TIMESTAMP')
+    # The user profile queries name the cross street columns cross_street1/cross_street2
+    query = re.sub(r"\bAS cross_street(\d)\b", r"AS cross_street_\1", query)
+    # DuckDB has no UNNEST ... WITH OFFSET; pair each element with its 0-based subscript
+    query = re.sub(
+        r"FROM\s+(\w+),\s*UNNEST\((\w+)\) AS (\w+) WITH OFFSET AS (\w+)",
+        r"FROM (SELECT *, UNNEST(\2) AS \3, generate_subscripts(\2, 1) - 1 AS \4 FROM \1)",
+        query,
+    )
+    return query.strip().rstrip(';')
+
+
+def compiled_duckdb_query(sources):
+    return sql_compiler.compile_address_query(sources, tables=TABLES, dialect="duckdb")
+
+
+def legacy_duckdb_queries(file_names):
+    return "\nUNION ALL\n".join(legacy_duckdb_query(file_name) for file_name in file_names)
+
+
+def rows(client, query):
+    """Multiset of the compared columns of a query's rows"""
+    columns_sql = ", ".join(COMPARED_COLUMNS)
+    return Counter(client.execute(f"SELECT {columns_sql} FROM ({query}) q").fetchall())
+
+
+def _module4_columns():
+    columns = []
+    for slot in address_registry.MODULE4_ADDRESS_SLOTS:
+        for value in slot["fields"].values():
+            for column in [value] if isinstance(value, str) else value:
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+
+def _participant(connect_id, verified=True, destruction=False, module4_complete=True):
+    return {
+        "Connect_ID": connect_id,
+        "d_821247024": VERIFIED if verified else 875007964,
+        "d_831041022": 353358909 if destruction else NO_DESTRUCTION,
+        "d_663265240": MODULE4_COMPLETE if module4_complete else 972455046,
+    }
+
+
+@pytest.fixture
+def module4_client():
+    """DuckDB connection holding module 4 answers that exercise every slot"""
+    columns = _module4_columns()
+    rng = random.Random(4)
+    participants, module4 = [], []
+
+    def answer(connect_id, values):
+        row = {column: None for column in columns}
+        row.update(values)
+        row["Connect_ID"] = connect_id
+        module4.append(row)
+
+    # Every one of the 25 slots answered, with the US columns
+    participants.append(_participant("1"))
+    answer("1", {column: f"{column}-value" for column in columns})
+
+    # No slot answered, and slots answered with empty strings only
+    participants.append(_participant("2"))
+    answer("2", {})
+    participants.append(_participant("3"))
+    answer("3", {column: "" for column in columns})
+
+    # Non-US fallback columns only, a cross street only, and an empty US
+    # column in front of a filled non-US one
+    participants.append(_participant("4"))
+    fallback, cross_street, empty_us = address_registry.MODULE4_ADDRESS_SLOTS[:3]
+    values = {columns_[-1]: "fallback" for columns_ in fallback["fields"].values() if isinstance(columns_, list)}
+    values[cross_street["fields"]["cross_street_1"]] = "Cross St"
+    values[empty_us["fields"]["city"][0]] = ""
+    values[empty_us["fields"]["city"][1]] = "Non-US City"
+    answer("4", values)
+
+    # Two module 4 rows of one participant
+    participants.append(_participant("5"))
+    answer("5", {columns[0]: "12"})
+    answer("5", {columns[0]: "12"})
+
+    # Ineligible participants, and answers without a participant
+    participants.append(_participant("6", verified=False))
+    answer("6", {column: "x" for column in columns})
+    participants.append(_participant("7", destruction=True))
+    answer("7", {column: "x" for column in columns})
+    participants.append(_participant("8", module4_complete=False))
+    answer("8", {column: "x" for column in columns})
+    answer("9", {column: "x" for column in columns})
+
+    # Random mixes of values, NULLs and empty strings
+    for connect_id in range(100, 200):
+        participants.append(_participant(str(connect_id)))
+        answer(str(connect_id), {
+            column: rng.choice(["a", "b", "", None, None, None]) for column in columns
+        })
+
+    client = duckdb.connect()
+    participants_table = pa.Table.from_pylist(participants)
+    module4_table = pa.Table.from_pylist(
+        module4, schema=pa.schema([("Connect_ID", pa.string())] + [(column, pa.string()) for column in columns])
+    )
+    client.register("participants_rows", participants_table)
+    client.register("module4_rows", module4_table)
+    client.execute("CREATE TABLE participants AS SELECT * FROM participants_rows")
+    client.execute("CREATE TABLE module4 AS SELECT * FROM module4_rows")
+    yield client
+    client.close()
+
+
+def test_module4_parity(module4_client):
+    legacy = rows(module4_client, legacy_duckdb_query(constants.ADDRESS_QUERY_SQL))
+    compiled = rows(module4_client, compiled_duckdb_query(MODULE4_SOURCES))
+
+    assert compiled == legacy
+    # The data reaches every slot, so the comparison covers all of them
+    nicknames = {row[COMPARED_COLUMNS.index("address_nickname")] for row in legacy}
+    assert nicknames == {slot["nickname"] for slot in address_registry.MODULE4_ADDRESS_SLOTS}
+    assert len(address_registry.MODULE4_ADDRESS_SLOTS) == 25
+
+
+def test_module4_parity_skips_unanswered_slots(module4_client):
+    compiled = rows(module4_client, compiled_duckdb_query(MODULE4_SOURCES))
+    connect_ids = {row[0] for row in compiled}
+
+    assert "1" in connect_ids
+    assert not connect_ids & {"2", "3", "6", "7", "8", "9"}
+    # Both module 4 rows of participant 5 come through
+    assert sum(count for row, count in compiled.items() if row[0] == "5") == 2
+
+
+@pytest.fixture
+def cohort_client(tmp_path):
+    """DuckDB connection holding a synthetic cohort and user profiles with empty fields"""
+    synthetic_cohort.generate_cohort(500, str(tmp_path), seed=21)
+
+    profile_columns = [column for column in synthetic_cohort.PROFILE_COLUMNS
+                       if column != synthetic_cohort.HISTORY_TIMESTAMP]
+    physical = address_registry.USER_PROFILE_ADDRESSES[0]["fields"]
+    empty = {column: "" for column in profile_columns}
+    edge_cases = [
+        # Empty strings everywhere, and no history
+        dict(empty, Connect_ID="900000001", **{address_registry.USER_PROFILE_HISTORY_ARRAY: None}),
+        # An empty history array, and history entries without any address
+        dict(Connect_ID="900000002", **{
+            physical["city"]: "Fargo",
+            address_registry.USER_PROFILE_HISTORY_ARRAY: [],
+        }),
+        dict(Connect_ID="900000003", **{address_registry.USER_PROFILE_HISTORY_ARRAY: [
+            dict(empty, **{synthetic_cohort.HISTORY_TIMESTAMP: "2024-01-01T00:00:00.000Z"}),
+            {physical["zip_code"]: "58102", synthetic_cohort.HISTORY_TIMESTAMP: None},
+            {},
+        ]}),
+        # No Connect_ID
+        dict(Connect_ID=None, **{physical["city"]: "Fargo"}),
+    ]
+    for row in edge_cases:
+        row.update({"d_821247024": VERIFIED, "d_831041022": NO_DESTRUCTION, "d_663265240": MODULE4_COMPLETE})
+    edge_table = pa.Table.from_pylist(edge_cases, schema=synthetic_cohort.PARTICIPANTS_SCHEMA)
+
+    client = duckdb.connect()
+    client.register("edge_cases", edge_table)
+    participants_path = tmp_path / "participants.parquet"
+    module4_path = tmp_path / "module4_v1_JP.parquet"
+    client.execute(f"""
+    CREATE TABLE participants AS
+    SELECT * FROM read_parquet('{participants_path}')
+    UNION ALL BY NAME
+    SELECT * FROM edge_cases""")
+    client.execute(f"CREATE TABLE module4 AS SELECT * FROM read_parquet('{module4_path}')")
+    yield client
+    client.close()
+
+
+def test_user_profile_parity(cohort_client):
+    legacy = rows(cohort_client, legacy_duckdb_query(constants.USER_PROFILE_QUERY_SQL))
+    compiled = rows(cohort_client, compiled_duckdb_query(PROFILE_SOURCES))
+
+    assert compiled == legacy
+    # Current (0) and historical (1-based) addresses are both compared
+    orders = {row[COMPARED_COLUMNS.index("historical_order")] for row in legacy}
+    assert 0 in orders and 1 in orders
+
+
+def test_address_query_parity(cohort_client):
+    legacy = rows(cohort_client, legacy_duckdb_queries([constants.ADDRESS_QUERY_SQL, constants.USER_PROFILE_QUERY_SQL]))
+    compiled = rows(cohort_client, compiled_duckdb_query(address_registry.ADDRESS_SOURCES))
+
+    assert compiled == legacy
+    assert {row[COMPARED_COLUMNS.index("address_source")] for row in legacy} == {"module4", "user_profile"}
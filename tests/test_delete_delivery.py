@@ -0,0 +1,63 @@
+"""
+Deleting a delivery on the local backend, then rerunning the pipeline
+"""
+import pytest
+
+import main
+import duckdb_backend
+from instrumentation import DeliveryCompletedError
+from duckdb_backend import METADATA_TABLE, COMPREHENSIVE_TABLE
+
+
+def delivered(client, table):
+    return sorted(client.execute(f"SELECT address_fingerprint FROM {table}").fetchall())
+
+
+def test_deleted_delivery_is_redelivered(local_pipeline):
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    first = delivered(client, METADATA_TABLE)
+    assert first
+
+    # The delivery succeeded, so a rerun on the same day does nothing, and a
+    # rerun of the delivery by ID is refused
+    main.main(client=client)
+    assert delivered(client, METADATA_TABLE) == first
+    (delivery_id,), = client.execute(f"SELECT DISTINCT delivery_id FROM {METADATA_TABLE}").fetchall()
+    with pytest.raises(DeliveryCompletedError):
+        main.main(client=client, delivery_id=delivery_id)
+    assert delivered(client, METADATA_TABLE) == first
+
+    duckdb_backend.delete_delivery(client, delivery_id)
+    assert delivered(client, METADATA_TABLE) == []
+    assert delivered(client, COMPREHENSIVE_TABLE) == []
+
+    # The deleted addresses are delivered again
+    main.main(client=client)
+    assert delivered(client, METADATA_TABLE) == first
+    assert delivered(client, COMPREHENSIVE_TABLE) == first
+
+
+def failing(name):
+    """Pipeline step named name that fails (steps are recorded by name)"""
+    def step(*args, **kwargs):
+        raise RuntimeError(f"{name} failed")
+    step.__name__ = name
+    return step
+
+
+def test_failed_run_resumes(local_pipeline, monkeypatch):
+    client = duckdb_backend.connect()
+    export_addresses = duckdb_backend.export_addresses
+    monkeypatch.setattr(duckdb_backend, "export_addresses", failing("export_addresses"))
+    with pytest.raises(RuntimeError, match="export_addresses failed"):
+        main.main(client=client)
+    first = delivered(client, METADATA_TABLE)
+    assert first
+
+    # The rerun only exports: the recorded delivery is not identified again
+    monkeypatch.setattr(duckdb_backend, "export_addresses", export_addresses)
+    monkeypatch.setattr(duckdb_backend, "deliver_new_addresses", failing("deliver_new_addresses"))
+    main.main(client=client)
+    assert delivered(client, METADATA_TABLE) == first
+    assert list((local_pipeline / "exports").glob("*index*"))
@@ -0,0 +1,27 @@
+"""
+Exporting a delivery again from the command line, on the local backend
+"""
+import json
+
+import pytest
+
+import main
+import duckdb_backend
+
+
+def test_export_command_exports_only_the_current_delivery(local_pipeline, monkeypatch):
+    client = duckdb_backend.connect()
+    monkeypatch.setattr(main, "_shared_client", client)
+    main.main(client=client)
+    delivery_id = duckdb_backend.current_delivery_id(client)
+    assert delivery_id
+
+    export_dir = local_pipeline / "reexport"
+    args = main.parse_args(["--backend", "duckdb", "export", delivery_id, "--local-dir", str(export_dir)])
+    args.command(args)
+    (index_path,) = export_dir.glob("*index*")
+    assert json.loads(index_path.read_text())["delivery_id"] == delivery_id
+
+    args = main.parse_args(["--backend", "duckdb", "export", "DELIVERY_20000101", "--local-dir", str(export_dir)])
+    with pytest.raises(ValueError, match="Only the current delivery"):
+        args.command(args)
@@ -0,0 +1,38 @@
+"""
+Re-mapping addresses delivered with an older fingerprint version, on the local backend
+"""
+import fingerprint
+import hash_index
+import main
+import duckdb_backend
+from duckdb_backend import METADATA_TABLE
+
+
+def metadata(client):
+    return sorted(client.execute(f"""
+    SELECT address_hash, address_fingerprint, fingerprint_version FROM {METADATA_TABLE}
+    """).fetchall())
+
+
+def test_addresses_delivered_with_an_older_version_are_not_delivered_again(local_pipeline):
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    delivered = metadata(client)
+    assert delivered
+    assert {version for _, _, version in delivered} == {fingerprint.FINGERPRINT_VERSION}
+
+    # As if the delivery was fingerprinted by the previous version: its
+    # fingerprints no longer match the addresses, and so neither does the index
+    client.execute(f"""
+    UPDATE {METADATA_TABLE}
+    SET address_fingerprint = -address_fingerprint, fingerprint_version = {fingerprint.FINGERPRINT_VERSION - 1}
+    """)
+    hash_index.HashIndex(duckdb_backend._hash_index_dir()).clear()
+
+    # The next delivery maps them back through their legacy address_hash
+    # before identifying new addresses, so it delivers nothing
+    main.main(client=client, delivery_id="DELIVERY_20991231")
+    assert metadata(client) == delivered
+    index = hash_index.HashIndex(duckdb_backend._hash_index_dir())
+    assert index.fingerprint_version == fingerprint.FINGERPRINT_VERSION
+    assert index.contains([address_fingerprint for _, address_fingerprint, _ in delivered]).all()
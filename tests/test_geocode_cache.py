@@ -0,0 +1,109 @@
+"""
+Ingesting returned geocodes and resolving new addresses from the geocode cache, on the local backend
+"""
+import csv
+
+import pytest
+
+import fingerprint
+import main
+import duckdb_backend
+from address_registry import ADDRESS_FIELDS
+from duckdb_backend import ADDRESSES_TABLE, GEOCODE_CACHE_TABLE, LOCATION_MAP_TABLE, METADATA_TABLE
+
+
+def delivered_locations(client):
+    """Location key of each delivered address fingerprint"""
+    rows = client.execute(f"""
+    SELECT a.address_fingerprint, {', '.join(f'a.{field}' for field in ADDRESS_FIELDS)}
+    FROM {ADDRESSES_TABLE} a
+    SEMI JOIN {METADATA_TABLE} m ON m.address_fingerprint = a.address_fingerprint
+    """).fetchall()
+    return {
+        address_fingerprint: fingerprint.location_key(dict(zip(ADDRESS_FIELDS, values)))
+        for address_fingerprint, *values in rows
+    }
+
+
+def write_results(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def delivered_client(local_pipeline):
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    return client
+
+
+def test_ingest_keeps_the_best_match(delivered_client, tmp_path):
+    keys = sorted(set(delivered_locations(delivered_client).values()))[:3]
+    first = write_results(tmp_path / "first.csv", [
+        {"location_key": key, "latitude": 40.0, "longitude": -75.0, "match_score": 80} for key in keys
+    ] + [
+        # Rows without coordinates are not cached
+        {"location_key": 1, "latitude": "", "longitude": -75.0, "match_score": 100},
+    ])
+    assert duckdb_backend.ingest_geocodes(delivered_client, [first]) == 3
+
+    # A later file replaces the geocode of a location, keeping its best match
+    second = write_results(tmp_path / "second.csv", [
+        {"location_key": keys[0], "latitude": 41.0, "longitude": -76.0, "match_score": 95},
+        {"location_key": keys[0], "latitude": 42.0, "longitude": -77.0, "match_score": 60},
+    ])
+    assert duckdb_backend.ingest_geocodes(delivered_client, [second]) == 1
+    cached = dict(delivered_client.execute(f"SELECT location_key, latitude FROM {GEOCODE_CACHE_TABLE}").fetchall())
+    assert cached == {keys[0]: 41.0, keys[1]: 40.0, keys[2]: 40.0}
+
+
+def test_results_without_location_keys_are_keyed_by_address(delivered_client, tmp_path):
+    values = delivered_client.execute(f"""
+    SELECT {', '.join(ADDRESS_FIELDS)} FROM {ADDRESSES_TABLE}
+    SEMI JOIN {METADATA_TABLE} USING (address_fingerprint)
+    LIMIT 1
+    """).fetchone()
+    address = dict(zip(ADDRESS_FIELDS, values))
+    path = write_results(tmp_path / "results.csv", [
+        {**{field: value or "" for field, value in address.items()}, "latitude": 40.0, "longitude": -75.0},
+    ])
+    assert duckdb_backend.ingest_geocodes(delivered_client, [path]) == 1
+    (location_key,), = delivered_client.execute(f"SELECT location_key FROM {GEOCODE_CACHE_TABLE}").fetchall()
+    assert location_key == fingerprint.location_key(address)
+
+
+def test_cached_locations_are_not_delivered_again(delivered_client, tmp_path):
+    delivery_id = duckdb_backend.current_delivery_id(delivered_client)
+    locations = delivered_locations(delivered_client)
+    cached_keys = sorted(set(locations.values()))[::2]
+    path = write_results(tmp_path / "results.csv", [
+        {"location_key": key, "latitude": 40.0, "longitude": -75.0, "match_score": 90} for key in cached_keys
+    ])
+    duckdb_backend.ingest_geocodes(delivered_client, [path])
+
+    # Once the delivery is deleted its addresses are new again, and those at a
+    # cached location are resolved from the cache instead of being delivered
+    duckdb_backend.delete_delivery(delivered_client, delivery_id)
+    main.main(client=delivered_client)
+    redelivery_id = duckdb_backend.current_delivery_id(delivered_client)
+
+    resolved = dict(delivered_client.execute(f"""
+    SELECT address_fingerprint, location_key FROM {LOCATION_MAP_TABLE}
+    WHERE delivery_id = $delivery_id AND resolution = 'cache'
+    """, {"delivery_id": redelivery_id}).fetchall())
+    redelivered = {row[0] for row in delivered_client.execute(
+        f"SELECT address_fingerprint FROM {METADATA_TABLE} WHERE delivery_id = $delivery_id",
+        {"delivery_id": redelivery_id},
+    ).fetchall()}
+    cached = set(cached_keys)
+    assert resolved == {
+        address_fingerprint: location_key
+        for address_fingerprint, location_key in locations.items() if location_key in cached
+    }
+    assert redelivered == {
+        address_fingerprint
+        for address_fingerprint, location_key in locations.items() if location_key not in cached
+    }
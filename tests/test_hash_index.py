@@ -0,0 +1,122 @@
+"""
+On-disk index of delivered fingerprints of hash_index.py
+"""
+import numpy as np
+import pytest
+
+import main
+import hash_index
+import duckdb_backend
+from hash_index import HashIndex
+
+
+@pytest.fixture
+def small_index(tmp_path, monkeypatch):
+    """An index whose Bloom filter and merge chunks are small enough to outgrow in a test"""
+    monkeypatch.setattr(hash_index, "MIN_BLOOM_CAPACITY", 64)
+    monkeypatch.setattr(hash_index, "CHUNK_SIZE", 7)
+    return HashIndex(str(tmp_path / "index"))
+
+
+def fingerprints(count, seed):
+    return np.random.default_rng(seed).integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max,
+                                                size=count, dtype=np.int64)
+
+
+def test_contains_after_merges_and_bloom_rebuilds(small_index):
+    added = []
+    for batch in range(12):
+        values = fingerprints(40, seed=batch)
+        small_index.add(values, [f"DELIVERY_{batch}"], 4)
+        added.append(values)
+        assert small_index.contains(np.concatenate(added)).all()
+
+    # 480 fingerprints outgrew the Bloom filter capacity of 64 several times,
+    # and pairs of segments were merged into O(log n) segments
+    assert small_index.count == 480
+    assert small_index.bloom_capacity >= small_index.count
+    assert len(small_index.segments) < 12
+    for segment in small_index.segments:
+        assert (np.diff(segment) > 0).all()
+    assert sorted(np.concatenate(small_index.segments).tolist()) == sorted(np.concatenate(added).tolist())
+
+    assert not small_index.contains(fingerprints(1000, seed=99)).any()
+
+
+def test_merge_segments_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(hash_index, "CHUNK_SIZE", 3)
+    values = np.sort(fingerprints(50, seed=1))
+    older, newer = values[::3], np.setdiff1d(values, values[::3])
+    merged = hash_index._merge_segments(older, newer, str(tmp_path / "merged.npy"))
+    assert merged.tolist() == values.tolist()
+
+
+def test_contains_after_reopening(small_index):
+    values = fingerprints(100, seed=1)
+    small_index.add(values[:50], ["DELIVERY_1"], 4)
+    small_index.add(values[50:], ["DELIVERY_2"], 4)
+
+    reopened = HashIndex(small_index.directory)
+    assert reopened.contains(values).all()
+    assert reopened.count == 100
+    assert reopened.deliveries == {"DELIVERY_1", "DELIVERY_2"}
+    assert reopened.fingerprint_version == 4
+
+    # Adding to the reopened index keeps the earlier fingerprints
+    more = fingerprints(100, seed=2)
+    reopened.add(more, ["DELIVERY_3"], 4)
+    assert HashIndex(small_index.directory).contains(np.concatenate([values, more])).all()
+
+
+def test_contains_after_rebuild(small_index):
+    small_index.add(fingerprints(30, seed=1), ["DELIVERY_1"], 3)
+    values = np.unique(fingerprints(200, seed=2))
+    small_index.rebuild([values[:70], values[70:]], len(values), ["DELIVERY_2"], 4)
+
+    assert small_index.contains(values).all()
+    assert not small_index.contains(np.setdiff1d(fingerprints(30, seed=1), values)).any()
+    assert small_index.deliveries == {"DELIVERY_2"}
+    assert HashIndex(small_index.directory).contains(values).all()
+
+
+def test_rebuild_checks_the_count(small_index):
+    with pytest.raises(ValueError, match="Expected 3 fingerprints"):
+        small_index.rebuild([np.array([1, 2], dtype=np.int64)], 3, [], 4)
+
+
+def test_contains_fingerprints_without_high_bits(small_index):
+    # Every double hash of a fingerprint whose high 32 bits are zero lands on
+    # the same Bloom filter bit
+    values = np.arange(0, 300, 3, dtype=np.int64)
+    small_index.add(values, ["DELIVERY_1"], 4)
+    assert small_index.contains(values).all()
+    assert not small_index.contains(values + 1).any()
+    assert HashIndex(small_index.directory).contains(values).all()
+
+
+def test_clear(small_index):
+    small_index.add(fingerprints(10, seed=1), ["DELIVERY_1"], 4)
+    small_index.clear()
+    assert small_index.count == 0
+    assert small_index.deliveries == set()
+    assert not HashIndex(small_index.directory).contains(fingerprints(10, seed=1)).any()
+
+
+def test_failed_index_update_rebuilds_the_index(local_pipeline, monkeypatch):
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    (delivery_id,), = client.execute(f"SELECT DISTINCT delivery_id FROM {duckdb_backend.METADATA_TABLE}").fetchall()
+    delivered = client.execute(f"SELECT address_fingerprint FROM {duckdb_backend.METADATA_TABLE}").fetchnumpy()
+    assert HashIndex(duckdb_backend._hash_index_dir()).deliveries == {delivery_id}
+
+    # A failed update clears the index rather than leaving a listed delivery incomplete
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    with monkeypatch.context() as patch:
+        patch.setattr(HashIndex, "add", fail)
+        duckdb_backend._index_delivery(client, delivery_id)
+    assert HashIndex(duckdb_backend._hash_index_dir()).count == 0
+
+    index = duckdb_backend._load_hash_index(client)
+    assert index.deliveries == {delivery_id}
+    assert index.contains(delivered["address_fingerprint"]).all()
@@ -0,0 +1,134 @@
+"""
+Query budgets and estimates of instrumentation.py
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import constants
+import instrumentation
+from instrumentation import PipelineRun, BudgetExceededError
+
+TRANSACTION_SCRIPT = """
+DECLARE new_address_count INT64;
+
+BEGIN
+  BEGIN TRANSACTION;
+  -- Rerunning a delivery replaces its rows
+  DELETE FROM current_delivery WHERE TRUE;
+
+  CREATE TEMP TABLE ranked AS
+  SELECT *, ROW_NUMBER() OVER (ORDER BY id) AS row_rank FROM addresses;
+
+  -- Every pair of similar ranked addresses
+  CREATE TEMP TABLE pairs AS
+  SELECT a.id FROM ranked a JOIN ranked b ON a.id = b.id;
+
+  SET new_address_count = (SELECT COUNT(*) FROM pairs);
+  INSERT INTO current_delivery SELECT * FROM ranked WHERE id NOT IN (SELECT id FROM pairs);
+  SET new_address_count = @@row_count;
+  INSERT INTO run_state VALUES (@delivery_id, 'step', CURRENT_TIMESTAMP(), NULL);
+  COMMIT TRANSACTION;
+EXCEPTION WHEN ERROR THEN
+  ROLLBACK TRANSACTION;
+  RAISE USING MESSAGE = @@error.message;
+END;
+
+SELECT new_address_count;
+"""
+
+RANKED = "SELECT *, ROW_NUMBER() OVER (ORDER BY id) AS row_rank FROM addresses"
+PAIRS = f"SELECT a.id FROM ({RANKED}) a JOIN ({RANKED}) b ON a.id = b.id"
+
+
+def test_estimable_statements_inline_temp_tables():
+    assert instrumentation._estimable_statements(TRANSACTION_SCRIPT) == [
+        "DELETE FROM current_delivery WHERE TRUE",
+        RANKED,
+        PAIRS,
+        f"SELECT COUNT(*) FROM ({PAIRS})",
+        f"INSERT INTO current_delivery SELECT * FROM ({RANKED}) WHERE id NOT IN (SELECT id FROM ({PAIRS}))",
+    ]
+
+
+# The copy script of address_processing.migrate_delivery_tables
+MIGRATION_SCRIPT = """
+ALTER TABLE `project.geocoding.delivery_metadata` ADD COLUMN delivery_date TIMESTAMP;
+
+CREATE OR REPLACE TABLE `project.geocoding.delivery_metadata_partitioned`
+PARTITION BY DATE(delivery_date)
+CLUSTER BY address_fingerprint, Connect_ID
+AS
+SELECT * FROM `project.geocoding.delivery_metadata`;
+
+ASSERT (SELECT COUNT(*) FROM `project.geocoding.delivery_metadata_partitioned`) = (SELECT COUNT(*) FROM `project.geocoding.delivery_metadata`)
+    AS 'The partitioned copy of `project.geocoding.delivery_metadata` does not hold all its rows; the table was left as it is';
+"""
+
+
+def test_estimable_statements_inline_permanent_tables_and_skip_asserts():
+    assert instrumentation._estimable_statements(MIGRATION_SCRIPT) == [
+        "SELECT * FROM `project.geocoding.delivery_metadata`",
+    ]
+    script = MIGRATION_SCRIPT + "SELECT COUNT(*) FROM `project.geocoding.delivery_metadata_partitioned`;\n"
+    assert instrumentation._estimable_statements(script)[-1] == (
+        "SELECT COUNT(*) FROM (SELECT * FROM `project.geocoding.delivery_metadata`)"
+    )
+
+
+def test_estimable_statements_of_a_single_query():
+    assert instrumentation._estimable_statements("SELECT * FROM addresses\n") == ["SELECT * FROM addresses"]
+
+
+@pytest.fixture
+def budgets(monkeypatch):
+    monkeypatch.setattr(constants, "STEP_BYTES_BILLED_BUDGET", 100)
+    monkeypatch.setattr(constants, "STEP_BYTES_BILLED_BUDGETS", {})
+    monkeypatch.setattr(constants, "RUN_BYTES_BILLED_BUDGET", 150)
+
+
+def test_budget_caps_queries_at_the_bytes_left(budgets):
+    run = PipelineRun("DELIVERY_20260101", "bigquery")
+
+    # A query may bill what its step and the run have left before it starts
+    assert run.check_budget("refresh", 60) == 100
+    with pytest.raises(BudgetExceededError):
+        run.check_budget("refresh", 50)
+    # A query only estimated counts against no budget
+    assert run.check_budget("deliver", 90, executed=False) == 90
+    assert run.check_budget("deliver", 90) == 90
+
+
+def test_budget_refuses_queries_without_an_estimate(budgets, monkeypatch):
+    run = PipelineRun("DELIVERY_20260101", "bigquery")
+    with pytest.raises(BudgetExceededError, match="could not be estimated"):
+        run.check_budget("deliver", None)
+    # Asking for an estimate that fails is not running a query
+    assert run.check_budget("deliver", None, executed=False) == 100
+
+    # A plan warns instead, and without budgets nothing is checked
+    assert PipelineRun("DELIVERY_20260101", "bigquery", plan=True).check_budget("deliver", None) == 100
+    monkeypatch.setattr(constants, "STEP_BYTES_BILLED_BUDGET", None)
+    monkeypatch.setattr(constants, "RUN_BYTES_BILLED_BUDGET", None)
+    assert run.check_budget("deliver", None) is None
+
+
+def _job(job_id):
+    return SimpleNamespace(job_id=job_id, statement_type="SCRIPT", state="DONE", created=None, ended=None,
+                           slot_millis=None, total_bytes_processed=None, total_bytes_billed=None,
+                           cache_hit=None, num_dml_affected_rows=None)
+
+
+def test_report_marks_unestimated_steps_unknown():
+    run = PipelineRun("DELIVERY_20260101", "bigquery", plan=True)
+    for step in ["refresh", "deliver"]:
+        with run.step(step):
+            pass
+    run.jobs = [("refresh", _job("a"), 10), ("refresh", _job("b"), 0),
+                ("deliver", _job("c"), 5), ("deliver", _job("d"), None)]
+
+    report = run.report("succeeded")
+    steps = {step["step"]: step for step in report["steps"]}
+    assert steps["refresh"]["estimated_bytes_processed"] == 10
+    assert steps["deliver"]["estimated_bytes_processed"] is None
+    assert report["estimated_bytes_processed"] is None
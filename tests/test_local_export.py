@@ -0,0 +1,61 @@
+"""
+Sharded export of a delivery on the local backend
+"""
+import hashlib
+import json
+import os
+
+import duckdb
+import pytest
+
+import constants
+import main
+import duckdb_backend
+from duckdb_backend import METADATA_TABLE
+
+
+def read_shard(path, file_format):
+    reader = "read_parquet" if file_format == "parquet" else "read_csv"
+    options = "" if file_format == "parquet" else ", all_varchar = true"
+    return duckdb.execute(f"""
+    SELECT CAST(Connect_ID AS VARCHAR), CAST(address_fingerprint AS BIGINT)
+    FROM {reader}('{path}'{options})
+    """).fetchall()
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_export_is_sharded_by_participant(local_pipeline, monkeypatch, file_format):
+    monkeypatch.setattr(constants, "LOCAL_EXPORT_FORMAT", file_format)
+    monkeypatch.setattr(constants, "EXPORT_ROWS_PER_FILE", 250)
+    monkeypatch.setattr(constants, "LOCAL_EXPORT_WORKERS", 2)
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    delivered = sorted(client.execute(f"SELECT Connect_ID, address_fingerprint FROM {METADATA_TABLE}").fetchall())
+
+    export_dir = local_pipeline / "exports"
+    index_path, = export_dir.glob("*_index.json")
+    with open(index_path) as f:
+        index = json.load(f)
+    assert index["delivery_id"] == duckdb_backend.current_delivery_id(client)
+    assert index["format"] == file_format
+    assert index["row_count"] == len(delivered)
+    assert index["shard_count"] == len(index["shards"]) == -(-len(delivered) // 250)
+
+    exported = []
+    participants = []
+    for shard in index["shards"]:
+        path = os.path.join(export_dir, shard["file"])
+        with open(path, "rb") as f:
+            assert hashlib.md5(f.read()).hexdigest() == shard["md5"]
+        assert os.path.getsize(path) == shard["size_bytes"]
+        rows = read_shard(path, file_format)
+        assert len(rows) == shard["row_count"]
+        # Each shard is sorted by participant
+        assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+        exported += rows
+        participants.append({row[0] for row in rows})
+
+    # Every delivered address is exported once, with all of a participant's
+    # addresses in the same shard
+    assert sorted(exported) == delivered
+    assert sum(len(shard) for shard in participants) == len(set().union(*participants))
@@ -0,0 +1,53 @@
+"""
+Collapsing near-duplicate addresses on the local backend
+"""
+import constants
+import main
+import duckdb_backend
+from duckdb_backend import ADDRESSES_TABLE, COLLAPSE_MAP_TABLE, METADATA_TABLE
+
+
+def fingerprints(client, table):
+    return {row[0] for row in client.execute(f"SELECT address_fingerprint FROM {table}").fetchall()}
+
+
+def collapsed(client):
+    return client.execute(f"""
+    SELECT c.similarity, m.Connect_ID = c.Connect_ID
+    FROM {COLLAPSE_MAP_TABLE} c
+    JOIN {METADATA_TABLE} m
+      ON m.delivery_id = c.delivery_id AND m.address_fingerprint = c.representative_fingerprint
+    """).fetchall()
+
+
+def test_near_duplicates_are_collapsed_into_a_delivered_address(local_pipeline, monkeypatch):
+    monkeypatch.setattr(constants, "COLLAPSE_NEAR_DUPLICATES", True)
+    monkeypatch.setattr(constants, "NEAR_DUPLICATE_SIMILARITY", 0.8)
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    first_delivery_id = duckdb_backend.current_delivery_id(client)
+
+    # Every address is either delivered or collapsed into a delivered address
+    # of the same participant, at least NEAR_DUPLICATE_SIMILARITY similar
+    delivered = fingerprints(client, METADATA_TABLE)
+    collapsed_fingerprints = fingerprints(client, COLLAPSE_MAP_TABLE)
+    # (history entries repeating an address share its fingerprint, so some
+    # collapsed rows duplicate a delivered one)
+    assert collapsed_fingerprints - delivered
+    assert delivered | collapsed_fingerprints == fingerprints(client, ADDRESSES_TABLE)
+    pairs = collapsed(client)
+    assert len(pairs) == client.execute(f"SELECT COUNT(*) FROM {COLLAPSE_MAP_TABLE}").fetchone()[0]
+    assert all(similarity >= 0.8 and same_participant for similarity, same_participant in pairs)
+
+    # Collapsed addresses count as delivered
+    main.main(client=client, delivery_id="DELIVERY_20991231")
+    assert fingerprints(client, METADATA_TABLE) == delivered
+
+    # A stricter similarity collapses fewer addresses
+    for delivery_id in ["DELIVERY_20991231", first_delivery_id]:
+        duckdb_backend.delete_delivery(client, delivery_id)
+    monkeypatch.setattr(constants, "NEAR_DUPLICATE_SIMILARITY", 1.0)
+    main.main(client=client)
+    strict_pairs = collapsed(client)
+    assert 0 < len(strict_pairs) < len(pairs)
+    assert all(similarity == 1.0 for similarity, _ in strict_pairs)
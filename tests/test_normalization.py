@@ -0,0 +1,66 @@
+"""
+Address normalization rules of normalization.py
+"""
+import pytest
+
+import normalization
+
+
+@pytest.mark.parametrize("kind, lookup", [*normalization.WORD_LOOKUPS.items(), *normalization.VALUE_LOOKUPS.items()])
+def test_lookups(kind, lookup):
+    for word, replacement in lookup.items():
+        # Lookups apply after case, punctuation and whitespace rules
+        assert normalization.normalize_value(f"  {word.lower()} ", kind) == (replacement or None)
+
+
+@pytest.mark.parametrize("value, kind, expected", [
+    # Only ASCII letters are upper-cased, as in the SQL UDFs
+    ("straße", "text", "STRAßE"),
+    ("Straße", "street", "STRAßE"),
+    ("ﬁfth avenue", "street", "ﬁFTH AVE"),
+    ("josé st.", "street", "JOSé ST"),
+    ("Ünion", "city", "ÜNION"),
+    # Punctuation
+    ("O'Neil St.", "street", "ONEIL ST"),
+    ("123 Main St., Apt 4", "street", "123 MAIN ST # 4"),
+    ('"Main"; (rear): 5', "text", "MAIN REAR 5"),
+    ("Apt #5", "street", "# 5"),
+    ("#5", "unit", "5"),
+    # Whitespace, including whitespace other than ASCII spaces
+    ("  123\tmain\n street\r\f", "street", "123 MAIN ST"),
+    ("123 Main", "text", "123 MAIN"),
+    ("   ", "text", None),
+    (".,;", "street", None),
+    # Whole-value lookups and ZIP codes
+    ("New  York", "state", "NY"),
+    ("united states of america", "country", "US"),
+    ("02134-1234", "zip", "02134"),
+    ("021341234", "zip", "02134"),
+    ("2134", "zip", "02134"),
+    ("2134-5", "zip", "2134-5"),
+    (None, "street", None),
+])
+def test_normalize_value(value, kind, expected):
+    assert normalization.normalize_value(value, kind) == expected
+
+
+def test_normalize_values_matches_normalize_value():
+    values = ["123 Main St.", None, "straße", "123 Main St."]
+    assert normalization.normalize_values(values, "street") == [
+        normalization.normalize_value(value, "street") for value in values
+    ]
+
+
+def test_sql_udfs_use_the_python_rules():
+    statements = dict(zip(normalization.KINDS, normalization.sql_udf_statements("`project`.dataset")))
+    for kind, statement in statements.items():
+        # Python and BigQuery UPPER disagree beyond ASCII, so neither is used
+        assert "UPPER(" not in statement
+        assert (f"TRANSLATE(value, '{normalization.ASCII_LOWERCASE}', "
+                f"'{normalization.ASCII_UPPERCASE}')") in statement
+        for pattern in (normalization.DROP_PATTERN, normalization.SPACE_PATTERN, normalization.WHITESPACE_PATTERN):
+            assert pattern in statement
+        lookup = {**normalization.WORD_LOOKUPS, **normalization.VALUE_LOOKUPS}.get(kind, {})
+        for word, replacement in lookup.items():
+            assert f"STRUCT({normalization._sql_string(word)} AS word, " \
+                   f"{normalization._sql_string(replacement)} AS replacement)" in statement
@@ -0,0 +1,84 @@
+"""
+Summary statistics of the local backend, rolled up from the stored
+per-delivery statistics, against the direct reporting.summary_queries
+"""
+import pytest
+
+import main
+import reporting
+import duckdb_backend
+from duckdb_backend import COMPREHENSIVE_TABLE, METADATA_TABLE
+
+OLDER_DELIVERY = "DELIVERY_20000101"
+
+
+def direct_statistics(client, delivery_id=None):
+    """Statistics from the summary queries, each scanning the delivered addresses"""
+    delivery_filter = "WHERE delivery_id = $delivery_id" if delivery_id else ""
+    parameters = {"delivery_id": delivery_id} if delivery_id else {}
+    results = {}
+    for name, query in reporting.summary_queries(COMPREHENSIVE_TABLE, delivery_filter).items():
+        cursor = client.execute(query, parameters)
+        columns = [column[0] for column in cursor.description]
+        results[name] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return reporting.build_summary_statistics(delivery_id, results)
+
+
+def comparable(stats, keys):
+    """Statistics with their lists sorted, and percentages rounded"""
+    result = {}
+    for key in keys:
+        value = stats[key]
+        if isinstance(value, list):
+            value = sorted(
+                tuple(sorted((k, round(v, 6) if isinstance(v, float) else v) for k, v in item.items()))
+                for item in value
+            )
+        elif isinstance(value, float):
+            value = round(value, 6)
+        result[key] = value
+    return result
+
+
+@pytest.fixture
+def delivered_client(local_pipeline):
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    # An older delivery holding every other participant's addresses again
+    for table in [METADATA_TABLE, COMPREHENSIVE_TABLE]:
+        client.execute(f"""
+        INSERT INTO {table}
+        SELECT * REPLACE ('{OLDER_DELIVERY}' AS delivery_id)
+        FROM {table}
+        WHERE hash(Connect_ID) % 2 = 0
+        """)
+    return client
+
+
+SINGLE_DELIVERY_KEYS = [
+    "delivery_id", "total_addresses", "total_participants", "avg_addresses_per_participant",
+    "addresses_by_nickname", "addresses_by_source", "addresses_per_participant_distribution",
+    "field_completeness",
+]
+
+
+def test_delivery_statistics(delivered_client):
+    for delivery_id in [duckdb_backend.current_delivery_id(delivered_client), OLDER_DELIVERY]:
+        stored = duckdb_backend.generate_summary_statistics(delivered_client, delivery_id)
+        assert stored["total_addresses"] > 0
+        assert comparable(stored, SINGLE_DELIVERY_KEYS) == comparable(
+            direct_statistics(delivered_client, delivery_id), SINGLE_DELIVERY_KEYS
+        )
+
+
+def test_all_deliveries_statistics(delivered_client):
+    stored = duckdb_backend.generate_summary_statistics(delivered_client)
+    # The older delivery had no statistics stored yet
+    stored_ids = {row[0] for row in delivered_client.execute(
+        f"SELECT DISTINCT delivery_id FROM {duckdb_backend.SUMMARY_STATS_TABLE}").fetchall()}
+    assert OLDER_DELIVERY in stored_ids
+
+    # Participants delivered in both deliveries are counted once, with all their addresses
+    assert comparable(stored, SINGLE_DELIVERY_KEYS) == comparable(
+        direct_statistics(delivered_client), SINGLE_DELIVERY_KEYS
+    )
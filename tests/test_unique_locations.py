@@ -0,0 +1,71 @@
+"""
+Exporting each distinct location of a delivery once, on the local backend
+"""
+import json
+
+import duckdb
+import pytest
+
+import constants
+import fingerprint
+import main
+import duckdb_backend
+from address_registry import ADDRESS_FIELDS
+from duckdb_backend import ADDRESSES_TABLE, LOCATION_MAP_TABLE, METADATA_TABLE
+
+
+@pytest.fixture
+def located_client(local_pipeline, monkeypatch):
+    monkeypatch.setattr(constants, "EXPORT_UNIQUE_LOCATIONS", True)
+    client = duckdb_backend.connect()
+    main.main(client=client)
+    return client
+
+
+def exported_locations(export_dir):
+    index_path, = export_dir.glob("norc_locations_*_index.json")
+    with open(index_path) as f:
+        index = json.load(f)
+    rows = []
+    for shard in index["shards"]:
+        cursor = duckdb.execute(f"SELECT * FROM read_csv('{export_dir / shard['file']}', all_varchar = true)")
+        columns = [column[0] for column in cursor.description]
+        rows += [dict(zip(columns, row)) for row in cursor.fetchall()]
+    assert len(rows) == index["row_count"]
+    return rows
+
+
+def test_each_location_is_exported_once(located_client, local_pipeline):
+    delivery_id = duckdb_backend.current_delivery_id(located_client)
+    locations = exported_locations(local_pipeline / "exports")
+    keys = [int(row["location_key"]) for row in locations]
+    assert len(keys) == len(set(keys))
+
+    # Every delivered address is mapped to exactly one exported location
+    mapped = located_client.execute(f"""
+    SELECT address_fingerprint, location_key FROM {LOCATION_MAP_TABLE}
+    WHERE delivery_id = $delivery_id AND resolution = 'export'
+    """, {"delivery_id": delivery_id}).fetchall()
+    delivered = located_client.execute(f"SELECT address_fingerprint FROM {METADATA_TABLE}").fetchall()
+    assert sorted(address_fingerprint for address_fingerprint, _ in mapped) == sorted(row[0] for row in delivered)
+    assert {location_key for _, location_key in mapped} == set(keys)
+
+    # Addresses sharing a location are exported once, with their counts
+    assert len(keys) < len(mapped)
+    assert sum(int(row["address_count"]) for row in locations) == len(mapped)
+
+
+def test_location_keys_match_python(located_client):
+    rows = located_client.execute(f"""
+    SELECT m.location_key, {', '.join(f'a.{field}' for field in ADDRESS_FIELDS)}
+    FROM {LOCATION_MAP_TABLE} m
+    JOIN {ADDRESSES_TABLE} a ON a.address_fingerprint = m.address_fingerprint
+    """).fetchall()
+    assert rows
+    for location_key, *values in rows:
+        assert fingerprint.location_key(dict(zip(ADDRESS_FIELDS, values))) == location_key
+
+
+def test_deleting_the_delivery_removes_its_locations(located_client):
+    duckdb_backend.delete_delivery(located_client, duckdb_backend.current_delivery_id(located_client))
+    assert located_client.execute(f"SELECT COUNT(*) FROM {LOCATION_MAP_TABLE}").fetchone()[0] == 0
@@ -0,0 +1,111 @@
+"""
+Committing and rolling back the source watermarks of watermarks.py, run on DuckDB
+"""
+import datetime
+
+import duckdb
+import pytest
+
+import watermarks
+
+DAY_1, DAY_2, DAY_3 = (datetime.datetime(2026, 1, day) for day in (1, 2, 3))
+
+
+@pytest.fixture
+def client():
+    client = duckdb.connect()
+    for statement in watermarks.create_table_statements("watermarks", "watermark_history"):
+        client.execute(statement)
+    return client
+
+
+def stage(client, delivery_id, marks):
+    """Stage marks (source name to watermark) for a delivery, as stage_watermarks does"""
+    for source_name, mark in marks.items():
+        updated = client.execute("""
+        UPDATE watermarks SET pending_high_water_mark = $mark, pending_delivery_id = $delivery_id
+        WHERE source_name = $source_name
+        RETURNING source_name
+        """, {"mark": mark, "delivery_id": delivery_id, "source_name": source_name}).fetchall()
+        if not updated:
+            client.execute("INSERT INTO watermarks VALUES ($source_name, NULL, $mark, $delivery_id, NULL)",
+                           {"mark": mark, "delivery_id": delivery_id, "source_name": source_name})
+
+
+def run(client, statements, delivery_id):
+    for statement in statements:
+        client.execute(statement, {"delivery_id": delivery_id})
+
+
+def commit(client, delivery_id, marks):
+    stage(client, delivery_id, marks)
+    run(client, watermarks.commit_statements("watermarks", "watermark_history", "$delivery_id"), delivery_id)
+
+
+def rollback(client, delivery_id):
+    run(client, watermarks.rollback_statements("watermarks", "watermark_history", "$delivery_id"), delivery_id)
+
+
+def committed(client):
+    return dict(client.execute("""
+    SELECT source_name, high_water_mark FROM watermarks
+    WHERE pending_delivery_id IS NULL AND pending_high_water_mark IS NULL
+    """).fetchall())
+
+
+def test_commit_records_the_marks_advanced_from(client):
+    commit(client, "DELIVERY_1", {"participants": DAY_1, "module4": DAY_1})
+    commit(client, "DELIVERY_2", {"participants": DAY_2})
+    assert committed(client) == {"participants": DAY_2, "module4": DAY_1}
+    assert sorted(client.execute("""
+    SELECT delivery_id, source_name, previous_high_water_mark, high_water_mark FROM watermark_history
+    """).fetchall()) == [
+        ("DELIVERY_1", "module4", None, DAY_1),
+        ("DELIVERY_1", "participants", None, DAY_1),
+        ("DELIVERY_2", "participants", DAY_1, DAY_2),
+    ]
+
+
+def test_commit_leaves_other_deliveries_pending(client):
+    stage(client, "DELIVERY_2", {"participants": DAY_2})
+    run(client, watermarks.commit_statements("watermarks", "watermark_history", "$delivery_id"), "DELIVERY_1")
+    assert client.execute("SELECT high_water_mark, pending_delivery_id FROM watermarks").fetchall() == [
+        (None, "DELIVERY_2")
+    ]
+
+
+def test_rollback_of_the_latest_delivery(client):
+    commit(client, "DELIVERY_1", {"participants": DAY_1, "module4": DAY_1})
+    commit(client, "DELIVERY_2", {"participants": DAY_2, "module4": DAY_2})
+    rollback(client, "DELIVERY_2")
+    assert committed(client) == {"participants": DAY_1, "module4": DAY_1}
+    assert client.execute("SELECT DISTINCT delivery_id FROM watermark_history").fetchall() == [("DELIVERY_1",)]
+
+
+def test_rollback_of_an_earlier_delivery_keeps_the_earlier_mark(client):
+    commit(client, "DELIVERY_1", {"participants": DAY_1})
+    commit(client, "DELIVERY_2", {"participants": DAY_2})
+    commit(client, "DELIVERY_3", {"participants": DAY_3})
+
+    # Deleting DELIVERY_2 must re-check its participants, so the watermark
+    # goes back to the mark DELIVERY_2 advanced from
+    rollback(client, "DELIVERY_2")
+    assert committed(client) == {"participants": DAY_1}
+
+    # Rolling back DELIVERY_3 afterwards does not move it forward again
+    rollback(client, "DELIVERY_3")
+    assert committed(client) == {"participants": DAY_1}
+
+
+def test_rollback_of_a_first_delivery_checks_every_participant(client):
+    commit(client, "DELIVERY_1", {"participants": DAY_1})
+    commit(client, "DELIVERY_2", {"participants": DAY_2, "module4": DAY_2})
+    rollback(client, "DELIVERY_1")
+    # participants goes back to NULL; module4 was not advanced by DELIVERY_1
+    assert committed(client) == {"participants": None, "module4": DAY_2}
+
+
+def test_rollback_of_an_unknown_delivery_changes_nothing(client):
+    commit(client, "DELIVERY_1", {"participants": DAY_1})
+    rollback(client, "DELIVERY_9")
+    assert committed(client) == {"participants": DAY_1}